@@ -1,8 +1,13 @@
 from __future__ import unicode_literals
 import math
+import os
+import sys
 from collections import namedtuple
 
-import pcbnew as pcb
+# pcbnew or its stand-in, as chosen by RATCAM_PCBNEW (see synthesize/pcbapi.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthesize'))
+from pcbapi import pcbnew as pcb
+from polar import unit_arc_table
 
 # Leds will be named LED0, LED1...
 LED_PREFIX = 'LED'
@@ -27,8 +32,10 @@ ROTATION_OFS_RAD = -math.pi / 12.
 LED_ORIENTATION_OFS_RAD = math.pi
 # Offset angle of the resistors
 RESISTOR_ORIENTATION_OFS_RAD = 0.
-# Angular resolution for synthesizing arcs
+# Angular resolution for synthesizing arcs, used only if ARC_MAX_ERROR_MM is None
 ANGULAR_RESOLUTION = math.pi / 40
+# Maximum distance in mm between an arc and the segments approximating it
+ARC_MAX_ERROR_MM = 0.025
 # True for having the power ring on F.Cu (False resp. for B.Cu)
 PWR_RING_FCU = True
 # True for having the ground ring on F.Cu (False resp. for B.Cu)
@@ -88,7 +95,12 @@ def shift_along_arc(c, pos, delta_angle):
     angle, r = to_polar(c, pos)
     return to_cartesian(c, angle + delta_angle, r)
 
-def compute_radial_segment(c, start, end=None, angle=None, steps=None, angular_resolution=None, excess_angle=0., skip_start=True):
+def arc_tessellation():
+    if ARC_MAX_ERROR_MM is None:
+        return dict(angular_resolution=ANGULAR_RESOLUTION)
+    return dict(max_error=pcb.FromMM(ARC_MAX_ERROR_MM))
+
+def compute_radial_segment(c, start, end=None, angle=None, steps=None, angular_resolution=None, max_error=None, excess_angle=0., skip_start=True):
     assert((end is None) != (angle is None))
     # Determine polar coordinates of start
     start_angle, start_r = to_polar(c, start)
@@ -105,8 +117,13 @@ def compute_radial_segment(c, start, end=None, angle=None, steps=None, angular_r
             end_angle -= 2. * math.pi
         else:
             start_angle -= 2. * math.pi
-    assert((steps is None) != (angular_resolution is None))
-    if steps is None:
+    assert([steps, angular_resolution, max_error].count(None) == 2)
+    if max_error is not None:
+        # Largest angle whose chord stays within max_error from the arc
+        r = max(start_r, end_r)
+        max_step = 2. * math.acos(1. - max_error / r) if r > max_error else 2. * math.pi
+        steps = int(math.ceil(abs(end_angle - start_angle) / max_step))
+    elif steps is None:
         steps = int(math.ceil(abs(end_angle - start_angle) / angular_resolution))
     steps = max(1, steps)
     if excess_angle != 0.:
@@ -116,12 +133,16 @@ def compute_radial_segment(c, start, end=None, angle=None, steps=None, angular_r
         else:
             start_angle += excess_angle
             end_angle -= excess_angle
-    for i in range(steps + 1):
-        frac = float(i) / float(steps)
-        angle = start_angle + frac * (end_angle - start_angle)
-        r = start_r + frac * (end_r - start_r)
-        if i > 0 or not skip_start:
-            yield to_cartesian(c, angle, r)
+    # The cos/sin of a unit arc are cached, rotate them to start_angle and scale them row by row, the radius changes
+    # along the way
+    x, xy = unit_arc_table(end_angle - start_angle, skip_start=skip_start, include_end=True, steps=steps)
+    cos_a = math.cos(start_angle)
+    sin_a = math.sin(start_angle)
+    r = start_r + x * (end_r - start_r)
+    xs = c.x + r * (xy[:, 0] * cos_a - xy[:, 1] * sin_a)
+    ys = c.y + r * (xy[:, 0] * sin_a + xy[:, 1] * cos_a)
+    for px, py in zip(xs.tolist(), ys.tolist()):
+        yield c.__class__(px, py)
 
 
 class Illuminator(object):
@@ -237,6 +258,7 @@ class Illuminator(object):
         return self.make_track_segment(start, end, net_code, layer)
 
     def _make_track_arc_internal(self, start, net_code, layer, *args, **kwargs):
+        # This script talks to the KiCad 4/5 API, which has no arc tracks: arcs go as their tessellation
         last = start
         for pt in compute_radial_segment(self.center, start, *args, **kwargs):
             self.make_track_segment(last, pt, net_code, layer)
@@ -246,12 +268,12 @@ class Illuminator(object):
     def make_track_arc_from_endpts(self, start, end, net_code, layer):
         return self._make_track_arc_internal(
             start, net_code, layer,
-            end=end, angular_resolution=ANGULAR_RESOLUTION)
+            end=end, **arc_tessellation())
 
     def make_track_arc_from_angle(self, start, angle, net_code, layer):
         return self._make_track_arc_internal(
             start, net_code, layer,
-            angle=angle, angular_resolution=ANGULAR_RESOLUTION)
+            angle=angle, **arc_tessellation())
 
     def make_track_radial_segment(self, pos, displacement, net_code, layer):
         end_pos = shift_along_radius(self.center, pos, displacement)
@@ -274,11 +296,19 @@ class Illuminator(object):
                 outline.AppendCorner(vertex.x, vertex.y)
         if getattr(outline, 'CloseLastContour', None) is not None:
             outline.CloseLastContour()
-        area.SetCornerRadius(pcbnew.FromMM(DEFAULT_TRACK_WIDTH_MM / 2.))
+        area.SetCornerRadius(pcb.FromMM(DEFAULT_TRACK_WIDTH_MM / 2.))
         area.SetCornerSmoothingType(pcb.ZONE_SETTINGS.SMOOTHING_FILLET)
-        area.BuildFilledSolidAreasPolygons(self.board)
+        # Filled by fill_areas, once they are all there
         return area
 
+    def fill_areas(self):
+        # One pass of the board wide zone filler where there is one (KiCad 5 and later), one area at a time otherwise
+        if getattr(pcb, 'ZONE_FILLER', None) is not None:
+            pcb.ZONE_FILLER(self.board).Fill(self.board.Zones())
+        else:
+            for idx in range(self.board.GetAreaCount()):
+                self.board.GetArea(idx).BuildFilledSolidAreasPolygons(self.board)
+
     def make_fill_arc(self, start, end, width, is_thermal, net_code, layer):
         # Compute the vertices
         lower_arc_start = shift_along_radius(self.center, start, -width / 2.)
@@ -286,15 +316,15 @@ class Illuminator(object):
         vertices = list(compute_radial_segment(self.center,
                 lower_arc_start,
                 shift_along_radius(self.center, end, -width / 2.),
-                angular_resolution=ANGULAR_RESOLUTION,
                 excess_angle=0.0001,
-                skip_start=False)) + \
+                skip_start=False,
+                **arc_tessellation())) + \
             list(compute_radial_segment(self.center,
                 upper_arc_start,
                 shift_along_radius(self.center, start, width / 2.),
-                angular_resolution=ANGULAR_RESOLUTION,
                 excess_angle=0.0001,
-                skip_start=False))
+                skip_start=False,
+                **arc_tessellation()))
         return self.make_fill_area(vertices, is_thermal, net_code, layer)
 
     def make_via(self, position, net_code):
@@ -432,6 +462,7 @@ class Illuminator(object):
                     LayerFCu if GND_RING_FCU else LayerBCu
                 )
         self._route_pin_and_fet()
+        self.fill_areas()
 
     def _place_pin_and_fet(self):
         self.pin = self.board.FindModule(PIN_NAME)
@@ -0,0 +1,365 @@
+from __future__ import unicode_literals, print_function
+import os
+# The benchmarks run against the pcbnew stand-in, counting the pcbnew calls for --check. Counting slows the stand-in
+# down: timings are for RATCAM_PCBNEW=fake.
+os.environ.setdefault('RATCAM_PCBNEW', 'counting')
+from collections import namedtuple
+from pcbapi import pcbnew, PCBNEW
+from pcbfile import FromPCBFile, ToPCBFile, FootprintLibrary, IU_PER_MM
+from polar import Vector, Chord, apx_crown_sector, apx_crown_sector_array, apx_crown_sector_xy_array
+import multi_ring
+import radial_illuminator
+import argparse
+import copy
+import gc
+import io
+import json
+import math
+import pickle
+import platform
+import shutil
+import sexpr
+import sys
+import tempfile
+import timeit
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+# With --check-times, a benchmark regresses when it is this much slower than its baseline. Timings are compared as
+# ratios to the reference benchmark, timed around each one, which takes out the speed of the machine but not the noise
+# of a busy one: on shared machines ratios were seen to move by up to 2.2x from run to run, so only a larger slowdown
+# stands out. --check compares the pcbnew calls instead, which do not depend on timing.
+DEFAULT_THRESHOLD = 2.5
+# From the 6x2 layout of the illuminator up to 2000 LEDs
+DEFAULT_SIZES = [(6, 2), (24, 4), (60, 10), (200, 10)]
+# Rounds are made of enough calls to last at least this long, in seconds, so that they are not just timer noise
+MIN_ROUND_TIME = 0.02
+
+# setup() returns the state passed to run(); run is timed, number times in a row, for each of repeat rounds. With number
+# None, it is chosen so that a round lasts MIN_ROUND_TIME; only for benchmarks whose run can be repeated on the same
+# state.
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'run', 'number', 'repeat'])
+
+_R_PADS = [('1', -1.35, 0., 1.5, 1.3), ('2', 1.35, 0., 1.5, 1.3)]
+_LED_PADS = [('1', -2.225, 0., 2., 0.9), ('2', 2.225, 0., 2., 0.9)]
+_J_PADS = [('1', -2.525, -2.54, 3.15, 1.), ('2', 2.525, -2.54, 3.15, 1.)]
+_Q_PADS = [('1', -1.33, -0.65, 0.45, 1.5), ('2', -1.33, 0.65, 0.45, 1.5), ('3', 1.33, 0., 0.45, 1.5)]
+
+
+def _module_text(fpid, reference, x, y, pads, net_codes, layer='F.Cu'):
+    out = ['  (module %s (layer %s) (tedit 0) (tstamp 0)\n' % (fpid, layer),
+           '    (at %g %g)\n' % (x, y),
+           '    (fp_text reference %s (at 0 0) (layer F.SilkS))\n' % sexpr.quote(reference)]
+    for name, px, py, sx, sy in pads:
+        net_code, net_name = net_codes[name]
+        out.append('    (pad %s smd rect (at %g %g) (size %g %g) (layers %s) (net %d %s))\n' %
+                   (name, px, py, sx, sy, layer, net_code, sexpr.quote(net_name)))
+    out.append('  )\n')
+    return ''.join(out)
+
+
+def synthetic_board_text(n_lines, n_leds):
+    # A .kicad_pcb with the same topology as the illuminator: n_lines resistors fed by +5V from J0, each driving a
+    # chain of n_leds LEDs that ends on the ground ring, which Q0 closes. Nothing is placed.
+    nets = ['', '+5V', 'GND']
+
+    def new_net(name):
+        nets.append(name)
+        return len(nets) - 1, name
+
+    modules = []
+    for line_idx in range(n_lines):
+        prev = new_net('Net-(R%d-Pad2)' % line_idx)
+        modules.append(_module_text('Bench:R', 'R%d' % line_idx, 100., 100., _R_PADS, {'1': (1, '+5V'), '2': prev}))
+        for led_idx in range(n_leds):
+            ref = 'LED%d' % (line_idx * n_leds + led_idx)
+            nxt = new_net('Net-(%s-Pad1)' % ref) if led_idx < n_leds - 1 else (2, 'GND')
+            modules.append(_module_text('Bench:LED', ref, 100., 100., _LED_PADS, {'1': nxt, '2': prev}))
+            prev = nxt
+    modules.append(_module_text('Bench:J', 'J0', 100., 117.78, _J_PADS, {'1': (1, '+5V'), '2': (0, '')}, 'B.Cu'))
+    modules.append(_module_text('Bench:Q', 'Q0', 108.255, 116.585, _Q_PADS,
+                                {'1': (0, ''), '2': (0, ''), '3': (2, 'GND')}, 'B.Cu'))
+    out = ['(kicad_pcb (version 20171130) (host pcbnew 5.0.0)\n',
+           '  (general (thickness 1.6))\n',
+           '  (layers\n    (0 F.Cu signal)\n    (31 B.Cu signal)\n  )\n',
+           '  (setup (last_trace_width 0.25) (zone_clearance 0.508) (via_size 0.8) (via_drill 0.4))\n']
+    out += ['  (net %d %s)\n' % (code, sexpr.quote(name)) for code, name in enumerate(nets)]
+    out += modules
+    out.append(')\n')
+    return ''.join(out)
+
+
+def scaled_overrides(n_lines, n_leds):
+    # Grow the radius with the number of components, so that they still fit around the circle; rings and pours keep
+    # their distance from it
+    radius = 25. * max(1., n_lines * (n_leds + 1) / 18.)
+    return {
+        'lines.n_lines': n_lines,
+        'lines.n_leds': n_leds,
+        'lines.radius': radius * IU_PER_MM,
+        'rings.pwr_radius': (radius + 3.) * IU_PER_MM,
+        'rings.gnd_radius': (radius - 3.) * IU_PER_MM,
+        'pours.inner_radius': (radius - 1.5) * IU_PER_MM,
+        'pours.outer_radius': (radius + 1.5) * IU_PER_MM,
+    }
+
+
+def planned_rings(n_lines, n_leds):
+    # LED rings 8mm apart from 25mm on, each line taking as much of the circumference as it does on the illuminator
+    return multi_ring.plan_rings(n_lines, n_leds, 25. * IU_PER_MM, 8. * IU_PER_MM, (n_leds + 2) * 6.5 * IU_PER_MM)
+
+
+class _Context(object):
+    # Synthetic boards in a temporary folder, and the default options to restore before every benchmark
+    def board_path(self, n_lines, n_leds):
+        path = os.path.join(self.folder, 'bench_%dx%d.kicad_pcb' % (n_lines, n_leds))
+        if not os.path.isfile(path):
+            with io.open(path, 'w', encoding='utf-8', newline='\n') as stream:
+                stream.write(synthetic_board_text(n_lines, n_leds))
+        return path
+
+    def board(self, n_lines, n_leds):
+        # A fresh cad.Board, parsed only once
+        key = (n_lines, n_leds)
+        if key not in self._boards:
+            board = FromPCBFile.populate(self.board_path(n_lines, n_leds), library=FootprintLibrary())
+            self._boards[key] = pickle.dumps(board, pickle.HIGHEST_PROTOCOL)
+        return pickle.loads(self._boards[key])
+
+    def reset_options(self):
+        radial_illuminator.OPT.clear()
+        radial_illuminator.OPT.update(copy.deepcopy(self._opt))
+
+    def options(self, n_lines, n_leds):
+        self.reset_options()
+        radial_illuminator.apply_overrides(scaled_overrides(n_lines, n_leds))
+
+    def close(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def __init__(self):
+        self.folder = tempfile.mkdtemp(prefix='ratcam_bench_')
+        self._boards = {}
+        self._opt = copy.deepcopy(radial_illuminator.OPT)
+
+
+def _stages_until(ctx, n_lines, n_leds, stage_name):
+    # A board on which every stage before stage_name has run
+    ctx.options(n_lines, n_leds)
+    board = ctx.board(n_lines, n_leds)
+    for stage in radial_illuminator.STAGES:
+        if stage.func.__name__ == stage_name:
+            break
+        stage.func(board)
+    return board
+
+
+def _stage_benchmark(ctx, n_lines, n_leds, stage):
+    # Stages replace what they produced on a previous run, so they can be timed over and over on the same board
+    return Benchmark('stage.%s[%dx%d]' % (stage.func.__name__, n_lines, n_leds),
+                     lambda: _stages_until(ctx, n_lines, n_leds, stage.func.__name__), stage.func, None, 5)
+
+
+def _main_setup(ctx, n_lines, n_leds):
+    ctx.options(n_lines, n_leds)
+    pcbnew.LoadBoard(ctx.board_path(n_lines, n_leds))
+
+
+def _multi_ring_setup(ctx, n_lines, n_leds):
+    ctx.reset_options()
+    radial_illuminator.OPT.multi_ring.rings = planned_rings(n_lines, n_leds)
+    return ctx.board(n_lines, n_leds)
+
+
+def _write_setup(ctx, n_lines, n_leds):
+    board = _stages_until(ctx, n_lines, n_leds, None)
+    return board, ctx.board_path(n_lines, n_leds), os.path.join(ctx.folder, 'out.kicad_pcb')
+
+
+def _reference(_):
+    total = 0.
+    for i in range(1000):
+        total += math.sqrt(i) * math.cos(i)
+    return total
+
+
+# Plain Python arithmetic that nothing in the scripts changes, the unit of the timings in the baseline
+REFERENCE = Benchmark('reference', None, _reference, None, 5)
+
+
+def benchmarks(ctx, sizes):
+    v = Vector(3., 4.)
+    chord = Chord(25. * IU_PER_MM, 0., 1.)
+    retval = [
+        Benchmark('polar.Vector.rotated', None, lambda _: v.rotated(0.3), None, 5),
+        Benchmark('polar.Chord.with_length', None, lambda _: chord.with_length(3. * IU_PER_MM), None, 5),
+        Benchmark('polar.apx_crown_sector', None,
+                  lambda _: list(apx_crown_sector(0., 0.5, 23.5 * IU_PER_MM, 26.5 * IU_PER_MM,
+                                                  max_error=0.025 * IU_PER_MM)), None, 5),
+        Benchmark('polar.apx_crown_sector_array', None,
+                  lambda _: apx_crown_sector_array(0., 0.5, 23.5 * IU_PER_MM, 26.5 * IU_PER_MM,
+                                                   max_error=0.025 * IU_PER_MM), None, 5),
+        Benchmark('polar.apx_crown_sector_xy_array', None,
+                  lambda _: apx_crown_sector_xy_array(0., 0.5, 23.5 * IU_PER_MM, 26.5 * IU_PER_MM,
+                                                      max_error=0.025 * IU_PER_MM), None, 5),
+        Benchmark('cad.Component.place_pads_on_circ', lambda: ctx.board(6, 2).components['LED0'],
+                  lambda comp: comp.place_pads_on_circ(1., 25. * IU_PER_MM), None, 5),
+    ]
+    for n_lines, n_leds in sizes:
+        size = '[%dx%d]' % (n_lines, n_leds)
+        retval += [_stage_benchmark(ctx, n_lines, n_leds, stage) for stage in radial_illuminator.STAGES]
+        retval += [
+            Benchmark('io.FromPCBFile.populate' + size, lambda n=n_lines, m=n_leds: ctx.board_path(n, m),
+                      lambda path: FromPCBFile.populate(path, library=FootprintLibrary()), None, 3),
+            Benchmark('io.ToPCBFile.write' + size, lambda n=n_lines, m=n_leds: _write_setup(ctx, n, m),
+                      lambda args: ToPCBFile.write(*args), None, 3),
+            Benchmark('main' + size, lambda n=n_lines, m=n_leds: _main_setup(ctx, n, m),
+                      lambda _: radial_illuminator.main(), 1, 3),
+            Benchmark('multi_ring.synthesize' + size, lambda n=n_lines, m=n_leds: _multi_ring_setup(ctx, n, m),
+                      multi_ring.synthesize, 1, 3),
+        ]
+    return retval
+
+
+def _time_round(run, state, number):
+    # As timeit does, without the garbage collector kicking in at random
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timeit.default_timer()
+        for _ in range(number):
+            run(state)
+        return timeit.default_timer() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def run_benchmark(bench):
+    # Best time per call over all rounds, in seconds, and the pcbnew calls per call when they are counted
+    best = None
+    calls = None
+    number = bench.number
+    for _ in range(bench.repeat):
+        state = bench.setup() if bench.setup is not None else None
+        if number is None:
+            # Calibrate on the first round
+            number = 1
+            while _time_round(bench.run, state, number) < MIN_ROUND_TIME:
+                number *= 2
+        if PCBNEW == 'counting':
+            pcbnew.reset_calls()
+        elapsed = _time_round(bench.run, state, number) / number
+        best = elapsed if best is None else min(best, elapsed)
+        if PCBNEW == 'counting' and len(pcbnew.CALLS) > 0:
+            calls = sum(pcbnew.CALLS.values()) // number
+    return best, calls
+
+
+def run(sizes=None, names=None):
+    # Returns {name: seconds} for every benchmark whose name starts with one of names (all if None), the same in units
+    # of REFERENCE, and {name: calls} for the ones that call pcbnew, if the calls are counted
+    ctx = _Context()
+    times = {}
+    ratios = {}
+    calls = {}
+    try:
+        for bench in benchmarks(ctx, sizes if sizes is not None else DEFAULT_SIZES):
+            if names is not None and not any(bench.name.startswith(name) for name in names):
+                continue
+            # The machine can change speed along the way: the reference is timed again around each benchmark, and the
+            # best of both is taken, as for the benchmark itself
+            reference, _ = run_benchmark(REFERENCE)
+            times[bench.name], bench_calls = run_benchmark(bench)
+            ratios[bench.name] = times[bench.name] / min(reference, run_benchmark(REFERENCE)[0])
+            if bench_calls is not None:
+                calls[bench.name] = bench_calls
+            print('%-48s %10.3fms %10.4g' % (bench.name, times[bench.name] * 1000., ratios[bench.name]),
+                  file=sys.stderr)
+    finally:
+        ctx.reset_options()
+        ctx.close()
+    return times, ratios, calls
+
+
+def compare(values, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns (name, value, baseline value) for every benchmark whose ratio (or call count) exceeds threshold times its
+    # baseline, and the names of those missing from the baseline, which cannot be checked
+    regressions = []
+    missing = []
+    for name, value in sorted(values.items()):
+        base = baseline.get(name)
+        if base is None:
+            missing.append(name)
+        elif value > threshold * base:
+            regressions.append((name, value, base))
+    return regressions, missing
+
+
+def _parse_size(arg):
+    n_lines, _, n_leds = arg.partition('x')
+    return int(n_lines), int(n_leds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the geometry primitives, the synthesis stages and board I/O.')
+    parser.add_argument('names', nargs='*', metavar='NAME', help='Only run the benchmarks starting with these.')
+    parser.add_argument('--sizes', type=lambda arg: list(map(_parse_size, arg.split(','))), default=None,
+                        help='Synthetic boards to run on, as LINESxLEDS, e.g. 6x2,24x4 (default: %s).' %
+                             ','.join('%dx%d' % size for size in DEFAULT_SIZES))
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline: the pcbnew calls with RATCAM_PCBNEW=counting, the '
+                             'timings with RATCAM_PCBNEW=fake.')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with status 1 if any benchmark makes more pcbnew calls than its baseline, or is '
+                             'missing from it (needs RATCAM_PCBNEW=counting, the default).')
+    parser.add_argument('--check-times', action='store_true',
+                        help='Exit with status 1 if any benchmark, timed in units of the reference one, is slower than '
+                             'its baseline by more than threshold, or is missing from it (needs RATCAM_PCBNEW=fake).')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+    # Counting calls slows the stand-in down, then only the counts are meaningful
+    counting = (PCBNEW == 'counting')
+    if args.check and not counting:
+        parser.error('--check compares pcbnew calls, run with RATCAM_PCBNEW=counting.')
+    if args.check_times and counting:
+        parser.error('--check-times compares timings, run with RATCAM_PCBNEW=fake.')
+    times, ratios, calls = run(args.sizes, args.names if len(args.names) > 0 else None)
+    json.dump(dict(times=times, ratios=ratios, calls=calls), sys.stdout, indent=2, sort_keys=True)
+    print()
+    if args.save_baseline:
+        baseline = dict(ratios={}, calls={})
+        if os.path.isfile(args.baseline):
+            with io.open(args.baseline, encoding='utf-8') as stream:
+                baseline.update(json.load(stream))
+        # Only the benchmarks that ran are replaced
+        if counting:
+            baseline['calls'].update(calls)
+        else:
+            baseline['ratios'].update(ratios)
+            # Only for reference, the ratios hold on other machines too
+            baseline['machine'] = '%s, Python %s' % (platform.platform(), platform.python_version())
+        with io.open(args.baseline, 'w', encoding='utf-8') as stream:
+            stream.write(json.dumps(baseline, indent=2, sort_keys=True, ensure_ascii=False) + '\n')
+    if args.check or args.check_times:
+        with io.open(args.baseline, encoding='utf-8') as stream:
+            baseline = json.load(stream)
+        if args.check:
+            # The counts are exact, any extra call is a regression
+            regressions, missing = compare(calls, baseline['calls'], 1.)
+            for name, value, base in regressions:
+                print('%s regressed: %d pcbnew calls, baseline %d.' % (name, value, base), file=sys.stderr)
+        else:
+            regressions, missing = compare(ratios, baseline['ratios'], args.threshold)
+            for name, value, base in regressions:
+                print('%s regressed: %.4g references, baseline %.4g (x%.2f).' % (name, value, base, value / base),
+                      file=sys.stderr)
+        for name in missing:
+            print('%s is not in the baseline, run with --save-baseline.' % name, file=sys.stderr)
+        if len(regressions) > 0 or len(missing) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
 from __future__ import unicode_literals
+from collections import namedtuple
 import math
-from polar import Polar, Chord, Point, apx_arc_through_polars, normalize_angle, Vector
+from polar import Polar, Chord, Point, apx_arc_through_polars_xy_array, apx_arc_xy_array, normalize_angle, Vector, \
+    points_to_array, array_to_points, rotation_matrix, rotate_xy_array, rotate_point
+from spatial import GridIndex, segments_bounding_boxes, polygon_bounding_box, point_bounding_box
 from enum import Enum
+import weakref
+
+
+NetPlaceholder = namedtuple('NetPlaceholder', ['name', 'code'])
+# How many terminals of a net belong to LEDs, resistors, link components (the connector and the MOSFET) and the rest
+TerminalCounts = namedtuple('TerminalCounts', ['leds', 'resistors', 'links', 'others'])
 
 
 class Layer(Enum):
@@ -9,10 +18,143 @@ class Layer(Enum):
     B_Cu = 31
 
 
+class NetType(Enum):
+    UNKNOWN = '?'
+    LED_STRIP = 'led strip'
+    POWER = 'power'
+    GROUND = 'ground'
+    LINK = 'link'
+
+
+class ObservedList(list):
+    # A list that calls listener.item_added(self, item) and listener.item_removed(self, item) whenever an item enters
+    # or leaves it. The initial items are not notified.
+    def _notify(self, removed, added):
+        if self.listener is None:
+            return
+        for item in removed:
+            self.listener.item_removed(self, item)
+        for item in added:
+            self.listener.item_added(self, item)
+
+    def append(self, item):
+        list.append(self, item)
+        self._notify((), (item,))
+
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        self._notify((), items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, idx, item):
+        list.insert(self, idx, item)
+        self._notify((), (item,))
+
+    def remove(self, item):
+        list.remove(self, item)
+        self._notify((item,), ())
+
+    def pop(self, idx=-1):
+        item = list.pop(self, idx)
+        self._notify((item,), ())
+        return item
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            value = list(value)
+            removed = list.__getitem__(self, idx)
+        else:
+            removed = [list.__getitem__(self, idx)]
+        list.__setitem__(self, idx, value)
+        self._notify(removed, value if isinstance(idx, slice) else (value,))
+
+    def __delitem__(self, idx):
+        removed = list.__getitem__(self, idx)
+        list.__delitem__(self, idx)
+        self._notify(removed if isinstance(idx, slice) else (removed,), ())
+
+    # Python 2 routes simple slices through these
+    def __setslice__(self, i, j, value):
+        self.__setitem__(slice(max(0, i), max(0, j)), value)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(max(0, i), max(0, j)))
+
+    def __reduce__(self):
+        return self.__class__, (list(self), self.listener)
+
+    def __init__(self, items=(), listener=None):
+        list.__init__(self, items)
+        self.listener = listener
+
+
+class ObservedDict(dict):
+    # Same as ObservedList, for the values of a dictionary
+    def _notify(self, removed, added):
+        if self.listener is None:
+            return
+        for item in removed:
+            self.listener.item_removed(self, item)
+        for item in added:
+            self.listener.item_added(self, item)
+
+    def __setitem__(self, key, value):
+        removed = [dict.__getitem__(self, key)] if key in self else []
+        dict.__setitem__(self, key, value)
+        self._notify(removed, (value,))
+
+    def __delitem__(self, key):
+        removed = dict.__getitem__(self, key)
+        dict.__delitem__(self, key)
+        self._notify((removed,), ())
+
+    def pop(self, key, *args):
+        if key not in self:
+            return dict.pop(self, key, *args)
+        value = dict.pop(self, key)
+        self._notify((value,), ())
+        return value
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        removed = list(self.values())
+        dict.clear(self)
+        self._notify(removed, ())
+
+    def __reduce__(self):
+        return self.__class__, (dict(self), self.listener)
+
+    def __init__(self, items=(), listener=None):
+        dict.__init__(self, items)
+        self.listener = listener
+
+
 class Via(object):
     DEFAULT_DIAMETER = None
     DEFAULT_DRILL_DIAMETER = None
 
+    def bounding_boxes(self):
+        radius = self.diameter / 2. if self.diameter is not None else 0.
+        return point_bounding_box(self.position.x, self.position.y, radius, radius)
+
+    def rotated(self, angle, matrix=None):
+        # A copy rotated around the origin; matrix is rotation_matrix(angle), if already at hand
+        if matrix is None:
+            matrix = rotation_matrix(angle)
+        return Via(rotate_point(self.position, matrix), diameter=self.diameter, drill_diameter=self.drill_diameter)
+
     def __repr__(self):
         return 'Via(%s)' % repr(self.position)
 
@@ -28,6 +170,25 @@ class Via(object):
 class Track(object):
     DEFAULT_WIDTH = None
 
+    @property
+    def points(self):
+        return array_to_points(self.vertices)
+
+    @points.setter
+    def points(self, points):
+        # Stored as a contiguous (N, 2) array of x, y
+        self.vertices = points_to_array(points)
+
+    def bounding_boxes(self):
+        # One per segment
+        return segments_bounding_boxes(self.vertices, self.width / 2. if self.width is not None else 0.)
+
+    def rotated(self, angle, matrix=None):
+        # A copy rotated around the origin; matrix is rotation_matrix(angle), if already at hand
+        if matrix is None:
+            matrix = rotation_matrix(angle)
+        return Track(rotate_xy_array(self.vertices, matrix), self.layer, width=self.width)
+
     def __repr__(self):
         return 'Track(%s, %s)' % (repr(self.points), repr(self.layer))
 
@@ -35,14 +196,144 @@ class Track(object):
         return 'Track(%s)' % str(self.points)
 
     def __init__(self, points, layer=Layer.F_Cu, width=None):
-        self.points = list(points)
+        self.points = points
         self.layer = layer
         self.width = width if width is not None else self.__class__.DEFAULT_WIDTH
 
 
+class ArcTrack(Track):
+    # Arcs whose ends are closer than this to the same radius are considered of constant radius
+    RADIUS_TOLERANCE = 1.
+    # Used to tessellate the arc when no tessellation parameters are given
+    DEFAULT_MAX_ERROR = None
+
+    @property
+    def points(self):
+        return array_to_points(self.vertices)
+
+    @points.setter
+    def points(self, points):
+        raise TypeError('The points of an ArcTrack follow from its center, radius and angles, they cannot be set.')
+
+    @property
+    def vertices(self):
+        # Tessellation of the arc, for whoever cannot handle true arcs
+        if self._vertices is None:
+            kwargs = dict(self.tessellation)
+            if len(kwargs) == 0 and self.__class__.DEFAULT_MAX_ERROR is not None:
+                kwargs['max_error'] = self.__class__.DEFAULT_MAX_ERROR
+            kwargs['skip_start'] = False
+            kwargs['include_end'] = True
+            arc = apx_arc_xy_array(Polar(self.start_angle, self.radius), self.angle, **kwargs)
+            self._vertices = arc + (self.center.x, self.center.y)
+        return self._vertices
+
+    @property
+    def end_angle(self):
+        return self.start_angle + self.angle
+
+    @property
+    def start(self):
+        return self.center + Polar(self.start_angle, self.radius).to_point().to_vector()
+
+    @property
+    def mid(self):
+        return self.center + Polar(self.start_angle + self.angle / 2., self.radius).to_point().to_vector()
+
+    @property
+    def end(self):
+        return self.center + Polar(self.end_angle, self.radius).to_point().to_vector()
+
+    def bounding_boxes(self):
+        # One per tessellation segment, grown by the largest distance between the segments and the arc
+        half_step = abs(self.angle) / (2. * max(1, len(self.vertices) - 1))
+        margin = self.radius * (1. - math.cos(half_step))
+        return segments_bounding_boxes(self.vertices, margin + (self.width / 2. if self.width is not None else 0.))
+
+    def rotated(self, angle, matrix=None):
+        # The tessellation is rotated along, which is cheaper than computing it again for every copy
+        if matrix is None:
+            matrix = rotation_matrix(angle)
+        retval = ArcTrack(rotate_point(self.center, matrix), self.radius, normalize_angle(self.start_angle + angle),
+                          self.angle, self.layer, width=self.width, **self.tessellation)
+        retval._vertices = rotate_xy_array(self.vertices, matrix)
+        return retval
+
+    @staticmethod
+    def through_polars(p1, p2, center=Point(0., 0.), layer=Layer.F_Cu, width=None, **kwargs):
+        # Shortest arc around center from p1 to p2 (relative to center). If the radius changes along the way, this is
+        # not an arc and a tessellated Track is returned instead, using the same tessellation parameters.
+        kwargs.pop('skip_start', None)
+        kwargs.pop('include_end', None)
+        angle = normalize_angle(p2.a - p1.a + math.pi) - math.pi
+        if abs(p1.r - p2.r) >= ArcTrack.RADIUS_TOLERANCE or abs(angle * p1.r) < ArcTrack.RADIUS_TOLERANCE:
+            arc = apx_arc_through_polars_xy_array(p1, p2, skip_start=False, include_end=True, **kwargs)
+            arc += (center.x, center.y)
+            return Track(arc, layer, width=width)
+        return ArcTrack(center, (p1.r + p2.r) / 2., p1.a, angle, layer, width=width, **kwargs)
+
+    @staticmethod
+    def through_points(start, mid, end, layer=Layer.F_Cu, width=None):
+        # Arc from start to end passing through mid, or a straight Track if the three points are aligned
+        ax, ay, bx, by, cx, cy = start.x, start.y, mid.x, mid.y, end.x, end.y
+        d = 2. * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+        if abs(d) < ArcTrack.RADIUS_TOLERANCE:
+            return Track([start, end], layer, width=width)
+        a2, b2, c2 = ax * ax + ay * ay, bx * bx + by * by, cx * cx + cy * cy
+        center = Point((a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d,
+                       (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d)
+        s = (start - center).to_polar()
+        e = (end - center).to_polar()
+        # A positive d means start, mid, end go counterclockwise
+        if d > 0.:
+            angle = normalize_angle(e.a - s.a)
+        else:
+            angle = -normalize_angle(s.a - e.a)
+        return ArcTrack(center, s.r, s.a, angle, layer, width=width)
+
+    def __repr__(self):
+        return 'ArcTrack(%s, %s, %s, %s, %s)' % (repr(self.center), repr(self.radius), repr(self.start_angle),
+                                                 repr(self.angle), repr(self.layer))
+
+    def __str__(self):
+        return 'ArcTrack(%s, %s)' % (str(self.start), str(self.end))
+
+    def __init__(self, center, radius, start_angle, angle, layer=Layer.F_Cu, width=None, **kwargs):
+        # angle is the signed sweep, counterclockwise if positive; kwargs are the apx_arc_array tessellation
+        # parameters used for vertices
+        self.center = center
+        self.radius = radius
+        self.start_angle = start_angle
+        self.angle = angle
+        self.layer = layer
+        self.width = width if width is not None else self.__class__.DEFAULT_WIDTH
+        self.tessellation = kwargs
+        self._vertices = None
+
+
 class Fill(object):
     DEFAULT_FILLET_RADIUS = None
 
+    @property
+    def points(self):
+        return array_to_points(self.vertices)
+
+    @points.setter
+    def points(self, points):
+        # Stored as a contiguous (N, 2) array of x, y
+        self.vertices = points_to_array(points)
+
+    def bounding_boxes(self):
+        return polygon_bounding_box(self.vertices)
+
+    def rotated(self, angle, matrix=None):
+        # A copy rotated around the origin; matrix is rotation_matrix(angle), if already at hand
+        if matrix is None:
+            matrix = rotation_matrix(angle)
+        retval = Fill(rotate_xy_array(self.vertices, matrix), self.layer, fillet_radius=self.fillet_radius)
+        retval.thermal = self.thermal
+        return retval
+
     def __repr__(self):
         return 'Fill(%s, %s)' % (repr(self.points), repr(self.layer))
 
@@ -50,7 +341,7 @@ class Fill(object):
         return 'Fill(%s)' % str(self.points)
 
     def __init__(self, points, layer=Layer.F_Cu, fillet_radius=None):
-        self.points = list(points)
+        self.points = points
         self.thermal = False
         self.layer = layer
         self.fillet_radius = fillet_radius if fillet_radius is not None else self.__class__.DEFAULT_FILLET_RADIUS
@@ -96,15 +387,29 @@ class Net(object):
     def other_terminals(self, pad):
         return [t for t in self.terminals if t.pad is not pad]
 
+    def item_added(self, container, item):
+        if self.index is not None:
+            self.index.insert(item, item.bounding_boxes(), self)
+
+    def item_removed(self, container, item):
+        if self.index is not None:
+            self.index.remove(item)
+
+    def attach_index(self, index):
+        # Keeps the tracks, vias and fills of this net in index; None detaches it
+        if self.index is not None:
+            for item in self.tracks + self.fills:
+                self.index.remove(item)
+        self.index = index
+        for item in self.tracks + self.fills:
+            self.item_added(None, item)
+
     def route_arc(self, center=Point(0., 0.), **kwargs):
         if len(self.terminals) != 2:
             raise RuntimeError()
         s = (self.terminals[0].position - center).to_polar()
         t = (self.terminals[1].position - center).to_polar()
-        kwargs['skip_start'] = False
-        kwargs['include_end'] = True
-        self.tracks.append(Track(map(lambda pol: center + pol.to_point().to_vector(),
-                                     apx_arc_through_polars(s, t, **kwargs))))
+        self.tracks.append(ArcTrack.through_polars(s, t, center, **kwargs))
         self.flag_routed = True
 
     def route_straight(self):
@@ -123,9 +428,13 @@ class Net(object):
         self.name = name
         self.code = code
         self.terminals = terminals
-        self.tracks = []
-        self.fills = []
+        self.index = None
+        self.tracks = ObservedList(listener=self)
+        self.fills = ObservedList(listener=self)
         self.flag_routed = False
+        # Set by Board.classify_nets
+        self.net_type = NetType.UNKNOWN
+        self.terminal_counts = None
 
 
 class Pad(object):
@@ -135,14 +444,127 @@ class Pad(object):
     def __str__(self):
         return str(self.name)
 
-    def __init__(self, name, offset=None, connected_to=None, size=None):
+    def __init__(self, name, offset=None, connected_to=None, size=None, layers=None):
         self.name = name
         self.offset = offset
         self.connected_to = connected_to
         self.size = size
+        # Copper layers, None if unknown
+        self.layers = layers
+
+
+class Footprint(object):
+    # The pad geometry that components with the same footprint share, and whatever is computed out of it alone.
+    # Footprint.of interns them, so components whose pads have the same names, offsets and sizes get the same one: what
+    # is cached in here is computed once per distinct footprint instead of once per component.
+
+    def cached(self, key, compute):
+        # compute() the first time key is asked for, the same value from then on
+        try:
+            return self._cache[key]
+        except KeyError:
+            retval = self._cache[key] = compute()
+            return retval
+
+    def get_pads_distance(self, pad1, pad2):
+        # Pads by name, as everything below
+        return self.cached(('distance', pad1, pad2), lambda: (self.pads[pad1].offset - self.pads[pad2].offset).l2())
+
+    def has_symmetric_pads(self, pad1, pad2, tolerance=0.001):
+        # Whether the two pads are as far from the footprint origin
+        return self.cached(('symmetric', pad1, pad2, tolerance),
+                           lambda: abs(self.pads[pad1].offset.l2() - self.pads[pad2].offset.l2()) <= tolerance)
+
+    def get_pads_aperture(self, radius, pad1, pad2):
+        # Angle spanned by the two pads when they both lie on a circle of the given radius
+        return self.cached(('aperture', radius, pad1, pad2),
+                           lambda: Chord(radius, 0., 0.).with_length(self.get_pads_distance(pad1, pad2)).aperture)
+
+    def get_pads_axis_angle(self, pad1, pad2, flipped=False):
+        # Angle of the line from pad1 to pad2 with the footprint unrotated
+        def compute():
+            axis = self.pads[pad2].offset.flipped(flip_y=flipped) - self.pads[pad1].offset.flipped(flip_y=flipped)
+            return axis.to_polar().a
+        return self.cached(('axis_angle', pad1, pad2, flipped), compute)
+
+    @classmethod
+    def of(cls, pads, name=None):
+        # The footprint of a component with the given pads. name is the footprint name, e.g. 'Ratcam:LED-GW_2.3x2.3mm',
+        # None if unknown; footprints with different names are never shared.
+        # Plain tuples, Vector does not compare with None
+        key = (name, tuple(sorted((pad.name, tuple(pad.offset) if pad.offset is not None else None,
+                                   tuple(pad.size) if pad.size is not None else None) for pad in pads)))
+        retval = _FOOTPRINTS.get(key)
+        if retval is None:
+            retval = _FOOTPRINTS[key] = cls(name, pads)
+        return retval
+
+    def __repr__(self):
+        return 'Footprint(%s)' % repr(self.name)
+
+    def __init__(self, name, pads):
+        self.name = name
+        # Copies without nets nor layers, the pads of the component it comes from stay its own
+        self.pads = {pad.name: Pad(pad.name, offset=pad.offset, size=pad.size) for pad in pads}
+        self._cache = {}
+
+
+# Footprint.of, by name and pads; footprints last as long as some component uses them
+_FOOTPRINTS = weakref.WeakValueDictionary()
 
 
 class Component(object):
+    # Transformed pad offsets and absolute pad positions are cached, the setters below invalidate them
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+        self._pad_positions = {}
+        self._moved()
+
+    @property
+    def orientation(self):
+        return self._orientation
+
+    @orientation.setter
+    def orientation(self, orientation):
+        self._orientation = orientation
+        self._pad_offsets = {}
+        self._pad_positions = {}
+        self._moved()
+
+    @property
+    def flipped(self):
+        return self._flipped
+
+    @flipped.setter
+    def flipped(self, flipped):
+        self._flipped = flipped
+        self._pad_offsets = {}
+        self._pad_positions = {}
+        self._moved()
+
+    def _moved(self):
+        if self.index is None:
+            return
+        for pad in self.pads.values():
+            if self.position is None or self.orientation is None:
+                self.index.remove(pad)
+            else:
+                self.index.insert(pad, self.get_pad_bounding_boxes(pad), self)
+
+    def attach_index(self, index):
+        # Keeps the pads of this component in index, following it as it moves; None detaches it
+        if self.index is not None:
+            for pad in self.pads.values():
+                self.index.remove(pad)
+        self.index = index
+        self._moved()
+
     def __repr__(self):
         return 'Component(%s, %s)' % (repr(self.name), repr(self.pads))
 
@@ -177,12 +599,30 @@ class Component(object):
         return self.get_pad_offset(pad).rotated(-tan_angle).dx
 
     def get_pad_offset(self, pad):
+        # Entries remember the pad offset they were computed from, in case the pad gets a new one
+        cached = self._pad_offsets.get(pad)
+        if cached is not None and cached[0] is pad.offset:
+            return cached[1]
         if pad not in self.pads.values():
             raise ValueError()
-        return pad.offset.flipped(flip_y=self.flipped).rotated(self.orientation)
+        # Same as pad.offset.flipped(flip_y=self.flipped).rotated(self.orientation), in one go
+        dx, dy = pad.offset
+        if self.flipped:
+            dy = -dy
+        c = math.cos(self.orientation)
+        s = math.sin(self.orientation)
+        retval = Vector(c * dx - s * dy, s * dx + c * dy)
+        self._pad_offsets[pad] = (pad.offset, retval)
+        return retval
 
     def get_pad_position(self, pad):
-        return self.position + self.get_pad_offset(pad)
+        offset = self.get_pad_offset(pad)
+        cached = self._pad_positions.get(pad)
+        if cached is not None and cached[0] is offset:
+            return cached[1]
+        retval = self.position + offset
+        self._pad_positions[pad] = (offset, retval)
+        return retval
 
     def place_radial(self, angle, radius, orientation=0.):
         self.orientation = orientation + angle - math.pi / 2.
@@ -191,19 +631,20 @@ class Component(object):
 
     def place_pads_on_circ(self, angle, radius, pad1=None, pad2=None, orientation=0.):
         pad1, pad2 = self._two_pads(pad1, pad2)
-        chord = Chord(radius, 0., angle).with_length(self.get_pads_distance(pad1, pad2))
+        chord = Chord(radius, self.footprint.get_pads_aperture(radius, pad1.name, pad2.name), angle)
         self.align_pads_to_chord(chord, orientation=orientation)
         self.flag_placed = True
 
     def get_pads_distance(self, pad1=None, pad2=None):
         pad1, pad2 = self._two_pads(pad1, pad2)
-        return (pad1.offset - pad2.offset).l2()
+        return self.footprint.get_pads_distance(pad1.name, pad2.name)
 
     def align_pads_to_chord(self, chord, pad1=None, pad2=None, orientation=0.):
         pad1, pad2 = self._two_pads(pad1, pad2)
         assert(abs(chord.length - self.get_pads_distance(pad1, pad2)) < 0.001)
-        # Compute the natural pad inclination
-        pads_angle = normalize_angle(orientation + (self.get_pad_offset(pad2) - self.get_pad_offset(pad1)).to_polar().a)
+        # Compute the natural pad inclination, regardless of the current orientation
+        pads_angle = normalize_angle(orientation + self.footprint.get_pads_axis_angle(pad1.name, pad2.name,
+                                                                                      self.flipped))
         # Apply the correct orientation
         self.orientation = (chord.declination - math.pi / 2.) + (pads_angle - math.pi)
         # Now get the correct, transformed offset and move the component in place
@@ -213,37 +654,127 @@ class Component(object):
             chord_endpt = chord.endpoints[0]
         self.position = chord_endpt.to_point() + (self.get_pad_position(pad1) - self.position)
 
+    def get_pad_bounding_boxes(self, pad):
+        # Axis aligned box of the rotated pad, as a (1, 4) array for GridIndex
+        pos = self.get_pad_position(pad)
+        sx, sy = (abs(pad.size.dx) / 2., abs(pad.size.dy) / 2.) if pad.size is not None else (0., 0.)
+        c = abs(math.cos(self.orientation))
+        s = abs(math.sin(self.orientation))
+        return point_bounding_box(pos.x, pos.y, c * sx + s * sy, s * sx + c * sy)
+
     def get_pads_bounding_box(self):
-        vmin = Vector(0., 0.)
-        vmax = Vector(0., 0.)
+        min_dx, min_dy, max_dx, max_dy = 0., 0., 0., 0.
         for pad in self.pads.values():
             ofs = self.get_pad_offset(pad)
-            vmin.dx = min(vmin.dx, ofs.dx - pad.size.dx / 2.)
-            vmin.dy = min(vmin.dy, ofs.dy - pad.size.dy / 2.)
-            vmax.dx = max(vmax.dx, ofs.dx + pad.size.dx / 2.)
-            vmax.dy = max(vmax.dy, ofs.dy + pad.size.dy / 2.)
-        return vmin, vmax
+            min_dx = min(min_dx, ofs.dx - pad.size.dx / 2.)
+            min_dy = min(min_dy, ofs.dy - pad.size.dy / 2.)
+            max_dx = max(max_dx, ofs.dx + pad.size.dx / 2.)
+            max_dy = max(max_dy, ofs.dy + pad.size.dy / 2.)
+        return Vector(min_dx, min_dy), Vector(max_dx, max_dy)
 
-    def __init__(self, name, pads, position=None, orientation=None, flipped=False):
+    def __init__(self, name, pads, position=None, orientation=None, flipped=False, footprint=None):
         self.name = name
-        self.position = position
-        self.orientation = orientation
-        self.flipped = flipped
-        self.flag_placed = False
+        self.index = None
         if isinstance(pads, dict):
             self.pads = pads
         else:
             self.pads = {pad.name: pad for pad in pads}
+        # footprint is the footprint name, if known. Pads are not supposed to change from now on.
+        self.footprint = Footprint.of(self.pads.values(), name=footprint)
+        self.position = position
+        self.orientation = orientation
+        self.flipped = flipped
+        self.flag_placed = False
 
 
 class Board(object):
+    def collect_netlist(self):
+        # Build the nets out of the NetPlaceholder that each pad is connected to
+        for comp in self.components.values():
+            for pad in comp.pads.values():
+                net_name, net_code = pad.connected_to
+                if net_name is None or net_code is None:
+                    continue
+                terminal = Terminal(comp, pad)
+                if net_name in self.netlist:
+                    self.netlist[net_name].terminals.append(terminal)
+                else:
+                    self.netlist[net_name] = Net(net_name, net_code, [terminal])
+
     def assign_connections(self):
         for n in self.netlist.values():
             n.assign_connections(self)
 
+    @staticmethod
+    def _classify_net(net, led_pfx, res_pfx, link_names, ignored_pfx):
+        # Terminals that could not be loaded still hold names
+        terminals = [(t.component.name if isinstance(t.component, Component) else t.component, t.pad)
+                     for t in net.terminals]
+        if ignored_pfx:
+            terminals = [(name, pad) for name, pad in terminals if not name.startswith(ignored_pfx)]
+        comp_names = [name for name, _ in terminals]
+        leds = resistors = links = 0
+        for name in comp_names:
+            if name.startswith(led_pfx):
+                leds += 1
+            elif name.startswith(res_pfx):
+                resistors += 1
+            elif name in link_names:
+                links += 1
+        counts = TerminalCounts(leds, resistors, links, len(comp_names) - leds - resistors - links)
+        if len(comp_names) == 2 and leds + resistors == 2 and resistors < 2:
+            pad_names = [pad.name if isinstance(pad, Pad) else pad for _, pad in terminals]
+            # Two LEDs on the same pad are the ends of two lines, i.e. the ground ring of two lines
+            if resistors == 1 or pad_names[0] != pad_names[1]:
+                return NetType.LED_STRIP, counts
+        # Supply nets reach only the lines and the connector or the MOSFET, e.g. pull-up resistors are none of them
+        if len(comp_names) > 1 and counts.others == 0 and (leds == 0) != (resistors == 0):
+            return (NetType.POWER if resistors > 0 else NetType.GROUND), counts
+        if links == len(comp_names) and len(set(comp_names)) > 1:
+            return NetType.LINK, counts
+        return NetType.UNKNOWN, counts
+
+    def classify_nets(self, led_pfx, res_pfx, link_names=(), ignored_pfx=None):
+        # Tags every net with its NetType and TerminalCounts, and indexes them by type in nets_by_type, in netlist
+        # order. Components are told apart by name: LEDs and resistors by prefix, the connector and the MOSFET by
+        # being in link_names; those starting with ignored_pfx, e.g. test points, do not count at all. Nets do not
+        # change once loaded, so this is a no-op when called again with the same arguments.
+        key = (led_pfx, res_pfx, tuple(sorted(link_names)), ignored_pfx)
+        if self._net_types_key == key:
+            return
+        self.nets_by_type = {net_type: [] for net_type in NetType}
+        for net in self.netlist.values():
+            net.net_type, net.terminal_counts = Board._classify_net(net, led_pfx, res_pfx, key[2], ignored_pfx)
+            self.nets_by_type[net.net_type].append(net)
+        self.type_counts = {net_type: len(nets) for net_type, nets in self.nets_by_type.items()}
+        self._net_types_key = key
+
+    @property
+    def index(self):
+        # GridIndex over pads, tracks, vias and fills; built on first use and kept up to date from then on
+        if self._index is None:
+            self._index = GridIndex()
+            for net in self.netlist.values():
+                net.attach_index(self._index)
+            for comp in self.components.values():
+                comp.attach_index(self._index)
+        return self._index
+
+    def item_added(self, container, item):
+        if self._index is not None:
+            item.attach_index(self._index)
+
+    def item_removed(self, container, item):
+        if self._index is not None:
+            item.attach_index(None)
+
     def __repr__(self):
         return 'Board(%s, %s)' % (repr(self.components), repr(self.netlist))
 
     def __init__(self):
-        self.components = {}
-        self.netlist = {}
+        self._index = None
+        self._net_types_key = None
+        self.nets_by_type = None
+        self.type_counts = None
+        self.components = ObservedDict(listener=self)
+        self.netlist = ObservedDict(listener=self)
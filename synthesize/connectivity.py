@@ -0,0 +1,115 @@
+from __future__ import unicode_literals
+from collections import namedtuple
+from drc import item_shape, pad_shape, copper_layers, point_segment_distances, points_in_polygon
+import cad
+import math
+import numpy as np
+
+
+Disconnection = namedtuple('Disconnection', ['net', 'islands'])
+
+# Anchors closer than this to some copper are connected to it
+DEFAULT_TOLERANCE = 10.
+# Hashed grid cell for the anchors, 1mm in pcbnew internal units
+DEFAULT_CELL_SIZE = 1000000.
+
+
+class UnionFind(object):
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return
+        if self.rank[x] < self.rank[y]:
+            x, y = y, x
+        self.parent[y] = x
+        if self.rank[x] == self.rank[y]:
+            self.rank[x] += 1
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.rank = [0] * n
+
+
+def _anchors(item, comp):
+    # The points through which an item connects to the copper around it, as pcbnew sees it: the ends of a track, the
+    # center of a via or a pad. Zones have none, they connect to whatever anchor they cover.
+    if isinstance(item, cad.Pad):
+        pos = comp.get_pad_position(item)
+        return [(pos.x, pos.y)]
+    elif isinstance(item, cad.Via):
+        return [(item.position.x, item.position.y)]
+    elif isinstance(item, cad.Track):
+        if len(item.vertices) == 0:
+            return []
+        return [tuple(item.vertices[0]), tuple(item.vertices[-1])]
+    return []
+
+
+def _covered(shape, points, tolerance):
+    # Which of the (N, 2) points lie on the copper of shape
+    p = points[:, np.newaxis, :]
+    dist, _ = point_segment_distances(p, shape.segments[np.newaxis, :, 0], shape.segments[np.newaxis, :, 1])
+    retval = np.min(dist, axis=1) <= shape.radius + tolerance
+    if shape.polygon is not None:
+        retval |= points_in_polygon(points, shape.polygon)
+    return retval
+
+
+def net_islands(net, tolerance=DEFAULT_TOLERANCE, cell_size=DEFAULT_CELL_SIZE):
+    # Groups the terminals of net by the copper island they are on. The anchors of every pad, track and via are hashed
+    # into a grid, then each piece of copper is joined with the anchors that fall on it.
+    terminals = [t for t in net.terminals if isinstance(t.pad, cad.Pad) and isinstance(t.component, cad.Component)
+                 and t.component.position is not None]
+    items = [(t.pad, t.component) for t in terminals]
+    items += [(item, None) for item in list(net.tracks) + list(net.fills)]
+    grid = {}
+    for idx, (item, comp) in enumerate(items):
+        layers = copper_layers(item)
+        for x, y in _anchors(item, comp):
+            cell = (int(math.floor(x / cell_size)), int(math.floor(y / cell_size)))
+            grid.setdefault(cell, []).append((x, y, idx, layers))
+    uf = UnionFind(len(items))
+    for idx, (item, comp) in enumerate(items):
+        shape = pad_shape(comp, item) if isinstance(item, cad.Pad) else item_shape(item)
+        layers = copper_layers(item)
+        # Anchors in the cells touched by the bounding box of the shape
+        lo = np.min(shape.segments.reshape(-1, 2), axis=0) - shape.radius - tolerance
+        hi = np.max(shape.segments.reshape(-1, 2), axis=0) + shape.radius + tolerance
+        candidates = []
+        for ix in range(int(math.floor(lo[0] / cell_size)), int(math.floor(hi[0] / cell_size)) + 1):
+            for iy in range(int(math.floor(lo[1] / cell_size)), int(math.floor(hi[1] / cell_size)) + 1):
+                candidates.extend(anchor for anchor in grid.get((ix, iy), ())
+                                  if anchor[2] != idx and len(anchor[3] & layers) > 0)
+        if len(candidates) == 0:
+            continue
+        covered = _covered(shape, np.array([(x, y) for x, y, _, _ in candidates]), tolerance)
+        for anchor, is_covered in zip(candidates, covered):
+            if is_covered:
+                uf.union(idx, anchor[2])
+    islands = {}
+    for idx, t in enumerate(terminals):
+        islands.setdefault(uf.find(idx), []).append(t)
+    return list(islands.values())
+
+
+def check_connectivity(board, only_routed=True, tolerance=DEFAULT_TOLERANCE):
+    # Returns a Disconnection for each net whose terminals are not all joined by its copper. Unless only_routed is
+    # False, only the nets that are flagged as routed or have some copper are checked: flag_routed alone is not enough,
+    # route_rings never sets it.
+    retval = []
+    for net in board.netlist.values():
+        if only_routed and not (net.flag_routed or len(net.tracks) > 0 or len(net.fills) > 0):
+            continue
+        islands = net_islands(net, tolerance)
+        if len(islands) > 1:
+            retval.append(Disconnection(net, islands))
+    return retval
@@ -0,0 +1,163 @@
+from __future__ import unicode_literals
+from collections import namedtuple
+from polar import Point
+import cad
+import math
+import numpy as np
+
+
+Violation = namedtuple('Violation', ['distance', 'position', 'layers', 'net1', 'item1', 'net2', 'item2'])
+
+# Copper outline as segments (N, 2, 2) grown by radius, plus the polygon vertices for filled shapes
+_Shape = namedtuple('_Shape', ['segments', 'radius', 'polygon'])
+
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def point_segment_distances(p, s0, s1):
+    # Distances from the points p to the segments s0-s1 and the closest points on the segments, all broadcast
+    d = s1 - s0
+    dd = np.sum(d * d, axis=-1)
+    t = np.sum((p - s0) * d, axis=-1) / np.where(dd > 0., dd, 1.)
+    q = s0 + np.clip(t, 0., 1.)[..., np.newaxis] * d
+    return np.sqrt(np.sum((p - q) ** 2, axis=-1)), q
+
+
+def segment_distances(a, b):
+    # For (N, 2, 2) and (M, 2, 2) segments, returns the (N, M) distances between each pair and the (N, M, 2) closest
+    # points on a and on b
+    a0, a1 = a[:, np.newaxis, 0], a[:, np.newaxis, 1]
+    b0, b1 = b[np.newaxis, :, 0], b[np.newaxis, :, 1]
+    # Endpoints against the other segment; this is the answer unless the segments cross
+    d_a0, q_a0 = point_segment_distances(a0, b0, b1)
+    d_a1, q_a1 = point_segment_distances(a1, b0, b1)
+    d_b0, q_b0 = point_segment_distances(b0, a0, a1)
+    d_b1, q_b1 = point_segment_distances(b1, a0, a1)
+    shape = d_a0.shape
+    dist = np.stack([d_a0, d_a1, d_b0, d_b1])
+    on_a = np.stack([np.broadcast_to(a0, shape + (2,)), np.broadcast_to(a1, shape + (2,)), q_b0, q_b1])
+    on_b = np.stack([q_a0, q_a1, np.broadcast_to(b0, shape + (2,)), np.broadcast_to(b1, shape + (2,))])
+    best = np.argmin(dist, axis=0)
+    rows, cols = np.indices(shape)
+    retval = dist[best, rows, cols]
+    pa = on_a[best, rows, cols]
+    pb = on_b[best, rows, cols]
+    # Proper crossings
+    da, db = a1 - a0, b1 - b0
+    o1, o2 = _cross(b0 - a0, da), _cross(b1 - a0, da)
+    o3, o4 = _cross(a0 - b0, db), _cross(a1 - b0, db)
+    crossing = (o1 * o2 < 0.) & (o3 * o4 < 0.)
+    if np.any(crossing):
+        t = o3 / np.where(crossing, o3 - o4, 1.)
+        x = a0 + t[..., np.newaxis] * da
+        retval = np.where(crossing, 0., retval)
+        pa = np.where(crossing[..., np.newaxis], x, pa)
+        pb = np.where(crossing[..., np.newaxis], x, pb)
+    return retval, pa, pb
+
+
+def points_in_polygon(points, polygon):
+    # Even-odd rule, for (N, 2) points and a (M, 2) closed polygon
+    x, y = points[:, np.newaxis, 0], points[:, np.newaxis, 1]
+    v0 = polygon[np.newaxis, :]
+    v1 = np.roll(polygon, -1, axis=0)[np.newaxis, :]
+    straddles = (v0[..., 1] > y) != (v1[..., 1] > y)
+    dy = v1[..., 1] - v0[..., 1]
+    x_cross = v0[..., 0] + (y - v0[..., 1]) * (v1[..., 0] - v0[..., 0]) / np.where(dy != 0., dy, 1.)
+    return np.sum(straddles & (x < x_cross), axis=1) % 2 == 1
+
+
+def _polygon_shape(vertices):
+    vertices = np.asarray(vertices, dtype=float)
+    return _Shape(np.stack([vertices, np.roll(vertices, -1, axis=0)], axis=1), 0., vertices)
+
+
+def item_shape(item):
+    if isinstance(item, cad.Via):
+        pos = np.array([item.position.x, item.position.y])
+        return _Shape(np.array([[pos, pos]]), item.diameter / 2. if item.diameter is not None else 0., None)
+    elif isinstance(item, cad.Track):
+        vertices = item.vertices if len(item.vertices) > 1 else np.concatenate((item.vertices, item.vertices))
+        return _Shape(np.stack([vertices[:-1], vertices[1:]], axis=1),
+                      item.width / 2. if item.width is not None else 0., None)
+    else:
+        # Fills are taken as their outline, without fillets: that is never less copper than pcbnew would pour
+        return _polygon_shape(item.vertices)
+
+
+def pad_shape(comp, pad):
+    # The pad rectangle; round and oval pads fit inside it
+    pos = comp.get_pad_position(pad)
+    hx, hy = abs(pad.size.dx) / 2., abs(pad.size.dy) / 2.
+    c, s = math.cos(comp.orientation), math.sin(comp.orientation)
+    return _polygon_shape([(pos.x + c * dx - s * dy, pos.y + s * dx + c * dy)
+                           for dx, dy in ((-hx, -hy), (hx, -hy), (hx, hy), (-hx, hy))])
+
+
+def shape_distance(shape1, shape2):
+    # Distance between the copper of two shapes (0 if they touch or overlap) and the point where it is measured
+    dist, pa, pb = segment_distances(shape1.segments, shape2.segments)
+    idx = np.unravel_index(np.argmin(dist), dist.shape)
+    distance = max(0., dist[idx] - shape1.radius - shape2.radius)
+    position = (pa[idx] + pb[idx]) / 2.
+    # Either shape could be entirely inside the other one
+    for inner, outer in ((shape1, shape2), (shape2, shape1)):
+        if outer.polygon is not None:
+            inside = points_in_polygon(inner.segments[:, 0], outer.polygon)
+            if np.any(inside):
+                distance = 0.
+                position = inner.segments[np.argmax(inside), 0]
+    return distance, Point(float(position[0]), float(position[1]))
+
+
+def copper_layers(item):
+    if isinstance(item, cad.Pad):
+        return set(item.layers) if item.layers is not None else set(cad.Layer)
+    elif isinstance(item, cad.Via):
+        return set(cad.Layer)
+    return {item.layer}
+
+
+def _net_name(item, owner):
+    if isinstance(item, cad.Pad):
+        return item.connected_to.name if item.connected_to is not None else None
+    return owner.name
+
+
+def check_clearances(board, min_clearance, fills_as_copper=True):
+    # Returns a Violation for each pair of copper items of different nets that share a layer and are closer than
+    # min_clearance, sorted by increasing distance. Pads are checked against tracks, vias and fills only, the
+    # footprints are not ours to fix. Candidate pairs come from board.index.
+    # pcbnew keeps the clearance from other nets when it fills a zone; without fills_as_copper, fills are only checked
+    # against each other, as that is what the zone filler cannot fix.
+    index = board.index
+    shapes = {}
+    retval = []
+
+    def get_shape(item, owner):
+        if item not in shapes:
+            shapes[item] = pad_shape(owner, item) if isinstance(item, cad.Pad) else item_shape(item)
+        return shapes[item]
+
+    done = set()
+    for net in board.netlist.values():
+        for item in list(net.tracks) + list(net.fills):
+            done.add(item)
+            layers = copper_layers(item)
+            for other in index.overlapping(item, min_clearance):
+                owner = index.owner(other)
+                if other in done or _net_name(other, owner) == net.name:
+                    continue
+                if not fills_as_copper and isinstance(item, cad.Fill) != isinstance(other, cad.Fill):
+                    continue
+                common = layers & copper_layers(other)
+                if len(common) == 0:
+                    continue
+                distance, position = shape_distance(get_shape(item, net), get_shape(other, owner))
+                if distance < min_clearance:
+                    retval.append(Violation(distance, position, sorted(common, key=lambda layer: layer.value),
+                                            net.name, item, _net_name(other, owner), other))
+    retval.sort(key=lambda violation: violation.distance)
+    return retval
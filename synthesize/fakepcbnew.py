@@ -0,0 +1,550 @@
+from __future__ import unicode_literals
+from collections import Counter
+import sexpr
+import io
+import math
+import os
+import sys
+
+# In-memory stand-in for the part of KiCad's pcbnew module that the synthesis scripts use, so that they can run (and
+# be timed) where KiCad is not installed. It follows the KiCad 4/5 API the scripts are written against. Select it with
+# RATCAM_PCBNEW=fake, see pcbapi. GetBoard returns the last board loaded with LoadBoard, at first the .kicad_pcb file
+# in RATCAM_PCBNEW_BOARD if set, or an empty board.
+
+IU_PER_MM = 1000000.
+F_Cu = 0
+B_Cu = 31
+VIA_THROUGH = 3
+PAD_ZONE_CONN_FULL = 1
+PAD_ZONE_CONN_THERMAL = 2
+
+# Calls to the API by name, e.g. 'TRACK.SetStart' or 'VIA' for the constructor; only counted after instrument()
+CALLS = Counter()
+
+_LAYERS = {'F.Cu': F_Cu, 'B.Cu': B_Cu}
+_BOARD = None
+_INSTRUMENTED = False
+
+
+def _iu(mm):
+    return int(float(mm) * IU_PER_MM)
+
+
+def FromMM(mm):
+    return _iu(mm)
+
+
+def ToMM(iu):
+    return float(iu) / IU_PER_MM
+
+
+class ZONE_SETTINGS(object):
+    SMOOTHING_NONE = 0
+    SMOOTHING_CHAMFER = 1
+    SMOOTHING_FILLET = 2
+
+
+class CPolyLine(object):
+    NO_HATCH = 0
+    DIAGONAL_FULL = 1
+    DIAGONAL_EDGE = 2
+
+    def AppendCorner(self, x, y):
+        self._corners.append(wxPoint(x, y))
+
+    def CloseLastContour(self):
+        pass
+
+    def GetCornersCount(self):
+        return len(self._corners)
+
+    def __init__(self):
+        self._corners = []
+
+
+class wxPoint(object):
+    __slots__ = ('x', 'y')
+
+    def __add__(self, other):
+        return wxPoint(self.x + other.x, self.y + other.y)
+
+    def __sub__(self, other):
+        return wxPoint(self.x - other.x, self.y - other.y)
+
+    def __eq__(self, other):
+        return isinstance(other, wxPoint) and self.x == other.x and self.y == other.y
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    def __getitem__(self, idx):
+        return (self.x, self.y)[idx]
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return 'wxPoint(%d, %d)' % (self.x, self.y)
+
+    def __init__(self, x=0, y=0):
+        self.x = int(x)
+        self.y = int(y)
+
+
+class wxSize(wxPoint):
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'wxSize(%d, %d)' % (self.x, self.y)
+
+
+class NETINFO_ITEM(object):
+    def GetNetname(self):
+        return self._name
+
+    def GetNetCode(self):
+        return self._code
+
+    def __init__(self, board, name, code):
+        self._board = board
+        self._name = name
+        self._code = code
+
+
+class _ConnectedItem(object):
+    # Net code and layer, as BOARD_CONNECTED_ITEM
+    def GetNetCode(self):
+        return self._net_code
+
+    def SetNetCode(self, net_code):
+        self._net_code = int(net_code)
+
+    def GetNetname(self):
+        net = self._board._nets.get(self._net_code) if self._board is not None else None
+        return net._name if net is not None else ''
+
+    def GetNet(self):
+        return self._board._nets.get(self._net_code) if self._board is not None else None
+
+    def GetLayer(self):
+        return self._layer
+
+    def SetLayer(self, layer):
+        # Also takes cad.Layer, which SWIG would convert from its value
+        self._layer = int(getattr(layer, 'value', layer))
+
+    def IsOnLayer(self, layer):
+        return self._layer == layer
+
+    def __init__(self, board):
+        self._board = board
+        self._net_code = 0
+        self._layer = F_Cu
+
+
+class TRACK(_ConnectedItem):
+    def GetStart(self):
+        return wxPoint(self._start.x, self._start.y)
+
+    def SetStart(self, pt):
+        self._start = wxPoint(pt.x, pt.y)
+
+    def GetEnd(self):
+        return wxPoint(self._end.x, self._end.y)
+
+    def SetEnd(self, pt):
+        self._end = wxPoint(pt.x, pt.y)
+
+    def GetWidth(self):
+        return self._width
+
+    def SetWidth(self, width):
+        self._width = int(width)
+
+    def __init__(self, board):
+        super(TRACK, self).__init__(board)
+        self._start = wxPoint()
+        self._end = wxPoint()
+        self._width = _iu(0.25)
+
+
+class VIA(TRACK):
+    # A via is a track whose start and end are both its position
+    def GetPosition(self):
+        return wxPoint(self._start.x, self._start.y)
+
+    def SetPosition(self, pt):
+        self._start = wxPoint(pt.x, pt.y)
+        self._end = wxPoint(pt.x, pt.y)
+
+    def SetViaType(self, via_type):
+        self._via_type = via_type
+
+    def GetViaType(self):
+        return self._via_type
+
+    def SetLayerPair(self, top, bottom):
+        self._layers = (int(getattr(top, 'value', top)), int(getattr(bottom, 'value', bottom)))
+
+    def IsOnLayer(self, layer):
+        return layer in self._layers
+
+    def GetDrill(self):
+        return self._drill
+
+    def SetDrill(self, drill):
+        self._drill = int(drill)
+
+    def __init__(self, board):
+        super(VIA, self).__init__(board)
+        self._via_type = VIA_THROUGH
+        self._layers = (F_Cu, B_Cu)
+        self._width = _iu(0.8)
+        self._drill = _iu(0.4)
+
+
+class ZONE_CONTAINER(_ConnectedItem):
+    def Outline(self):
+        return self._outline
+
+    def GetNumCorners(self):
+        return len(self._outline._corners)
+
+    def GetCornerPosition(self, idx):
+        pt = self._outline._corners[idx]
+        return wxPoint(pt.x, pt.y)
+
+    def GetPadConnection(self):
+        return self._pad_connection
+
+    def SetPadConnection(self, pad_connection):
+        self._pad_connection = pad_connection
+
+    def GetCornerSmoothingType(self):
+        return self._smoothing
+
+    def SetCornerSmoothingType(self, smoothing):
+        self._smoothing = smoothing
+
+    def GetCornerRadius(self):
+        return self._corner_radius
+
+    def SetCornerRadius(self, radius):
+        self._corner_radius = int(radius)
+
+    def IsFilled(self):
+        return self._filled
+
+    def SetIsFilled(self, filled):
+        self._filled = bool(filled)
+
+    def FillSegments(self):
+        # There is no copper to compute here, just remember it was asked for
+        self._filled = True
+        return True
+
+    def BuildFilledSolidAreasPolygons(self, board):
+        self._filled = True
+        return True
+
+    def __init__(self, board):
+        super(ZONE_CONTAINER, self).__init__(board)
+        self._outline = CPolyLine()
+        self._pad_connection = PAD_ZONE_CONN_THERMAL
+        self._smoothing = ZONE_SETTINGS.SMOOTHING_NONE
+        self._corner_radius = 0
+        self._filled = False
+
+
+class D_PAD(_ConnectedItem):
+    def GetName(self):
+        return self._name
+
+    def GetPadName(self):
+        return self._name
+
+    def GetPos0(self):
+        return wxPoint(self._pos0.x, self._pos0.y)
+
+    def GetSize(self):
+        return wxSize(self._size.x, self._size.y)
+
+    def GetPosition(self):
+        # pos0 rotated with the module; pcbnew angles are clockwise on screen, in tenths of degree
+        angle = math.radians(self._module._orientation / 10.)
+        c, s = math.cos(angle), math.sin(angle)
+        x, y = self._pos0.x, self._pos0.y
+        return wxPoint(self._module._position.x + int(round(x * c + y * s)),
+                       self._module._position.y + int(round(y * c - x * s)))
+
+    def IsOnLayer(self, layer):
+        return layer in self._layers
+
+    def __init__(self, module, name, pos0, size, layers):
+        super(D_PAD, self).__init__(module._board)
+        self._module = module
+        self._name = name
+        self._pos0 = pos0
+        self._size = size
+        self._layers = set(layers)
+
+
+class MODULE(object):
+    def GetReference(self):
+        return self._reference
+
+    def GetPosition(self):
+        return wxPoint(self._position.x, self._position.y)
+
+    def SetPosition(self, pt):
+        self._position = wxPoint(pt.x, pt.y)
+
+    def GetOrientation(self):
+        return self._orientation
+
+    def SetOrientation(self, orientation):
+        # Normalized to [0, 3600) as pcbnew does
+        self._orientation = float(orientation) % 3600.
+
+    def IsFlipped(self):
+        return self._flipped
+
+    def Flip(self, center):
+        # Mirrors the module about the horizontal line through center, moving it to the other side of the board
+        self._position = wxPoint(self._position.x, 2 * center.y - self._position.y)
+        self._orientation = -self._orientation % 3600.
+        self._flipped = not self._flipped
+        for pad in self._pads:
+            pad._pos0 = wxPoint(pad._pos0.x, -pad._pos0.y)
+            pad._layers = {B_Cu if layer == F_Cu else F_Cu if layer == B_Cu else layer for layer in pad._layers}
+
+    def Pads(self):
+        return list(self._pads)
+
+    def FindPadByName(self, name):
+        return next((pad for pad in self._pads if pad._name == name), None)
+
+    def __init__(self, board, reference, position, orientation=0., flipped=False):
+        self._board = board
+        self._reference = reference
+        self._position = position
+        self._orientation = orientation
+        self._flipped = flipped
+        self._pads = []
+
+
+class BOARD(object):
+    def GetModules(self):
+        return list(self._modules)
+
+    def FindModule(self, reference):
+        return next((modu for modu in self._modules if modu._reference == reference), None)
+
+    def FindNet(self, net):
+        # By code or by name
+        if isinstance(net, int):
+            return self._nets.get(net)
+        return next((info for info in self._nets.values() if info._name == net), None)
+
+    def GetNetCount(self):
+        return len(self._nets)
+
+    def GetTracks(self):
+        return list(self._tracks)
+
+    def Add(self, item):
+        if isinstance(item, MODULE):
+            self._modules.append(item)
+        elif isinstance(item, ZONE_CONTAINER):
+            self._zones.append(item)
+        else:
+            self._tracks.append(item)
+        item._board = self
+
+    def _delete(self, item):
+        if isinstance(item, MODULE):
+            self._modules.remove(item)
+        elif isinstance(item, ZONE_CONTAINER):
+            self._zones.remove(item)
+        else:
+            self._tracks.remove(item)
+
+    def Delete(self, item):
+        self._delete(item)
+
+    def Remove(self, item):
+        # Same as Delete, nothing is freed here anyway
+        self._delete(item)
+
+    def GetAreaCount(self):
+        return len(self._zones)
+
+    def Zones(self):
+        return list(self._zones)
+
+    def GetArea(self, idx):
+        return self._zones[idx]
+
+    def InsertArea(self, net_code, idx, layer, x, y, hatch):
+        zone = ZONE_CONTAINER(self)
+        zone._net_code = int(net_code)
+        zone._layer = int(getattr(layer, 'value', layer))
+        zone._outline._corners.append(wxPoint(x, y))
+        self._zones.insert(idx, zone)
+        return zone
+
+    def GetFileName(self):
+        return self._file_name
+
+    def __init__(self, file_name=''):
+        self._file_name = file_name
+        self._nets = {0: NETINFO_ITEM(self, '', 0)}
+        self._modules = []
+        self._tracks = []
+        self._zones = []
+
+
+class ZONE_FILLER(object):
+    def Fill(self, zones, check=False):
+        for zone in zones:
+            zone._filled = True
+        return True
+
+    def __init__(self, board):
+        self._board = board
+
+
+def _conv_point(node):
+    return wxPoint(round(float(node[1]) * IU_PER_MM), round(float(node[2]) * IU_PER_MM))
+
+
+def _conv_net(node):
+    net = sexpr.find(node, 'net')
+    return int(net[1]) if net is not None else 0
+
+
+def _conv_module(board, node):
+    at = sexpr.find(node, 'at')
+    reference = next(text[2] for text in sexpr.find_all(node, 'fp_text') if text[1] == 'reference')
+    modu = MODULE(board, reference, _conv_point(at), float(at[3]) * 10. if len(at) > 3 else 0.,
+                  sexpr.find(node, 'layer')[1] == 'B.Cu')
+    for pad in sexpr.find_all(node, 'pad'):
+        layers = sexpr.find(pad, 'layers')
+        layers = layers[1:] if layers is not None else []
+        layers = set(_LAYERS.values()) if '*.Cu' in layers else {_LAYERS[name] for name in layers if name in _LAYERS}
+        d_pad = D_PAD(modu, pad[1], _conv_point(sexpr.find(pad, 'at')), wxSize(*_conv_point(sexpr.find(pad, 'size'))),
+                      layers)
+        d_pad._net_code = _conv_net(pad)
+        modu._pads.append(d_pad)
+    return modu
+
+
+def _conv_track(board, node):
+    if node[0] == 'via':
+        trk = VIA(board)
+        trk._start = trk._end = _conv_point(sexpr.find(node, 'at'))
+        trk._width = _iu(sexpr.find(node, 'size')[1])
+        trk._drill = _iu(sexpr.find(node, 'drill')[1])
+    else:
+        trk = TRACK(board)
+        trk._start = _conv_point(sexpr.find(node, 'start'))
+        trk._end = _conv_point(sexpr.find(node, 'end'))
+        trk._width = _iu(sexpr.find(node, 'width')[1])
+        trk._layer = _LAYERS.get(sexpr.find(node, 'layer')[1], F_Cu)
+    trk._net_code = _conv_net(node)
+    return trk
+
+
+def _conv_zone(board, node):
+    zone = ZONE_CONTAINER(board)
+    zone._net_code = _conv_net(node)
+    zone._layer = _LAYERS.get(sexpr.find(node, 'layer')[1], F_Cu)
+    connect_pads = sexpr.find(node, 'connect_pads')
+    if connect_pads is not None and sexpr.has_atom(connect_pads, 'yes'):
+        zone._pad_connection = PAD_ZONE_CONN_FULL
+    fill = sexpr.find(node, 'fill')
+    if fill is not None:
+        smoothing = sexpr.find(fill, 'smoothing')
+        radius = sexpr.find(fill, 'radius')
+        if smoothing is not None and smoothing[1] == 'fillet':
+            zone._smoothing = ZONE_SETTINGS.SMOOTHING_FILLET
+            zone._corner_radius = _iu(radius[1]) if radius is not None else 0
+    for xy in sexpr.find_all(sexpr.find(sexpr.find(node, 'polygon'), 'pts'), 'xy'):
+        zone._outline._corners.append(_conv_point(xy))
+    return zone
+
+
+def _load_board(path):
+    board = BOARD(path)
+    with io.open(path, encoding='utf-8') as stream:
+        for _, node, _, _ in sexpr.iter_nodes(stream):
+            if node[0] == 'net':
+                board._nets[int(node[1])] = NETINFO_ITEM(board, node[2], int(node[1]))
+            elif node[0] == 'module':
+                board._modules.append(_conv_module(board, node))
+            elif node[0] in ('segment', 'via'):
+                board._tracks.append(_conv_track(board, node))
+            elif node[0] == 'zone':
+                board._zones.append(_conv_zone(board, node))
+    return board
+
+
+def LoadBoard(path):
+    # Only what the scripts read: nets, modules with their pads, tracks, vias and zones on copper. Arcs are skipped,
+    # as KiCad 5 cannot load them either. The loaded board becomes the one returned by GetBoard.
+    global _BOARD
+    _BOARD = _load_board(path)
+    return _BOARD
+
+
+def GetBoard():
+    global _BOARD
+    if _BOARD is None:
+        path = os.environ.get('RATCAM_PCBNEW_BOARD')
+        _BOARD = _load_board(path) if path else BOARD()
+    return _BOARD
+
+
+def _counted(name, func):
+    def wrapper(*args, **kwargs):
+        CALLS[name] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def _counted_init(cls, func):
+    def wrapper(self, *args, **kwargs):
+        # Subclasses chain up to this constructor, count them only once
+        if type(self) is cls:
+            CALLS[cls.__name__] += 1
+        func(self, *args, **kwargs)
+    return wrapper
+
+
+def instrument():
+    # From now on count in CALLS every call that would cross into SWIG: module functions, constructors of the items
+    # that scripts create and every method of the board objects. Internally the stand-in only touches attributes,
+    # so the counts are those of the caller.
+    global _INSTRUMENTED
+    if _INSTRUMENTED:
+        return
+    _INSTRUMENTED = True
+    module = sys.modules[__name__]
+    for name in ('FromMM', 'ToMM', 'LoadBoard', 'GetBoard'):
+        setattr(module, name, _counted(name, getattr(module, name)))
+    for cls in (NETINFO_ITEM, _ConnectedItem, TRACK, VIA, ZONE_CONTAINER, D_PAD, MODULE, BOARD, CPolyLine,
+                ZONE_FILLER):
+        owner = 'BOARD_CONNECTED_ITEM' if cls is _ConnectedItem else cls.__name__
+        for name, value in list(vars(cls).items()):
+            if name[0].isupper() and callable(value):
+                setattr(cls, name, _counted('%s.%s' % (owner, name), value))
+    for cls in (TRACK, VIA):
+        cls.__init__ = _counted_init(cls, cls.__init__)
+
+
+def reset_calls():
+    CALLS.clear()
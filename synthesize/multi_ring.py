@@ -0,0 +1,270 @@
+from __future__ import unicode_literals, print_function
+from collections import namedtuple
+from cad import Component, Track, Via, Layer, NetType
+from pcbapi import FromMM
+from polar import Polar
+from radial_illuminator import OPT, dotdict, Stage, setup_defaults, get_spanned_angle, compute_ring_angles, \
+    lay_out_lines, connect_to_ring, ring_arcs, strip_pour, supply_pour, get_nets
+import radial_illuminator
+import math
+
+# Several concentric rings of LED lines, each with its own number of lines and of LEDs per line. Supply rings run in
+# between, alternately power and ground, so that each one feeds the LED rings on both its sides; the supply rings of the
+# same net are joined by vias and radial tracks on B.Cu. Lines and LEDs are numbered across the rings, inside out, as
+# in OPT.lines.res_ref and led_ref: a single ring is laid out, routed and poured as radial_illuminator does.
+
+# n_lines lines, made of a resistor and n_leds LEDs each, around a circle of the given radius
+LedRing = namedtuple('LedRing', ['n_lines', 'n_leds', 'radius'])
+# What setup_rings computes for each LED ring: the names of the components of each line, as (resistor, [LEDs]), the
+# RingAngles and the angle of each component, by name
+RingLayout = namedtuple('RingLayout', ['radius', 'lines', 'angles', 'component_angles'])
+
+OPT.multi_ring = dotdict(
+    # LedRing's, inside out; None for a single ring made after OPT.lines
+    rings=None,
+    # From the innermost (outermost) LED ring to the supply ring inside (outside) it. Between two LED rings, the supply
+    # ring runs halfway.
+    supply_gap=FromMM(3.),
+    # Radial width of the copper pours along each LED ring
+    pour_width=FromMM(3.),
+    # Whether the innermost LED ring takes power from the supply ring outside it; the next one then takes it from the
+    # one inside it, and so on
+    pwr_outside=True,
+    # How many radial tracks join each pair of supply rings of the same net, evenly spread around
+    n_spokes=4
+)
+
+
+def plan_rings(n_lines, n_leds, radius, ring_pitch, line_length):
+    # Spreads n_lines lines of n_leds LEDs on as many LED rings as needed, the first at radius and the next ones
+    # ring_pitch apart. Each ring takes as many lines as fit around it, a line with its gap taking line_length.
+    retval = []
+    while n_lines > 0:
+        n = min(n_lines, max(1, int(2. * math.pi * radius / line_length)))
+        retval.append(LedRing(n, n_leds, radius))
+        n_lines -= n
+        radius += ring_pitch
+    return retval
+
+
+def get_rings():
+    if OPT.multi_ring.rings is None:
+        return [LedRing(OPT.lines.n_lines, OPT.lines.n_leds, OPT.lines.radius)]
+    return list(OPT.multi_ring.rings)
+
+
+def get_ring_lines(rings):
+    # Names of the components of each line, ring by ring
+    retval = []
+    line_idx = 0
+    led_idx = 0
+    for ring in rings:
+        lines = []
+        for _ in range(ring.n_lines):
+            lines.append(('%s%d' % (OPT.lines.res_pfx, line_idx),
+                          ['%s%d' % (OPT.lines.led_pfx, led_idx + i) for i in range(ring.n_leds)]))
+            line_idx += 1
+            led_idx += ring.n_leds
+        retval.append(lines)
+    return retval
+
+
+def get_supply_radii(rings):
+    # One supply ring more than the LED rings, inside out. Each must clear the pours on its sides by a track width.
+    retval = [rings[0].radius - OPT.multi_ring.supply_gap]
+    for inner, outer in zip(rings[:-1], rings[1:]):
+        if outer.radius - inner.radius < OPT.multi_ring.pour_width + 3. * OPT.track_width:
+            raise ValueError('LED rings at radius %g and %g leave no room for a supply ring in between.' %
+                             (inner.radius, outer.radius))
+        retval.append((inner.radius + outer.radius) / 2.)
+    retval.append(rings[-1].radius + OPT.multi_ring.supply_gap)
+    if retval[0] <= 0.:
+        raise ValueError('The innermost supply ring would be at radius %g.' % retval[0])
+    return retval
+
+
+def get_supply_ring(ring_idx, is_res):
+    # Index of the supply ring that the resistors (or the LEDs) of a LED ring connect to
+    outside = (ring_idx % 2 == 0) == OPT.multi_ring.pwr_outside
+    return ring_idx + 1 if outside == is_res else ring_idx
+
+
+def lay_out_ring(board, ring, lines):
+    comps = []
+    for res, leds in lines:
+        comps.append((board.components[res], False))
+        comps += [(board.components[led], True) for led in leds]
+    spanned_angles = {comp.name: get_spanned_angle(comp, ring.radius) for comp, _ in comps}
+    angles = compute_ring_angles(ring.radius, ring.n_lines, ring.n_lines * (ring.n_leds + 1), spanned_angles)
+    if angles.angle_step <= 0.:
+        raise ValueError('%d lines of %d LEDs do not fit at radius %g.' % (ring.n_lines, ring.n_leds, ring.radius))
+    return RingLayout(ring.radius, lines, angles, lay_out_lines(comps, spanned_angles, angles.init_angle,
+                                                                angles.angle_step, angles.separator_spanned_angle))
+
+
+def get_ring_nets(board):
+    # For each LED ring, the nets that run along one of its lines, and the terminals of its lines that lead elsewhere,
+    # i.e. to the supply, along with whether they belong to a resistor. Only the LED strips and the supply nets are
+    # visited.
+    line_of = {}
+    for ring_idx, layout in enumerate(OPT.multi_ring.layout):
+        for line_idx, (res, leds) in enumerate(layout.lines):
+            line_of[res] = (ring_idx, line_idx, True)
+            line_of.update((led, (ring_idx, line_idx, False)) for led in leds)
+    retval = [([], []) for _ in OPT.multi_ring.layout]
+    for net in get_nets(board, NetType.LED_STRIP):
+        lines = set(line_of.get(t.component.name, (None, None, None))[:2] for t in net.terminals)
+        if len(lines) == 1 and (None, None) not in lines:
+            retval[next(iter(lines))[0]][0].append(net)
+    for net in get_nets(board, NetType.GROUND) + get_nets(board, NetType.POWER):
+        for t in net.terminals:
+            if t.component.name in line_of:
+                ring_idx, _, is_res = line_of[t.component.name]
+                retval[ring_idx][1].append((t, is_res))
+    return retval
+
+
+def setup_rings(board):
+    setup_defaults()
+    rings = get_rings()
+    OPT.multi_ring.supply_radii = get_supply_radii(rings)
+    OPT.multi_ring.layout = [lay_out_ring(board, ring, lines) for ring, lines in zip(rings, get_ring_lines(rings))]
+
+
+def place_rings(board):
+    place = Component.place_pads_on_circ if OPT.lines.pad_on_circ else Component.place_radial
+    for layout in OPT.multi_ring.layout:
+        for res, leds in layout.lines:
+            for name, is_led in [(res, False)] + [(led, True) for led in leds]:
+                place(board.components[name], layout.component_angles[name], layout.radius,
+                      orientation=OPT.lines.led_orient if is_led else OPT.lines.res_orient)
+
+
+def route_ring_lines(board):
+    for nets, _ in get_ring_nets(board):
+        for net in nets:
+            if len(net.terminals) != 2:
+                continue
+            del net.tracks[:]
+            net.route_arc(max_error=OPT.arc_max_error)
+
+
+def get_spoke_angles(net_idx, n_nets):
+    # The nets take turns around the circle, so that spokes of different nets never meet
+    period = 2. * math.pi / OPT.multi_ring.n_spokes
+    return [period * (i + (net_idx + 0.5) / n_nets) for i in range(OPT.multi_ring.n_spokes)]
+
+
+def route_supply_rings(board, **kwargs):
+    kwargs.setdefault('max_error', OPT.arc_max_error)
+    kwargs['skip_start'] = False
+    kwargs['include_end'] = True
+    radii = OPT.multi_ring.supply_radii
+    # Net of each supply ring, and the tracks and angles at which the lines reach it
+    nets = [None] * len(radii)
+    tracks = [[] for _ in radii]
+    angles = [[] for _ in radii]
+    for ring_idx, (layout, (_, terminals)) in enumerate(zip(OPT.multi_ring.layout, get_ring_nets(board))):
+        for t, is_res in terminals:
+            supply_idx = get_supply_ring(ring_idx, is_res)
+            if nets[supply_idx] is None:
+                nets[supply_idx] = t.pad.connected_to
+            elif nets[supply_idx] is not t.pad.connected_to:
+                raise ValueError('Supply ring %d would join nets %s and %s.' % (supply_idx, nets[supply_idx].name,
+                                                                                t.pad.connected_to.name))
+            overhang = -layout.angles.rings_overhang if is_res else layout.angles.rings_overhang
+            connection, angle = connect_to_ring(t, overhang, radii[supply_idx], **kwargs)
+            tracks[supply_idx] += connection
+            angles[supply_idx].append(angle)
+    # Supply rings of the same net, in order
+    net_rings = []
+    for supply_idx, net in enumerate(nets):
+        if net is None:
+            continue
+        supply_idxs = next((idxs for other, idxs in net_rings if other is net), None)
+        if supply_idxs is None:
+            del net.tracks[:]
+            supply_idxs = []
+            net_rings.append((net, supply_idxs))
+        supply_idxs.append(supply_idx)
+    # Vias on each supply ring joined to another one, and spokes on B.Cu in between
+    for net_idx, (net, supply_idxs) in enumerate(net_rings):
+        if len(supply_idxs) < 2:
+            continue
+        spoke_angles = get_spoke_angles(net_idx, len(net_rings))
+        for supply_idx in supply_idxs:
+            angles[supply_idx] += spoke_angles
+            tracks[supply_idx] += [Via(Polar(angle, radii[supply_idx]).to_point()) for angle in spoke_angles]
+        for supply_idx1, supply_idx2 in zip(supply_idxs[:-1], supply_idxs[1:]):
+            tracks[supply_idx1] += [Track([Polar(angle, radii[supply_idx1]).to_point(),
+                                           Polar(angle, radii[supply_idx2]).to_point()], Layer.B_Cu)
+                                    for angle in spoke_angles]
+    for supply_idx, net in enumerate(nets):
+        if net is None:
+            continue
+        net.tracks.extend(tracks[supply_idx])
+        # Also every 30 degrees, so that there is always somewhere to attach
+        net.tracks.extend(ring_arcs(set(angles[supply_idx] + [k * math.pi / 6. for k in range(12)]),
+                                    radii[supply_idx], **kwargs))
+        net.flag_routed = True
+    OPT.multi_ring.supply_nets = [net.name if net is not None else None for net in nets]
+
+
+def add_ring_copper_pours(board):
+    supply_pours = []
+    for layout, (nets, terminals) in zip(OPT.multi_ring.layout, get_ring_nets(board)):
+        inner_radius = layout.radius - OPT.multi_ring.pour_width / 2.
+        outer_radius = layout.radius + OPT.multi_ring.pour_width / 2.
+        for net in nets:
+            if len(net.terminals) != 2:
+                continue
+            del net.fills[:]
+            net.fills.append(strip_pour(net, inner_radius, outer_radius))
+        for t, is_res in terminals:
+            overhang = -layout.angles.pours_overhang if is_res else layout.angles.pours_overhang
+            supply_pours.append((t.pad.connected_to, supply_pour(t, overhang, layout.radius, layout.angles.angle_step,
+                                                                 layout.angles.pours_overhang, inner_radius,
+                                                                 outer_radius)))
+    for net in set(net for net, _ in supply_pours):
+        del net.fills[:]
+    for net, fill in supply_pours:
+        net.fills.append(fill)
+
+
+STAGES = [
+    # Lay out every LED ring and the supply rings in between
+    Stage(setup_rings,
+          reads=('multi_ring.rings', 'multi_ring.supply_gap', 'multi_ring.pour_width', 'lines.n_lines', 'lines.n_leds',
+                 'lines.led_pfx', 'lines.res_pfx', 'lines.radius', 'lines.pad_on_circ', 'lines.separator',
+                 'track_width', 'arc_max_error', 'via_diam', 'via_drill_diam'),
+          writes=('multi_ring.supply_radii', 'multi_ring.layout')),
+    # Place all leds and resistors in F.Cu
+    Stage(place_rings,
+          reads=('multi_ring.layout', 'lines.pad_on_circ', 'lines.led_orient', 'lines.res_orient'),
+          writes=('@placement',)),
+    # Connect adjacent pads on F.Cu
+    Stage(route_ring_lines,
+          reads=('@placement', 'multi_ring.layout', 'lines.led_pfx', 'lines.res_pfx', 'connector', 'mosfet',
+                 'test_point_pfx', 'arc_max_error'),
+          writes=('@led_tracks',)),
+    # Bring power and ground to the lines from the supply rings on either side, and join the supply rings
+    Stage(route_supply_rings,
+          reads=('@placement', 'multi_ring.layout', 'multi_ring.supply_radii', 'multi_ring.pwr_outside',
+                 'multi_ring.n_spokes', 'lines.led_pfx', 'lines.res_pfx', 'connector', 'mosfet', 'test_point_pfx',
+                 'track_width', 'arc_max_error'),
+          writes=('@ring_tracks', 'multi_ring.supply_nets')),
+    # Add copper pours on the front face
+    Stage(add_ring_copper_pours,
+          reads=('@placement', '@led_tracks', 'multi_ring.layout', 'multi_ring.pour_width', 'lines.led_pfx',
+                 'lines.res_pfx', 'connector', 'mosfet', 'test_point_pfx', 'track_width', 'arc_max_error',
+                 'pours.parallel_to_comp'),
+          writes=('@fills',)),
+]
+
+
+def synthesize(board, profiler=None):
+    radial_illuminator.synthesize(board, profiler, STAGES)
+
+
+if __name__ == '__main__':
+    radial_illuminator.main(STAGES)
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals, print_function
+from pcbfile import FootprintLibrary, FromPCBFile
+from polar import Point
+import cad
+import connectivity
+import radial_illuminator
+import sexpr
+import argparse
+import io
+import os
+import sys
+
+# The netlists exported from the schematic of the project
+PROJECT_NETLISTS = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Illuminator' + ext)
+                    for ext in ('.net', '.xml')]
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+
+class FromNetlist(object):
+    # Builds a cad.Board out of a netlist exported by eeschema, without any board: components come unplaced, with the
+    # pad geometry of their footprint in the library. Both the S-expression (.net) and the XML (.xml) exports are
+    # streamed, so that only the components and the connections are ever held in memory.
+
+    @staticmethod
+    def _iter_sexpr(path):
+        # Yields ('comp', ref, footprint) and ('net', code, name, [(ref, pin), ...])
+        with io.open(path, encoding='utf-8') as stream:
+            for parents, node, _, _ in sexpr.iter_nodes(stream, depth=2):
+                if parents[1] == 'components' and node[0] == 'comp':
+                    footprint = sexpr.find(node, 'footprint')
+                    yield 'comp', sexpr.find(node, 'ref')[1], footprint[1] if footprint is not None else None
+                elif parents[1] == 'nets' and node[0] == 'net':
+                    yield 'net', int(sexpr.find(node, 'code')[1]), sexpr.find(node, 'name')[1], \
+                        [(sexpr.find(n, 'ref')[1], sexpr.find(n, 'pin')[1]) for n in sexpr.find_all(node, 'node')]
+
+    @staticmethod
+    def _iter_xml(path):
+        # Same as _iter_sexpr. Every element is dropped as soon as it is read, along with what its parent holds of it.
+        parents = []
+        # cElementTree on Python 2 only takes byte strings as event names
+        for event, elem in ElementTree.iterparse(path, events=(str('start'), str('end'))):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if len(parents) != 2:
+                continue
+            if parents[1].tag == 'components' and elem.tag == 'comp':
+                yield 'comp', elem.get('ref'), elem.findtext('footprint')
+            elif parents[1].tag == 'nets' and elem.tag == 'net':
+                yield 'net', int(elem.get('code')), elem.get('name'), \
+                    [(n.get('ref'), n.get('pin')) for n in elem.findall('node')]
+            parents[1].clear()
+
+    @staticmethod
+    def _conv_component(ref, footprint, nets, library):
+        # nets maps each connected pin to its NetPlaceholder
+        pads = [FromPCBFile._conv_library_pad(template,
+                                              nets.get(template.name, cad.NetPlaceholder(name='', code=0)), None)
+                for template in library.get_pads(footprint)]
+        # Everything starts at the origin, flag_placed tells what has been placed since
+        return cad.Component(ref, pads, position=Point(0., 0.), orientation=0., footprint=footprint)
+
+    @staticmethod
+    def _check_footprints(footprints, library):
+        # There is no board to take the pads from: every footprint must be in the library
+        missing = {}
+        for ref, footprint in footprints.items():
+            if footprint is None or library.get_pads(footprint) is None:
+                missing.setdefault(footprint, []).append(ref)
+        if len(missing) > 0:
+            raise ValueError('Footprints not found in any library: %s. Add their libraries to the fp-lib-table of the '
+                             'project, point KISYSMOD to the KiCad footprints or pass the FootprintLibrary to use.' %
+                             ', '.join('%s (%s)' % (footprint if footprint is not None else 'none',
+                                                    ', '.join(sorted(refs)))
+                                       for footprint, refs in sorted(missing.items())))
+
+    @staticmethod
+    def populate(path, library=None):
+        # Same as FromPCBFile.populate, but from a .net or .xml netlist. If no footprint library is given, the one from
+        # the project fp-lib-table is used, along with $KISYSMOD. Raises ValueError if any footprint is not there.
+        if library is None:
+            library = FootprintLibrary.from_project(os.path.dirname(os.path.abspath(path)))
+        records = FromNetlist._iter_xml(path) if path.lower().endswith('.xml') else FromNetlist._iter_sexpr(path)
+        footprints = {}
+        nets = {}
+        for record in records:
+            if record[0] == 'comp':
+                _, ref, footprint = record
+                footprints[ref] = footprint
+                nets.setdefault(ref, {})
+            else:
+                _, code, name, nodes = record
+                for ref, pin in nodes:
+                    nets.setdefault(ref, {})[pin] = cad.NetPlaceholder(name=name, code=code)
+        FromNetlist._check_footprints(footprints, library)
+        board = cad.Board()
+        for ref in sorted(footprints.keys()):
+            board.components[ref] = FromNetlist._conv_component(ref, footprints[ref], nets[ref], library)
+        board.collect_netlist()
+        board.assign_connections()
+        return board
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Checks that netlists load and synthesize into a connected board.')
+    parser.add_argument('netlists', nargs='*', default=PROJECT_NETLISTS,
+                        help='.net or .xml netlists (default: the ones of the project).')
+    parser.add_argument('--lib-table', action='append', default=[], metavar='PATH',
+                        help='More fp-lib-tables, e.g. the global one of KiCad; the one of the project comes first.')
+    parser.add_argument('--search-dir', action='append', default=None, metavar='DIR',
+                        help='Look up libraries missing from the tables as LIBRARY.pretty in here '
+                             '(default: $KISYSMOD).')
+    args = parser.parse_args(argv)
+    failed = 0
+    for path in args.netlists:
+        library = FootprintLibrary.from_project(os.path.dirname(os.path.abspath(path)), args.lib_table,
+                                                args.search_dir)
+        try:
+            board = FromNetlist.populate(path, library=library)
+            radial_illuminator.synthesize(board)
+            # The connector, the MOSFET and the test points are left where they are, i.e. at the origin
+            disconnected = sorted(d.net.name for d in connectivity.check_connectivity(board)
+                                  if sum(1 for island in d.islands if any(t.component.flag_placed for t in island)) > 1)
+        except Exception as e:
+            print('%s: %s: %s' % (path, type(e).__name__, e), file=sys.stderr)
+            failed += 1
+            continue
+        if len(disconnected) > 0:
+            print('%s: disconnected nets %s.' % (path, ', '.join(disconnected)), file=sys.stderr)
+            failed += 1
+        else:
+            print('%s: %d components, %d nets.' % (path, len(board.components), len(board.netlist)), file=sys.stderr)
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,12 @@
 from __future__ import unicode_literals
-from collections import namedtuple
 from polar import *
+from pcbapi import pcbnew as pcb, FromMM
 import cad
-import pcbnew as pcb
+from functools import partial
 import math
 
 
-NetPlaceholder = namedtuple('NetPlaceholder', ['name', 'code'])
-
-
-ORIGIN = Point(pcb.FromMM(100.), pcb.FromMM(100.))
+ORIGIN = Point(FromMM(100.), FromMM(100.))
 
 
 class FromPCB(object):
@@ -26,12 +23,17 @@ class FromPCB(object):
         return Vector(float(pt.x), -float(pt.y))
 
     @staticmethod
-    def _conv_pad(pad):
+    def _conv_pad(pad, flipped):
         name = pad.GetName()
         pos0 = pad.GetPos0()
+        # Pads of flipped modules are stored mirrored, cad.Component mirrors the front side ones by itself
+        if flipped:
+            pos0 = pcb.wxPoint(pos0.x, -pos0.y)
         size = pad.GetSize()
-        net = NetPlaceholder(name=pad.GetNetname(), code=pad.GetNetCode())
-        return cad.Pad(name, offset=FromPCB._conv_vector(pos0), connected_to=net, size=FromPCB._conv_vector(size))
+        net = cad.NetPlaceholder(name=pad.GetNetname(), code=pad.GetNetCode())
+        layers = [layer for layer in cad.Layer if pad.IsOnLayer(layer.value)]
+        return cad.Pad(name, offset=FromPCB._conv_vector(pos0), connected_to=net, size=FromPCB._conv_vector(size),
+                       layers=layers)
 
     @staticmethod
     def _conv_component(modu):
@@ -39,22 +41,22 @@ class FromPCB(object):
         position = modu.GetPosition()
         orientation = modu.GetOrientation()
         flipped = modu.IsFlipped()
-        pads = map(FromPCB._conv_pad, modu.Pads())
+        pads = [FromPCB._conv_pad(pad, flipped) for pad in modu.Pads()]
         return cad.Component(reference, pads, position=FromPCB._conv_point(position),
                              orientation=FromPCB._conv_angle(orientation), flipped=flipped)
 
     @staticmethod
     def _conv_track(trk):
-        start = trk.GetStart()
-        end = trk.GetEnd()
+        start = FromPCB._conv_point(trk.GetStart())
+        end = FromPCB._conv_point(trk.GetEnd())
         layer = trk.GetLayer()
         width = trk.GetWidth()
-        return cad.Track([start, end], cad.Layer(str(layer)), width=width)
+        return cad.Track([start, end], cad.Layer(layer), width=width)
 
     @staticmethod
     def _conv_via(via):
         # Just assume goes from F to B
-        return cad.Via(via.GetPosition(), diameter=via.GetWidth(), drill_diameter=via.GetDrill())
+        return cad.Via(FromPCB._conv_point(via.GetPosition()), diameter=via.GetWidth(), drill_diameter=via.GetDrill())
 
     @staticmethod
     def populate():
@@ -62,23 +64,15 @@ class FromPCB(object):
         for modu in pcb.GetBoard().GetModules():
             comp = FromPCB._conv_component(modu)
             board.components[comp.name] = comp
-        for comp in board.components.values():
-            for pad in comp.pads.values():
-                net_name, net_code = pad.connected_to
-                if net_name is None or net_code is None:
-                    continue
-                terminal = cad.Terminal(comp, pad)
-                if net_name in board.netlist:
-                    board.netlist[net_name].terminals.append(terminal)
-                else:
-                    board.netlist[net_name] = cad.Net(net_name, net_code, [terminal])
+        board.collect_netlist()
         for trk in pcb.GetBoard().GetTracks():
             net_name = trk.GetNetname()
             if net_name in board.netlist:
-                if isinstance(trk, pcb.TRACK):
-                    board.netlist[net_name].tracks.append(FromPCB._conv_track(trk))
-                elif isinstance(trk, pcb.VIA):
+                # Vias are tracks too, check them first
+                if isinstance(trk, pcb.VIA):
                     board.netlist[net_name].tracks.append(FromPCB._conv_via(trk))
+                elif isinstance(trk, pcb.TRACK):
+                    board.netlist[net_name].tracks.append(FromPCB._conv_track(trk))
         for net in board.netlist.values():
             net.assign_connections(board)
         # for area_idx in range(pcb.GetBoard().GetAreaCount()):
@@ -98,47 +92,99 @@ class ToPCB(object):
     def _conv_point(pt):
         return pcb.wxPoint(float(pt.x) + ORIGIN.x, ORIGIN.y - float(pt.y))
 
+    @staticmethod
+    def _conv_xy(x, y):
+        return pcb.wxPoint(float(x) + ORIGIN.x, ORIGIN.y - float(y))
+
     @staticmethod
     def _conv_vector(pt):
         return pcb.wxPoint(float(pt.x), -float(pt.y))
 
+    @staticmethod
+    def _xy_key(pt):
+        return int(pt.x), int(pt.y)
+
+    @staticmethod
+    def _width_key(width):
+        # Items without an explicit width get the board default, so they never match anything and are always rebuilt
+        return int(width) if width is not None else None
+
+    @staticmethod
+    def _segment_key(net_code, layer, width, start, end):
+        return ('segment', net_code, layer, width) + tuple(sorted([ToPCB._xy_key(start), ToPCB._xy_key(end)]))
+
+    @staticmethod
+    def _via_key(net_code, position, diameter, drill_diameter):
+        return 'via', net_code, ToPCB._xy_key(position), diameter, drill_diameter
+
+    @staticmethod
+    def _zone_key(net_code, layer, pad_connection, fillet_radius, corners):
+        return ('zone', net_code, layer, pad_connection, fillet_radius) + tuple(map(ToPCB._xy_key, corners))
+
+    @staticmethod
+    def _board_item_key(elm):
+        # The same key that _conv_track, _conv_via or _conv_fill yield for the cad object that would create elm
+        if isinstance(elm, pcb.VIA):
+            return ToPCB._via_key(elm.GetNetCode(), elm.GetPosition(), elm.GetWidth(), elm.GetDrill())
+        elif isinstance(elm, pcb.TRACK):
+            return ToPCB._segment_key(elm.GetNetCode(), elm.GetLayer(), elm.GetWidth(), elm.GetStart(), elm.GetEnd())
+        fillet_radius = 0
+        if elm.GetCornerSmoothingType() == pcb.ZONE_SETTINGS.SMOOTHING_FILLET:
+            fillet_radius = elm.GetCornerRadius()
+        return ToPCB._zone_key(elm.GetNetCode(), elm.GetLayer(), elm.GetPadConnection(), fillet_radius,
+                               [elm.GetCornerPosition(idx) for idx in range(elm.GetNumCorners())])
+
+    @staticmethod
+    def _add_segment(start, end, layer, width, net_code):
+        t = pcb.TRACK(pcb.GetBoard())
+        t.SetStart(start)
+        t.SetEnd(end)
+        t.SetNetCode(net_code)
+        t.SetLayer(layer)
+        if width is not None:
+            t.SetWidth(width)
+        # t.SetWidth(pcb.FromMM(DEFAULT_TRACK_WIDTH_MM))
+        pcb.GetBoard().Add(t)
+
     @staticmethod
     def _conv_track(track, net_code):
-        if len(track.points) < 2:
+        # Yields (key, build) for every board item needed by track; build() adds it to the board. The pcbnew API this
+        # is written against (KiCad 4 and 5) has no arc tracks, so arcs go as their tessellation.
+        width = ToPCB._width_key(track.width)
+        if len(track.vertices) < 2:
             return
-        old_pt = track.points[0]
-        for pt in track.points[1:]:
-            t = pcb.TRACK(pcb.GetBoard())
-            t.SetStart(ToPCB._conv_point(old_pt))
-            t.SetEnd(ToPCB._conv_point(pt))
-            t.SetNetCode(net_code)
-            t.SetLayer(track.layer)
-            if track.width is not None:
-                t.SetWidth(track.width)
-            # t.SetWidth(pcb.FromMM(DEFAULT_TRACK_WIDTH_MM))
-            pcb.GetBoard().Add(t)
+        conv_pts = [ToPCB._conv_xy(x, y) for x, y in track.vertices]
+        old_pt = conv_pts[0]
+        for pt in conv_pts[1:]:
+            yield ToPCB._segment_key(net_code, track.layer.value, width, old_pt, pt), \
+                partial(ToPCB._add_segment, old_pt, pt, track.layer, track.width, net_code)
             old_pt = pt
 
     @staticmethod
-    def _conv_via(via, net_code):
+    def _add_via(position, diameter, drill_diameter, net_code):
         v = pcb.VIA(pcb.GetBoard())
-        v.SetPosition(ToPCB._conv_point(via.position))
+        v.SetPosition(position)
         v.SetViaType(pcb.VIA_THROUGH)
         v.SetLayerPair(cad.Layer.F_Cu, cad.Layer.B_Cu)
         v.SetNetCode(net_code)
-        if via.diameter is not None:
-            v.SetWidth(via.diameter)
-        if via.drill_diameter is not None:
-            v.SetDrill(via.drill_diameter)
+        if diameter is not None:
+            v.SetWidth(diameter)
+        if drill_diameter is not None:
+            v.SetDrill(drill_diameter)
         # v.SetWidth(pcb.FromMM(DEFAULT_TRACK_WIDTH_MM))
         pcb.GetBoard().Add(v)
 
     @staticmethod
-    def _conv_fill(fill, net_code):
-        conv_pts = list(map(ToPCB._conv_point, fill.points))
-        area = pcb.GetBoard().InsertArea(net_code, pcb.GetBoard().GetAreaCount(), fill.layer,
+    def _conv_via(via, net_code):
+        position = ToPCB._conv_point(via.position)
+        key = ToPCB._via_key(net_code, position, ToPCB._width_key(via.diameter), ToPCB._width_key(via.drill_diameter))
+        yield key, partial(ToPCB._add_via, position, via.diameter, via.drill_diameter, net_code)
+
+    @staticmethod
+    def _add_fill(conv_pts, layer, thermal, fillet_radius, net_code):
+        area = pcb.GetBoard().InsertArea(net_code, pcb.GetBoard().GetAreaCount(), layer,
                                          conv_pts[0].x, conv_pts[0].y, pcb.CPolyLine.DIAGONAL_EDGE)
-        area.SetPadConnection(pcb.PAD_ZONE_CONN_THERMAL if fill.thermal else pcb.PAD_ZONE_CONN_FULL)
+        area.SetPadConnection(pcb.PAD_ZONE_CONN_THERMAL if thermal else pcb.PAD_ZONE_CONN_FULL)
         outline = area.Outline()
         for pt in conv_pts[1:]:
             if getattr(outline, 'AppendCorner', None) is None:
@@ -148,33 +194,79 @@ class ToPCB(object):
                 outline.AppendCorner(pt.x, pt.y)
         if getattr(outline, 'CloseLastContour', None) is not None:
             outline.CloseLastContour()
-        if fill.fillet_radius is not None and fill.fillet_radius > 0.:
+        if fillet_radius > 0:
             area.SetCornerSmoothingType(pcb.ZONE_SETTINGS.SMOOTHING_FILLET)
-            area.SetCornerRadius(int(fill.fillet_radius))
-        # area.BuildFilledSolidAreasPolygons(pcb.GetBoard())
-        area.FillSegments()
+            area.SetCornerRadius(fillet_radius)
+        # Left unfilled, ToPCB.fill_zones fills them all at once
+
+    @staticmethod
+    def _conv_fill(fill, net_code):
+        conv_pts = [ToPCB._conv_xy(x, y) for x, y in fill.vertices]
+        fillet_radius = int(fill.fillet_radius) if fill.fillet_radius is not None and fill.fillet_radius > 0. else 0
+        pad_connection = pcb.PAD_ZONE_CONN_THERMAL if fill.thermal else pcb.PAD_ZONE_CONN_FULL
+        yield ToPCB._zone_key(net_code, fill.layer.value, pad_connection, fillet_radius, conv_pts), \
+            partial(ToPCB._add_fill, conv_pts, fill.layer, fill.thermal, fillet_radius, net_code)
 
     @staticmethod
     def place_component(comp):
+        # Modules that are already in place are left alone
         modu = pcb.GetBoard().FindModule(comp.name)
-        modu.SetPosition(ToPCB._conv_point(comp.position))
-        modu.SetOrientation(ToPCB._conv_angle(comp.orientation))
+        position = ToPCB._conv_point(comp.position)
+        orientation = ToPCB._conv_angle(comp.orientation)
+        # Flipping mirrors the orientation as well, so it goes first
         if modu.IsFlipped() != comp.flipped:
             modu.Flip(modu.GetPosition())
+        if ToPCB._xy_key(modu.GetPosition()) != ToPCB._xy_key(position):
+            modu.SetPosition(position)
+        if abs(math.sin(math.radians((orientation - modu.GetOrientation()) / 10.) / 2.)) > 1e-9:
+            modu.SetOrientation(orientation)
+
+    @staticmethod
+    def fill_zones():
+        # Fills every zone of the board in a single pass of the board wide zone filler (KiCad 5 and later); before that
+        # there is none and zones can only be filled one by one
+        board = pcb.GetBoard()
+        filler = getattr(pcb, 'ZONE_FILLER', None)
+        if filler is not None:
+            filler(board).Fill(board.Zones())
+        else:
+            for idx in range(board.GetAreaCount()):
+                board.GetArea(idx).FillSegments()
 
     @staticmethod
-    def apply(board):
+    def apply(board, incremental=False, fill_zones=True):
+        # With incremental, tracks, vias and zones are matched by geometry against the ones already on the board:
+        # only the missing ones are added and only the ones left over are deleted. Otherwise everything is rebuilt.
+        # Zones are refilled once at the end if anything changed, unless fill_zones is False: then they are left for
+        # pcbnew to fill when needed, which is all a batch export needs.
         for comp in board.components.values():
             ToPCB.place_component(comp)
-        to_delete = list(pcb.GetBoard().GetTracks())
-        to_delete += list(map(pcb.GetBoard().GetArea, range(pcb.GetBoard().GetAreaCount())))
-        for elm in to_delete:
-            pcb.GetBoard().Delete(elm)
+        existing = {}
+        for elm in list(pcb.GetBoard().GetTracks()) + \
+                list(map(pcb.GetBoard().GetArea, range(pcb.GetBoard().GetAreaCount()))):
+            existing.setdefault(ToPCB._board_item_key(elm) if incremental else None, []).append(elm)
+        to_build = []
         for net in board.netlist.values():
             for trk in net.tracks:
                 if isinstance(trk, cad.Track):
-                    ToPCB._conv_track(trk, net.code)
+                    to_build.extend(ToPCB._conv_track(trk, net.code))
                 elif isinstance(trk, cad.Via):
-                    ToPCB._conv_via(trk, net.code)
+                    to_build.extend(ToPCB._conv_via(trk, net.code))
             for fill in net.fills:
-                ToPCB._conv_fill(fill, net.code)
+                to_build.extend(ToPCB._conv_fill(fill, net.code))
+        missing = []
+        for key, build in to_build:
+            if len(existing.get(key, ())) > 0:
+                existing[key].pop()
+            else:
+                missing.append(build)
+        # Leftovers go first, so that the board never holds the stale copper along with the new one
+        changed = len(missing) > 0
+        for elms in existing.values():
+            for elm in elms:
+                pcb.GetBoard().Delete(elm)
+                changed = True
+        for build in missing:
+            build()
+        if changed and fill_zones:
+            ToPCB.fill_zones()
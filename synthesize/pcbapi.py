@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+import os
+
+# Which pcbnew module the scripts use, from RATCAM_PCBNEW:
+#   kicad     the real one (default), only available inside KiCad or with its Python bindings installed;
+#   fake      the in-memory stand-in in fakepcbnew, to run and time the synthesis anywhere;
+#   counting  the stand-in, counting every call to it in fakepcbnew.CALLS.
+PCBNEW = os.environ.get('RATCAM_PCBNEW', 'kicad')
+
+if PCBNEW not in ('kicad', 'fake', 'counting'):
+    raise ImportError('Unknown RATCAM_PCBNEW=%s, use kicad, fake or counting.' % PCBNEW)
+
+# pcbnew internal units are nanometers
+IU_PER_MM = 1000000.
+
+
+def FromMM(mm):
+    # Same as pcbnew.FromMM, for the lengths that are needed before pcbnew is, e.g. the defaults of OPT
+    return int(float(mm) * IU_PER_MM)
+
+
+class _LazyModule(object):
+    # Stands for the pcbnew module, which is only imported on first use: importing the scripts never does, so whatever
+    # does not talk to pcbnew (the .kicad_pcb reader and writer, the sweep) runs without KiCad
+    def _load(self):
+        if self._module is None:
+            if PCBNEW == 'kicad':
+                import pcbnew as module
+            else:
+                import fakepcbnew as module
+                if PCBNEW == 'counting':
+                    module.instrument()
+            self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __init__(self):
+        self._module = None
+
+
+pcbnew = _LazyModule()
@@ -0,0 +1,500 @@
+from __future__ import unicode_literals
+from collections import namedtuple, Counter
+from polar import Point, Vector
+import cad
+import sexpr
+import io
+import itertools
+import math
+import os
+import re
+
+
+# pcbnew internal units are nanometers
+IU_PER_MM = 1000000.
+# Same origin as pcb.ORIGIN, in millimeters
+ORIGIN_MM = Point(100., 100.)
+# First file format version with (arc ...) tracks
+ARC_TRACKS_VERSION = 20200119
+
+PadTemplate = namedtuple('PadTemplate', ['name', 'x', 'y', 'size_x', 'size_y'])
+
+_ENV_VAR_RE = re.compile(r'\$[({](\w+)[)}]')
+_TSTAMP_RE = re.compile(r'\(tstamp ([0-9A-Fa-f]+)\)')
+# Footprint items that have a layer of their own, and those of them with coordinates that flipping mirrors
+_MODULE_ITEMS = ('pad', 'fp_text', 'fp_line', 'fp_circle', 'fp_arc', 'fp_poly', 'fp_curve')
+_MODULE_POINTS = ('start', 'end', 'center')
+
+
+class FootprintLibrary(object):
+    # Footprints by 'Library:Footprint'. A library is looked up by name in paths, as listed by the fp-lib-tables, and
+    # failing that as Library.pretty in each of search_dirs, by default $KISYSMOD, where KiCad keeps its stock ones.
+    def lib_path(self, lib_name):
+        # The folder of the library, or None if it is nowhere to be found
+        if lib_name in self.paths:
+            return self.paths[lib_name]
+        for search_dir in self.search_dirs:
+            lib_path = os.path.join(search_dir, lib_name + '.pretty')
+            if os.path.isdir(lib_path):
+                return lib_path
+        return None
+
+    def _load(self, lib_name, fp_name):
+        lib_path = self.lib_path(lib_name)
+        if lib_path is None:
+            return None
+        fp_path = os.path.join(lib_path, fp_name + '.kicad_mod')
+        if not os.path.isfile(fp_path):
+            return None
+        with io.open(fp_path, encoding='utf-8') as stream:
+            modu = sexpr.parse(stream)
+        pads = []
+        for pad in sexpr.find_all(modu, 'pad'):
+            at = sexpr.find(pad, 'at')
+            size = sexpr.find(pad, 'size')
+            pads.append(PadTemplate(pad[1], float(at[1]), float(at[2]), float(size[1]), float(size[2])))
+        return tuple(pads)
+
+    def get_pads(self, fpid):
+        # Returns the PadTemplates (in millimeters, footprint coordinates) for 'Library:Footprint', or None if the
+        # footprint cannot be found in any of the known libraries. Each footprint is parsed only once.
+        if fpid not in self._cache:
+            lib_name, _, fp_name = fpid.rpartition(':')
+            self._cache[fpid] = self._load(lib_name, fp_name)
+        return self._cache[fpid]
+
+    @staticmethod
+    def _read_lib_table(table_path, project_dir=None):
+        if project_dir is None:
+            project_dir = os.path.dirname(os.path.abspath(table_path))
+
+        def expand(match):
+            if match.group(1) == 'KIPRJMOD':
+                return project_dir
+            return os.environ.get(match.group(1), match.group(0))
+
+        paths = {}
+        with io.open(table_path, encoding='utf-8') as stream:
+            for _, lib, _, _ in sexpr.iter_nodes(stream):
+                if lib[0] != 'lib':
+                    continue
+                name = sexpr.find(lib, 'name')
+                uri = sexpr.find(lib, 'uri')
+                if name is not None and uri is not None:
+                    paths[name[1]] = _ENV_VAR_RE.sub(expand, uri[1])
+        return paths
+
+    @classmethod
+    def from_lib_table(cls, table_path, project_dir=None, search_dirs=None):
+        return cls(FootprintLibrary._read_lib_table(table_path, project_dir), search_dirs)
+
+    @classmethod
+    def from_project(cls, project_dir, lib_tables=(), search_dirs=None):
+        # The libraries in the fp-lib-table of the project, and those in lib_tables, e.g. the global fp-lib-table of
+        # KiCad, for which $KIPRJMOD is project_dir too. As in KiCad, the project table wins over the others, which
+        # win over the ones after them.
+        paths = {}
+        for table_path in list(lib_tables)[::-1] + [os.path.join(project_dir, 'fp-lib-table')]:
+            if os.path.isfile(table_path):
+                paths.update(FootprintLibrary._read_lib_table(table_path, project_dir))
+        return cls(paths, search_dirs)
+
+    def __init__(self, paths=None, search_dirs=None):
+        self.paths = dict(paths) if paths is not None else {}
+        if search_dirs is None:
+            search_dirs = [os.environ['KISYSMOD']] if os.environ.get('KISYSMOD') else []
+        self.search_dirs = list(search_dirs)
+        self._cache = {}
+
+
+class FromPCBFile(object):
+    @staticmethod
+    def _conv_angle(angle):
+        return math.radians(float(angle))
+
+    @staticmethod
+    def _conv_point(x, y):
+        return Point((float(x) - ORIGIN_MM.x) * IU_PER_MM, (ORIGIN_MM.y - float(y)) * IU_PER_MM)
+
+    @staticmethod
+    def _conv_vector(x, y):
+        return Vector(float(x) * IU_PER_MM, -float(y) * IU_PER_MM)
+
+    @staticmethod
+    def _conv_layer(name):
+        return cad.Layer.__members__.get(name.replace('.', '_'))
+
+    @staticmethod
+    def _conv_net(node):
+        net = sexpr.find(node, 'net')
+        return int(net[1]) if net is not None else 0
+
+    @staticmethod
+    def _conv_pad_layers(pad):
+        layers = sexpr.find(pad, 'layers')
+        if layers is None:
+            return None
+        if '*.Cu' in layers[1:]:
+            return list(cad.Layer)
+        return [layer for layer in map(FromPCBFile._conv_layer, layers[1:]) if layer is not None]
+
+    @staticmethod
+    def _conv_pad(pad, net_names, flipped):
+        at = sexpr.find(pad, 'at')
+        size = sexpr.find(pad, 'size')
+        net_code = FromPCBFile._conv_net(pad)
+        net = cad.NetPlaceholder(name=net_names.get(net_code, ''), code=net_code)
+        # Pads of flipped modules are stored mirrored, cad.Component mirrors the front side ones by itself
+        return cad.Pad(pad[1], offset=FromPCBFile._conv_vector(at[1], -float(at[2]) if flipped else at[2]),
+                       connected_to=net,
+                       size=FromPCBFile._conv_vector(size[1], size[2]), layers=FromPCBFile._conv_pad_layers(pad))
+
+    @staticmethod
+    def _conv_library_pad(template, net, layers):
+        # Libraries hold the front side, which is what cad.Component expects also for flipped modules
+        return cad.Pad(template.name, offset=FromPCBFile._conv_vector(template.x, template.y), connected_to=net,
+                       size=FromPCBFile._conv_vector(template.size_x, template.size_y), layers=layers)
+
+    @staticmethod
+    def _conv_component(modu, net_names, library):
+        reference = next(text[2] for text in sexpr.find_all(modu, 'fp_text') if text[1] == 'reference')
+        at = sexpr.find(modu, 'at')
+        orientation = at[3] if len(at) > 3 else 0.
+        flipped = (sexpr.find(modu, 'layer')[1] == 'B.Cu')
+        pads = [FromPCBFile._conv_pad(pad, net_names, flipped) for pad in sexpr.find_all(modu, 'pad')]
+        templates = library.get_pads(modu[1]) if library is not None else None
+        if templates is not None:
+            # Geometry from the library, connections and (flipped) layers from the board
+            nets = {pad.name: pad.connected_to for pad in pads}
+            layers = {pad.name: pad.layers for pad in pads}
+            pads = [FromPCBFile._conv_library_pad(template,
+                                                  nets.get(template.name, cad.NetPlaceholder(name='', code=0)),
+                                                  layers.get(template.name))
+                    for template in templates]
+        return cad.Component(reference, pads, position=FromPCBFile._conv_point(at[1], at[2]),
+                             orientation=FromPCBFile._conv_angle(orientation), flipped=flipped, footprint=modu[1])
+
+    @staticmethod
+    def _conv_track(trk):
+        start = sexpr.find(trk, 'start')
+        end = sexpr.find(trk, 'end')
+        layer = FromPCBFile._conv_layer(sexpr.find(trk, 'layer')[1])
+        width = float(sexpr.find(trk, 'width')[1]) * IU_PER_MM
+        return cad.Track([FromPCBFile._conv_point(start[1], start[2]), FromPCBFile._conv_point(end[1], end[2])],
+                         layer, width=width)
+
+    @staticmethod
+    def _conv_arc(arc):
+        start = sexpr.find(arc, 'start')
+        mid = sexpr.find(arc, 'mid')
+        end = sexpr.find(arc, 'end')
+        layer = FromPCBFile._conv_layer(sexpr.find(arc, 'layer')[1])
+        width = float(sexpr.find(arc, 'width')[1]) * IU_PER_MM
+        return cad.ArcTrack.through_points(FromPCBFile._conv_point(start[1], start[2]),
+                                           FromPCBFile._conv_point(mid[1], mid[2]),
+                                           FromPCBFile._conv_point(end[1], end[2]), layer, width=width)
+
+    @staticmethod
+    def _conv_via(via):
+        # Just assume goes from F to B
+        at = sexpr.find(via, 'at')
+        return cad.Via(FromPCBFile._conv_point(at[1], at[2]),
+                       diameter=float(sexpr.find(via, 'size')[1]) * IU_PER_MM,
+                       drill_diameter=float(sexpr.find(via, 'drill')[1]) * IU_PER_MM)
+
+    @staticmethod
+    def _conv_fill(zone):
+        pts = sexpr.find(sexpr.find(zone, 'polygon'), 'pts')
+        fill = sexpr.find(zone, 'fill')
+        fillet_radius = 0.
+        if fill is not None:
+            smoothing = sexpr.find(fill, 'smoothing')
+            radius = sexpr.find(fill, 'radius')
+            if smoothing is not None and smoothing[1] == 'fillet' and radius is not None:
+                fillet_radius = float(radius[1]) * IU_PER_MM
+        retval = cad.Fill([FromPCBFile._conv_point(xy[1], xy[2]) for xy in sexpr.find_all(pts, 'xy')],
+                          FromPCBFile._conv_layer(sexpr.find(zone, 'layer')[1]), fillet_radius=fillet_radius)
+        connect_pads = sexpr.find(zone, 'connect_pads')
+        retval.thermal = connect_pads is None or not sexpr.has_atom(connect_pads, 'yes')
+        return retval
+
+    @staticmethod
+    def populate(path, library=None):
+        # Same as FromPCB.populate, but straight from a .kicad_pcb file. If no footprint library is given, the one
+        # from the project fp-lib-table is used; pad geometry then comes from there whenever the footprint is found.
+        if library is None:
+            library = FootprintLibrary.from_project(os.path.dirname(os.path.abspath(path)))
+        board = cad.Board()
+        net_names = {}
+        copper = []
+        with io.open(path, encoding='utf-8') as stream:
+            for _, node, _, _ in sexpr.iter_nodes(stream):
+                if node[0] == 'net':
+                    net_names[int(node[1])] = node[2]
+                elif node[0] == 'module':
+                    comp = FromPCBFile._conv_component(node, net_names, library)
+                    board.components[comp.name] = comp
+                elif node[0] == 'segment':
+                    copper.append((FromPCBFile._conv_net(node), FromPCBFile._conv_track(node)))
+                elif node[0] == 'arc':
+                    copper.append((FromPCBFile._conv_net(node), FromPCBFile._conv_arc(node)))
+                elif node[0] == 'via':
+                    copper.append((FromPCBFile._conv_net(node), FromPCBFile._conv_via(node)))
+                elif node[0] == 'zone':
+                    copper.append((FromPCBFile._conv_net(node), FromPCBFile._conv_fill(node)))
+        board.collect_netlist()
+        for net_code, elm in copper:
+            net = board.netlist.get(net_names.get(net_code))
+            if net is None:
+                continue
+            if isinstance(elm, cad.Fill):
+                net.fills.append(elm)
+            else:
+                net.tracks.append(elm)
+        board.assign_connections()
+        return board
+
+
+class ToPCBFile(object):
+    @staticmethod
+    def _fmt(value, digits=6):
+        retval = ('%.*f' % (digits, value)).rstrip('0').rstrip('.')
+        return '0' if retval in ('', '-0') else retval
+
+    @staticmethod
+    def _conv_angle(angle):
+        return math.degrees(float(angle))
+
+    @staticmethod
+    def _conv_xy(x, y):
+        return '%s %s' % (ToPCBFile._fmt(float(x) / IU_PER_MM + ORIGIN_MM.x),
+                          ToPCBFile._fmt(ORIGIN_MM.y - float(y) / IU_PER_MM))
+
+    @staticmethod
+    def _conv_length(length):
+        return ToPCBFile._fmt(float(length) / IU_PER_MM)
+
+    @staticmethod
+    def _conv_layer(layer):
+        return layer.name.replace('_', '.')
+
+    @staticmethod
+    def _conv_track(track, net_code, setup, out):
+        if len(track.vertices) < 2:
+            return
+        width = ToPCBFile._conv_length(track.width) if track.width is not None else setup['last_trace_width']
+        layer = ToPCBFile._conv_layer(track.layer)
+        conv_pts = [ToPCBFile._conv_xy(x, y) for x, y in track.vertices]
+        old_pt = conv_pts[0]
+        for pt in conv_pts[1:]:
+            out.append('  (segment (start %s) (end %s) (width %s) (layer %s) (net %d))\n' %
+                       (old_pt, pt, width, layer, net_code))
+            old_pt = pt
+
+    @staticmethod
+    def _conv_arc(arc, net_code, setup, out):
+        width = ToPCBFile._conv_length(arc.width) if arc.width is not None else setup['last_trace_width']
+        out.append('  (arc (start %s) (mid %s) (end %s) (width %s) (layer %s) (net %d))\n' %
+                   (ToPCBFile._conv_xy(arc.start.x, arc.start.y), ToPCBFile._conv_xy(arc.mid.x, arc.mid.y),
+                    ToPCBFile._conv_xy(arc.end.x, arc.end.y), width, ToPCBFile._conv_layer(arc.layer), net_code))
+
+    @staticmethod
+    def _conv_via(via, net_code, setup, out):
+        size = ToPCBFile._conv_length(via.diameter) if via.diameter is not None else setup['via_size']
+        drill = ToPCBFile._conv_length(via.drill_diameter) if via.drill_diameter is not None else setup['via_drill']
+        out.append('  (via (at %s) (size %s) (drill %s) (layers F.Cu B.Cu) (net %d))\n' %
+                   (ToPCBFile._conv_xy(via.position.x, via.position.y), size, drill, net_code))
+
+    @staticmethod
+    def _conv_fill(fill, net, setup, tstamps, out):
+        clearance = setup['zone_clearance']
+        out.append('  (zone (net %d) (net_name %s) (layer %s) (tstamp %X) (hatch edge 0.508)\n' %
+                   (net.code, sexpr.quote(net.name), ToPCBFile._conv_layer(fill.layer), next(tstamps)))
+        out.append('    (connect_pads%s (clearance %s))\n' % ('' if fill.thermal else ' yes', clearance))
+        out.append('    (min_thickness 0.254)\n')
+        # Zones are written unfilled, pcbnew fills them when needed
+        if fill.fillet_radius is not None and fill.fillet_radius > 0.:
+            out.append('    (fill (arc_segments 16) (thermal_gap %s) (thermal_bridge_width %s) (smoothing fillet) '
+                       '(radius %s))\n' % (clearance, clearance, ToPCBFile._conv_length(fill.fillet_radius)))
+        else:
+            out.append('    (fill (arc_segments 16) (thermal_gap %s) (thermal_bridge_width %s))\n' %
+                       (clearance, clearance))
+        out.append('    (polygon\n      (pts\n')
+        for i in range(0, len(fill.vertices), 5):
+            out.append('        %s\n' % ' '.join('(xy %s)' % ToPCBFile._conv_xy(x, y)
+                                                 for x, y in fill.vertices[i:i + 5]))
+        out.append('      )\n    )\n  )\n')
+
+    @staticmethod
+    def _dump(node):
+        return '(%s)' % ' '.join(ToPCBFile._dump(child) if isinstance(child, list) else sexpr.quote(child)
+                                 for child in node)
+
+    @staticmethod
+    def _conv_at(xy, angle):
+        angle = ToPCBFile._fmt(angle % 360., 7)
+        return '(at %s)' % xy if angle in ('0', '360') else '(at %s %s)' % (xy, angle)
+
+    @staticmethod
+    def _flip_layer(name):
+        # F.Cu and B.Cu, F.SilkS and B.SilkS and so on swap; *.Cu, Edge.Cuts and the like stay
+        if name.startswith('F.'):
+            return 'B.' + name[2:]
+        if name.startswith('B.'):
+            return 'F.' + name[2:]
+        return name
+
+    @staticmethod
+    def _mirror_point(node):
+        # (head x y ...) mirrored about the x axis of the module, i.e. the y axis of the file
+        return [node[0], node[1], ToPCBFile._fmt(-float(node[2]))] + node[3:]
+
+    @staticmethod
+    def _mirror_effects(node):
+        # Texts on the back side read mirrored
+        justify = sexpr.find(node, 'justify')
+        retval = [child for child in node if child is not justify]
+        atoms = [atom for atom in (justify[1:] if justify is not None else []) if atom != 'mirror']
+        if justify is None or 'mirror' not in justify[1:]:
+            atoms.append('mirror')
+        if len(atoms) > 0:
+            retval.append(['justify'] + atoms)
+        return retval
+
+    @staticmethod
+    def _module_edits(comp, modu_text, old_orientation, flip):
+        # Yields (start, end, text) for the nodes of a module that moving it to comp, and flipping it if flip, changes.
+        # Pads and texts carry absolute orientations. Flipping mirrors the pads and the graphics about the x axis of
+        # the module and swaps the side of their layers, as pcbnew does; the orientation is then set to the one of
+        # comp, the same as ToPCB.place_component.
+        new_orientation = ToPCBFile._conv_angle(comp.orientation) % 360.
+        lines = modu_text.splitlines(True)
+        for parents, node, start, end in sexpr.iter_nodes(lines, depth=1):
+            if node[0] == 'at':
+                yield start, end, ToPCBFile._conv_at(ToPCBFile._conv_xy(comp.position.x, comp.position.y),
+                                                     new_orientation)
+            elif node[0] == 'layer' and flip:
+                yield start, end, ToPCBFile._dump([node[0], ToPCBFile._flip_layer(node[1])])
+        for parents, node, start, end in sexpr.iter_nodes(lines, depth=2):
+            parent, head = parents[1], node[0]
+            if head == 'at' and parent in ('pad', 'fp_text'):
+                angle = float(node[3]) if len(node) > 3 else 0.
+                if flip:
+                    # Relative to the module, the angle is mirrored too
+                    node = ToPCBFile._mirror_point(node)
+                    angle = new_orientation - (angle - old_orientation)
+                else:
+                    angle += new_orientation - old_orientation
+                yield start, end, ToPCBFile._conv_at('%s %s' % (node[1], node[2]), angle)
+            elif not flip or parent not in _MODULE_ITEMS:
+                continue
+            elif head in ('layer', 'layers'):
+                yield start, end, ToPCBFile._dump([head] + list(map(ToPCBFile._flip_layer, node[1:])))
+            elif head in _MODULE_POINTS:
+                yield start, end, ToPCBFile._dump(ToPCBFile._mirror_point(node))
+            elif head == 'angle' and parent == 'fp_arc':
+                yield start, end, ToPCBFile._dump([head, ToPCBFile._fmt(-float(node[1]))])
+            elif head == 'effects' and parent == 'fp_text':
+                yield start, end, ToPCBFile._dump(ToPCBFile._mirror_effects(node))
+        if not flip:
+            return
+        # One point at a time, so that polygons keep their line breaks
+        for parents, node, start, end in sexpr.iter_nodes(lines, depth=3):
+            if parents[1] in _MODULE_ITEMS and parents[2] == 'pts' and node[0] == 'xy':
+                yield start, end, ToPCBFile._dump(ToPCBFile._mirror_point(node))
+
+    @staticmethod
+    def _conv_component(comp, modu, modu_text):
+        at = sexpr.find(modu, 'at')
+        old_position = FromPCBFile._conv_point(at[1], at[2])
+        old_orientation = float(at[3]) if len(at) > 3 else 0.
+        flip = (sexpr.find(modu, 'layer')[1] == 'B.Cu') != comp.flipped
+        delta = ToPCBFile._conv_angle(comp.orientation) - old_orientation
+        if not flip and abs(comp.position.x - old_position.x) < 1. and abs(comp.position.y - old_position.y) < 1. and \
+                abs(math.sin(math.radians(delta) / 2.)) < 1e-9:
+            return modu_text
+        # Replace from the last span so that offsets stay valid
+        pieces = []
+        last = len(modu_text)
+        for start, end, text in sorted(ToPCBFile._module_edits(comp, modu_text, old_orientation, flip),
+                                       key=lambda x: -x[0]):
+            pieces.append(modu_text[end:last])
+            pieces.append(text)
+            last = start
+        pieces.append(modu_text[:last])
+        return ''.join(reversed(pieces))
+
+    @staticmethod
+    def _conv_copper(board, setup, native_arcs, tstamps):
+        # Arcs are tessellated unless the file format supports them; zones take their tstamps from tstamps
+        out = []
+        for net in board.netlist.values():
+            for trk in net.tracks:
+                if isinstance(trk, cad.ArcTrack) and native_arcs:
+                    ToPCBFile._conv_arc(trk, net.code, setup, out)
+                elif isinstance(trk, cad.Track):
+                    ToPCBFile._conv_track(trk, net.code, setup, out)
+                elif isinstance(trk, cad.Via):
+                    ToPCBFile._conv_via(trk, net.code, setup, out)
+        for net in board.netlist.values():
+            for fill in net.fills:
+                ToPCBFile._conv_fill(fill, net, setup, tstamps, out)
+        return out
+
+    @staticmethod
+    def write(board, source_path, dest_path):
+        # Same as ToPCB.apply, but writes a .kicad_pcb file: every segment, arc, via and zone of the source is replaced
+        # by the content of the board, modules are moved in place, everything else is copied over verbatim.
+        with io.open(source_path, encoding='utf-8') as stream:
+            text = stream.read()
+        setup = {'last_trace_width': '0.25', 'via_size': '0.8', 'via_drill': '0.4', 'zone_clearance': '0.508'}
+        out = []
+        copper_pos = None
+        modules = []
+        version = 0
+        last = 0
+        for _, node, start, end in sexpr.iter_nodes(text.splitlines(True)):
+            if node[0] == 'version':
+                version = int(node[1])
+            elif node[0] == 'setup':
+                for key in setup.keys():
+                    value = sexpr.find(node, key)
+                    if value is not None:
+                        setup[key] = value[1]
+            elif node[0] in ('segment', 'arc', 'via', 'zone'):
+                # Drop the record along with its indentation and line break
+                line_start = max(last, text.rfind('\n', 0, start) + 1)
+                if text[line_start:start].strip():
+                    line_start = start
+                out.append(text[last:line_start])
+                if copper_pos is None:
+                    copper_pos = len(out)
+                    out.append(None)
+                last = end + 1 if text[end:end + 1] == '\n' else end
+            elif node[0] == 'module':
+                out.append(text[last:start])
+                modules.append((len(out), node))
+                out.append(text[start:end])
+                last = end
+        if copper_pos is None:
+            # Right before the closing parenthesis of the root
+            root_end = text.rindex(')')
+            out.append(text[last:root_end])
+            last = root_end
+            copper_pos = len(out)
+            out.append(None)
+        out.append(text[last:])
+        # Zones need a tstamp of their own, past every one already in the file
+        tstamps = itertools.count(max([int(tstamp, 16) for tstamp in _TSTAMP_RE.findall(text)] + [0]) + 1)
+        out[copper_pos] = ''.join(ToPCBFile._conv_copper(board, setup, version >= ARC_TRACKS_VERSION, tstamps))
+        # Modules sharing the same reference cannot be told apart, leave them as they are
+        references = [next(t[2] for t in sexpr.find_all(node, 'fp_text') if t[1] == 'reference')
+                      for _, node in modules]
+        reference_counts = Counter(references)
+        for (idx, node), reference in zip(modules, references):
+            comp = board.components.get(reference)
+            if comp is None or comp.position is None or comp.orientation is None or reference_counts[reference] > 1:
+                continue
+            out[idx] = ToPCBFile._conv_component(comp, node, out[idx])
+        with io.open(dest_path, 'w', encoding='utf-8', newline='\n') as stream:
+            stream.write(''.join(out))
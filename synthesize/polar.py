@@ -1,8 +1,13 @@
 from __future__ import print_function, unicode_literals
+from collections import namedtuple
+import itertools
 import math
+import numpy as np
 
 
-class Vector(object):
+class Vector(namedtuple('Vector', ['dx', 'dy'])):
+    __slots__ = ()
+
     def __add__(self, other):
         if isinstance(other, Vector):
             return Vector(self.dx + other.dx, self.dy + other.dy)
@@ -32,11 +37,26 @@ class Vector(object):
             raise TypeError()
         return Vector(float(other) * self.dx, float(other) * self.dy)
 
+    # Otherwise tuple repetition kicks in
+    __rmul__ = __mul__
+
     def __div__(self, other):
         if not isinstance(other, float) or isinstance(other, int):
             raise TypeError()
         return Vector(self.dx / float(other), self.dy / float(other))
 
+    def __eq__(self, other):
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return self.dx == other.dx and self.dy == other.dy
+
+    def __ne__(self, other):
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return self.dx != other.dx or self.dy != other.dy
+
+    __hash__ = tuple.__hash__
+
     def __repr__(self):
         return 'Vector(%f, %f)' % (self.dx, self.dy)
 
@@ -63,25 +83,23 @@ class Vector(object):
         return Polar(a if self.dy >= 0. else 2. * math.pi - a, norm)
 
     def change(self, **kwargs):
-        retval = Vector(self.dx, self.dy)
-        for k, v in kwargs.items():
-            setattr(retval, k, v)
-        return retval
+        return self._replace(**kwargs)
 
     def rotated(self, angle):
-        pol = self.to_polar()
-        pol.a += angle
-        return pol.to_point().to_vector()
+        c = math.cos(angle)
+        s = math.sin(angle)
+        return Vector(c * self.dx - s * self.dy, s * self.dx + c * self.dy)
 
     def flipped(self, flip_x=False, flip_y=False):
         return Vector(-self.dx if flip_x else self.dx, -self.dy if flip_y else self.dy)
 
-    def __init__(self, dx=0., dy=0.):
-        self.dx = dx
-        self.dy = dy
+    def __new__(cls, dx=0., dy=0.):
+        return super(Vector, cls).__new__(cls, dx, dy)
 
 
-class Point(object):
+class Point(namedtuple('Point', ['x', 'y'])):
+    __slots__ = ()
+
     def __add__(self, other):
         if not isinstance(other, Vector):
             raise TypeError()
@@ -105,6 +123,9 @@ class Point(object):
             raise TypeError()
         return Point(float(other) * self.x, float(other) * self.y)
 
+    # Otherwise tuple repetition kicks in
+    __rmul__ = __mul__
+
     def __div__(self, other):
         if not isinstance(other, float) or isinstance(other, int):
             raise TypeError()
@@ -112,14 +133,16 @@ class Point(object):
 
     def __eq__(self, other):
         if not isinstance(other, Point):
-            raise TypeError()
+            return NotImplemented
         return self.x == other.x and self.y == other.y
 
     def __ne__(self, other):
         if not isinstance(other, Point):
-            raise TypeError()
+            return NotImplemented
         return self.x != other.x or self.y != other.y
 
+    __hash__ = tuple.__hash__
+
     def __repr__(self):
         return 'Point(%f, %f)' % (self.x, self.y)
 
@@ -127,10 +150,7 @@ class Point(object):
         return repr(self)
 
     def change(self, **kwargs):
-        retval = Point(self.x, self.y)
-        for k, v in kwargs.items():
-            setattr(retval, k, v)
-        return retval
+        return self._replace(**kwargs)
 
     def to_vector(self):
         return Vector(self.x, self.y)
@@ -138,21 +158,20 @@ class Point(object):
     def to_polar(self):
         return self.to_vector().to_polar()
 
-    def __init__(self, x=0., y=0.):
-        self.x = x
-        self.y = y
+    def __new__(cls, x=0., y=0.):
+        return super(Point, cls).__new__(cls, x, y)
+
 
+class Polar(namedtuple('Polar', ['a', 'r'])):
+    __slots__ = ()
 
-class Polar(object):
     def to_point(self):
         return Point(math.cos(self.a) * self.r, math.sin(self.a) * self.r)
 
     def angle_to(self, other):
         if not isinstance(other, Polar):
             raise TypeError()
-        self._normalize()
-        other._normalize()
-        delta = other.a - self.a
+        delta = other.normalized().a - self.normalized().a
         # Always return the shortest
         if delta < -math.pi:
             return delta + 2. * math.pi
@@ -169,24 +188,20 @@ class Polar(object):
         return chord.endpoints[0 if shift >= 0 else 1]
 
     def change(self, **kwargs):
-        retval = Polar(self.a, self.r)
-        for k, v in kwargs.items():
-            setattr(retval, k, v)
-        return retval
+        return self._replace(**kwargs)
 
     def __eq__(self, other):
         if not isinstance(other, Polar):
-            raise TypeError()
-        self._normalize()
-        other._normalize()
-        return self.a == other.a and self.r == other.r
+            return NotImplemented
+        return tuple.__eq__(self.normalized(), other.normalized())
 
     def __ne__(self, other):
         if not isinstance(other, Polar):
-            raise TypeError()
-        self._normalize()
-        other._normalize()
-        return self.a != other.a or self.r != other.r
+            return NotImplemented
+        return tuple.__ne__(self.normalized(), other.normalized())
+
+    def __hash__(self):
+        return tuple.__hash__(self.normalized())
 
     def __repr__(self):
         return 'Polar(%f, %f)' % (self.a, self.r)
@@ -194,25 +209,22 @@ class Polar(object):
     def __str__(self):
         return repr(self)
 
-    def _normalize(self):
+    def normalized(self):
+        # Same point, with a positive radius and the angle in [0, 2pi)
         if self.r < 0.:
-            self.a += math.pi
-            self.r = -self.r
-        self.a = normalize_angle(self.a)
+            return Polar(normalize_angle(self.a + math.pi), -self.r)
+        return Polar(normalize_angle(self.a), self.r)
 
-    def __init__(self, a=0., r=0.):
-        self.a = a
-        self.r = r
+    def __new__(cls, a=0., r=0.):
+        return super(Polar, cls).__new__(cls, a, r)
 
 
-class Chord(object):
-    @property
-    def aperture(self):
-        return 2. * self._half_aperture
+class Chord(namedtuple('Chord', ['radius', 'aperture', 'declination'])):
+    __slots__ = ()
 
-    @aperture.setter
-    def aperture(self, x):
-        self._half_aperture = x / 2.
+    @property
+    def _half_aperture(self):
+        return self.aperture / 2.
 
     @property
     def distance_to_origin(self):
@@ -224,7 +236,7 @@ class Chord(object):
 
     @property
     def center(self):
-        return Polar(self.declination, self.distance_to_origin())
+        return Polar(self.declination, self.distance_to_origin)
 
     @property
     def endpoints(self):
@@ -241,28 +253,35 @@ class Chord(object):
         return self.with_radius(Vector(distance, self.length / 2.).l2())
 
     def change(self, **kwargs):
-        retval = Chord(self.radius, self.aperture, self.declination)
-        for k, v in kwargs.items():
-            setattr(retval, k, v)
-        return retval
+        return self._replace(**kwargs)
 
     @classmethod
     def from_length_and_distance(cls, distance, length, declination=0.):
         return Chord(Vector(distance, float(length) / 2.).l2(), 0., declination).with_length(length)
 
+    def __eq__(self, other):
+        if not isinstance(other, Chord):
+            return NotImplemented
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        if not isinstance(other, Chord):
+            return NotImplemented
+        return tuple.__ne__(self, other)
+
+    __hash__ = tuple.__hash__
+
     def __repr__(self):
         return 'Chord(%f, %f, %f)' % (self.radius, self.aperture, self.declination)
 
     def __str__(self):
         return repr(self)
 
-    def __init__(self, radius=0., aperture=0., declination=0.):
-        self.radius = radius
-        self._half_aperture = aperture / 2.
-        self.declination = declination
+    def __new__(cls, radius=0., aperture=0., declination=0.):
+        return super(Chord, cls).__new__(cls, radius, aperture, declination)
 
 
-def apx_unit_interval(skip_start=False, include_end=False, resolution=None, steps=None):
+def apx_unit_interval_array(skip_start=False, include_end=False, resolution=None, steps=None):
     if resolution is not None:
         if resolution <= 0.:
             raise ValueError()
@@ -270,33 +289,167 @@ def apx_unit_interval(skip_start=False, include_end=False, resolution=None, step
     if steps < 0:
         raise ValueError()
     elif steps == 0:
-        return
-    for i in range(1 if skip_start else 0, steps):
-        yield float(i) / float(steps)
-    if include_end:
-        yield 1.
+        return np.empty(0)
+    return np.arange(1 if skip_start else 0, steps + 1 if include_end else steps, dtype=float) / float(steps)
+
+
+def apx_unit_interval(skip_start=False, include_end=False, resolution=None, steps=None):
+    for x in apx_unit_interval_array(skip_start=skip_start, include_end=include_end, resolution=resolution,
+                                     steps=steps):
+        yield float(x)
+
+
+def _as_polar_pair(p):
+    # Accepts a Polar or any (a, r) pair, returns the normalized (a, r) floats
+    if isinstance(p, Polar):
+        a, r = p.a, p.r
+    else:
+        a, r = p
+    if r < 0.:
+        a += math.pi
+        r = -r
+    return normalize_angle(float(a)), float(r)
+
+
+def _shortest_angle(a1, a2):
+    delta = a2 - a1
+    if delta < -math.pi:
+        return delta + 2. * math.pi
+    elif delta > math.pi:
+        return delta - 2. * math.pi
+    else:
+        return delta
+
+
+def sagitta_steps(radius, da, max_error):
+    # Number of chords needed so that none of them is farther than max_error from an arc of the given radius and span
+    if max_error <= 0.:
+        raise ValueError()
+    radius = abs(radius)
+    if radius <= max_error:
+        return 1
+    max_step = 2. * math.acos(1. - max_error / radius)
+    return max(1, int(math.ceil(abs(da) / max_step)))
+
+
+def _arc_steps(r, da, resolution, steps, max_error):
+    # The (steps, resolution) to give to apx_unit_interval_array, in order of precedence the given steps, the least
+    # that keeps the chords within max_error from the arc, or the ones given by the angular resolution
+    if steps is None and max_error is not None:
+        return sagitta_steps(r, da, max_error), None
+    elif steps is None and resolution is not None and abs(da) > math.pi / 3600.:
+        return int(math.ceil(abs(da / resolution))), None
+    return steps, resolution
+
+
+# [last use, table] of each unit_arc_table by (span, steps, skip_start, include_end)
+_UNIT_ARC_TABLES = {}
+_UNIT_ARC_TABLES_CLOCK = itertools.count()
+UNIT_ARC_TABLES_SIZE = 1024
+
+
+def unit_arc_table(da, skip_start=False, include_end=False, resolution=None, steps=None):
+    # (x, xy) arrays of a unit arc starting at angle 0 and spanning da: x are the apx_unit_interval_array points, xy the
+    # (N, 2) array of their (cos, sin) rows. The same spans and steps recur over and over, so they are cached; the
+    # arrays are shared and read only.
+    if resolution is not None:
+        if resolution <= 0.:
+            raise ValueError()
+        steps = int(math.ceil(abs(1. / resolution)))
+    key = (float(da), steps, skip_start, include_end)
+    entry = _UNIT_ARC_TABLES.get(key)
+    if entry is None:
+        if len(_UNIT_ARC_TABLES) >= UNIT_ARC_TABLES_SIZE:
+            # Evict the least recently used half at once, so that hits only have to bump a counter
+            by_last_use = sorted(_UNIT_ARC_TABLES.keys(), key=lambda k: _UNIT_ARC_TABLES[k][0])
+            for old_key in by_last_use[:len(by_last_use) // 2]:
+                del _UNIT_ARC_TABLES[old_key]
+        x = apx_unit_interval_array(skip_start=skip_start, include_end=include_end, steps=steps)
+        xy = np.empty((len(x), 2))
+        np.cos(x * da, out=xy[:, 0])
+        np.sin(x * da, out=xy[:, 1])
+        x.flags.writeable = False
+        xy.flags.writeable = False
+        entry = [0, (x, xy)]
+        _UNIT_ARC_TABLES[key] = entry
+    entry[0] = next(_UNIT_ARC_TABLES_CLOCK)
+    return entry[1]
+
+
+def _unit_arc_to_xy(table, a, r):
+    # Rotates a unit_arc_table by a and scales it by r, which is either a number or an array with one radius per row
+    x, xy = table
+    c = math.cos(a)
+    s = math.sin(a)
+    retval = np.dot(xy, np.array([[c, s], [-s, c]]))
+    if isinstance(r, np.ndarray):
+        retval *= r[:, np.newaxis]
+    else:
+        retval *= r
+    return retval
+
+
+def apx_arc_through_polars_array(p1, p2, resolution=math.pi/60., steps=None, max_error=None, **kwargs):
+    # Returns a (N, 2) array of (angle, radius) rows. The number of steps is, in order of precedence, the given one,
+    # the least that keeps the chords within max_error from the arc, or the one given by the angular resolution.
+    a1, r1 = _as_polar_pair(p1)
+    a2, r2 = _as_polar_pair(p2)
+    dr = r2 - r1
+    da = _shortest_angle(a1, a2)
+    steps, resolution = _arc_steps(max(r1, r2), da, resolution, steps, max_error)
+    x = apx_unit_interval_array(steps=steps, resolution=resolution, **kwargs)
+    retval = np.empty((len(x), 2))
+    retval[:, 0] = a1 + x * da
+    retval[:, 1] = r1 + x * dr
+    return retval
+
+
+def apx_arc_through_polars_xy_array(p1, p2, resolution=math.pi/60., steps=None, max_error=None, **kwargs):
+    # Same as polar_array_to_xy(apx_arc_through_polars_array(...)), out of a unit_arc_table
+    a1, r1 = _as_polar_pair(p1)
+    a2, r2 = _as_polar_pair(p2)
+    da = _shortest_angle(a1, a2)
+    steps, resolution = _arc_steps(max(r1, r2), da, resolution, steps, max_error)
+    table = unit_arc_table(da, steps=steps, resolution=resolution, **kwargs)
+    return _unit_arc_to_xy(table, a1, r1 + table[0] * (r2 - r1) if r1 != r2 else r1)
 
 
 def apx_arc_through_polars(p1, p2, resolution=math.pi/60., steps=None, **kwargs):
     if not (isinstance(p1, Polar) and isinstance(p2, Polar)):
         raise TypeError()
-    dr = p2.r - p1.r
-    da = p1.angle_to(p2)
-    if steps is None and resolution is not None and abs(da) > math.pi / 3600.:
-        steps = int(math.ceil(abs(da / resolution)))
-        resolution = None
-    for x in apx_unit_interval(steps=steps, resolution=resolution, **kwargs):
-        yield Polar(p1.a + x * da, p1.r + x * dr)
+    for a, r in apx_arc_through_polars_array(p1, p2, resolution=resolution, steps=steps, **kwargs):
+        yield Polar(float(a), float(r))
+
+
+def apx_arc_array(p, da, resolution=math.pi/60., steps=None, max_error=None, **kwargs):
+    # Returns a (N, 2) array of (angle, radius) rows, steps are chosen as in apx_arc_through_polars_array
+    if isinstance(p, Polar):
+        a, r = p.a, p.r
+    else:
+        a, r = p
+    steps, resolution = _arc_steps(r, da, resolution, steps, max_error)
+    x = apx_unit_interval_array(steps=steps, resolution=resolution, **kwargs)
+    retval = np.empty((len(x), 2))
+    retval[:, 0] = a + x * da
+    retval[:, 1] = r
+    return retval
+
+
+def apx_arc_xy_array(p, da, resolution=math.pi/60., steps=None, max_error=None, **kwargs):
+    # Same as polar_array_to_xy(apx_arc_array(...)), out of a unit_arc_table
+    if isinstance(p, Polar):
+        a, r = p.a, p.r
+    else:
+        a, r = p
+    steps, resolution = _arc_steps(r, da, resolution, steps, max_error)
+    return _unit_arc_to_xy(unit_arc_table(da, steps=steps, resolution=resolution, **kwargs), a, r)
 
 
 def apx_arc(p, da, resolution=math.pi/60., steps=None, **kwargs):
     if not isinstance(p, Polar):
         raise TypeError()
-    if steps is None and resolution is not None and abs(da) > math.pi / 3600.:
-        steps = int(math.ceil(abs(da / resolution)))
-        resolution = None
-    for x in apx_unit_interval(steps=steps, resolution=resolution, **kwargs):
-        yield Polar(p.a + x * da, p.r)
+    for a, r in apx_arc_array(p, da, resolution=resolution, steps=steps, **kwargs):
+        yield Polar(float(a), float(r))
 
 
 def normalize_angle(a):
@@ -304,22 +457,85 @@ def normalize_angle(a):
     return a if a >= 0. else a + 2. * math.pi
 
 
-def apx_crown_sector(a1, a2, inner_r, outer_r, shift1=0., shift2=0., **kwargs):
-    # Compute the inner and outer polar points
-    inner = [Polar(a1, inner_r), Polar(a2, inner_r)]
-    outer = [Polar(a1, outer_r), Polar(a2, outer_r)]
-    # Apply the shifts
-    if shift1 != 0.:
-        inner[0] = inner[0].shift_along_tangent(shift1, True)
-        outer[0] = outer[0].shift_along_tangent(shift1, True)
-    if shift2 != 0.:
-        inner[1] = inner[1].shift_along_tangent(shift2, True)
-        outer[1] = outer[1].shift_along_tangent(shift2, True)
-    assert(inner[0].r == inner[1].r == inner_r)
-    assert(outer[0].r == outer[1].r == outer_r)
+def polar_array_to_xy(polars):
+    # (N, 2) array of (angle, radius) rows to a (N, 2) array of (x, y) rows
+    polars = np.asarray(polars, dtype=float).reshape(-1, 2)
+    retval = np.empty_like(polars)
+    np.cos(polars[:, 0], out=retval[:, 0])
+    np.sin(polars[:, 0], out=retval[:, 1])
+    retval *= polars[:, 1:2]
+    return retval
+
+
+def xy_array_to_polar(xy):
+    # (N, 2) array of (x, y) rows to a (N, 2) array of (angle, radius) rows, angles in [0, 2pi)
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    retval = np.empty_like(xy)
+    np.arctan2(xy[:, 1], xy[:, 0], out=retval[:, 0])
+    retval[:, 0] %= 2. * math.pi
+    np.hypot(xy[:, 0], xy[:, 1], out=retval[:, 1])
+    return retval
+
+
+def rotation_matrix(angle):
+    # Counterclockwise rotation around the origin, for rotate_xy_array and rotate_point
+    c = math.cos(angle)
+    s = math.sin(angle)
+    return np.array([[c, -s], [s, c]])
+
+
+def rotate_xy_array(xy, matrix):
+    # (N, 2) array of (x, y) rows rotated by a rotation_matrix, in one go
+    return np.dot(np.asarray(xy, dtype=float).reshape(-1, 2), matrix.T)
+
+
+def rotate_point(pt, matrix):
+    return Point(float(matrix[0, 0] * pt.x + matrix[0, 1] * pt.y), float(matrix[1, 0] * pt.x + matrix[1, 1] * pt.y))
+
+
+def points_to_array(points):
+    # Accepts either an array-like of (x, y) rows or an iterable of objects with x and y attributes
+    if isinstance(points, np.ndarray):
+        retval = np.ascontiguousarray(points, dtype=float)
+    else:
+        points = list(points)
+        if len(points) > 0 and not hasattr(points[0], 'x'):
+            retval = np.array(points, dtype=float)
+        else:
+            retval = np.array([(pt.x, pt.y) for pt in points], dtype=float)
+    return retval.reshape(-1, 2)
+
+
+def array_to_points(xy):
+    return [Point(float(x), float(y)) for x, y in xy]
+
+
+def _apx_crown_sector_endpoints(a1, a2, inner_r, outer_r, shift1, shift2):
+    # (angle, radius) of the inner and outer endpoints. Shifting along the tangent while maintaining the radius is a
+    # rotation by asin(shift / radius), see Polar.shift_along_tangent
+    inner = [(a1 - math.asin(shift1 / inner_r), inner_r), (a2 - math.asin(shift2 / inner_r), inner_r)]
+    outer = [(a1 - math.asin(shift1 / outer_r), outer_r), (a2 - math.asin(shift2 / outer_r), outer_r)]
+    return inner, outer
+
+
+def apx_crown_sector_array(a1, a2, inner_r, outer_r, shift1=0., shift2=0., **kwargs):
+    # Returns a (N, 2) array of (angle, radius) rows
+    inner, outer = _apx_crown_sector_endpoints(a1, a2, inner_r, outer_r, shift1, shift2)
+    kwargs['skip_start'] = False
+    kwargs['include_end'] = True
+    return np.concatenate((apx_arc_through_polars_array(inner[0], inner[1], **kwargs),
+                           apx_arc_through_polars_array(outer[1], outer[0], **kwargs)))
+
+
+def apx_crown_sector_xy_array(a1, a2, inner_r, outer_r, shift1=0., shift2=0., **kwargs):
+    # Same as polar_array_to_xy(apx_crown_sector_array(...)), out of unit_arc_table's
+    inner, outer = _apx_crown_sector_endpoints(a1, a2, inner_r, outer_r, shift1, shift2)
     kwargs['skip_start'] = False
     kwargs['include_end'] = True
-    for x in apx_arc_through_polars(inner[0], inner[1], **kwargs):
-        yield x  # yield from would be handy
-    for x in apx_arc_through_polars(outer[1], outer[0], **kwargs):
-        yield x  # Another fake yield from
+    return np.concatenate((apx_arc_through_polars_xy_array(inner[0], inner[1], **kwargs),
+                           apx_arc_through_polars_xy_array(outer[1], outer[0], **kwargs)))
+
+
+def apx_crown_sector(a1, a2, inner_r, outer_r, shift1=0., shift2=0., **kwargs):
+    for a, r in apx_crown_sector_array(a1, a2, inner_r, outer_r, shift1, shift2, **kwargs):
+        yield Polar(float(a), float(r))
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+from contextlib import contextmanager
+from pcbapi import pcbnew, PCBNEW
+import cad
+import io
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    # There is none on Windows, peak memory is then not reported
+    resource = None
+
+
+def board_metrics(board):
+    # Arcs are not tessellated just to count their vertices
+    metrics = dict(tracks=0, segments=0, arcs=0, vias=0, fills=0, fill_vertices=0, routed_nets=0)
+    for net in board.netlist.values():
+        for trk in net.tracks:
+            if isinstance(trk, cad.Via):
+                metrics['vias'] += 1
+            elif isinstance(trk, cad.ArcTrack):
+                metrics['tracks'] += 1
+                metrics['arcs'] += 1
+            else:
+                metrics['tracks'] += 1
+                metrics['segments'] += max(0, len(trk.vertices) - 1)
+        metrics['fills'] += len(net.fills)
+        metrics['fill_vertices'] += sum(len(fill.vertices) for fill in net.fills)
+        if net.flag_routed:
+            metrics['routed_nets'] += 1
+    return metrics
+
+
+def _peak_memory():
+    # Peak resident memory of the process so far, in kilobytes (ru_maxrss is in bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if os.uname()[0] == 'Darwin' else peak
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _pcbnew_calls():
+    # Only the counting stand-in keeps track of them
+    return sum(pcbnew.CALLS.values()) if PCBNEW == 'counting' else None
+
+
+class StageProfiler(object):
+    # Records wall and CPU time, peak memory and pcbnew calls of each stage it is given, along with the board metrics
+    # at the end of the stage. Disabled profilers just run the stages.
+
+    @contextmanager
+    def stage(self, name, board=None):
+        if not self.enabled:
+            yield
+            return
+        calls = _pcbnew_calls()
+        peak = _peak_memory()
+        cpu = _cpu_time()
+        wall = time.time()
+        yield
+        record = dict(name=name, wall=time.time() - wall, cpu=_cpu_time() - cpu, peak_memory=_peak_memory())
+        # The peak is process wide, a stage that grows it shows how much it asked for on top of the previous ones
+        record['peak_memory_growth'] = record['peak_memory'] - peak if peak is not None else None
+        record['pcbnew_calls'] = _pcbnew_calls() - calls if calls is not None else None
+        if board is not None:
+            record.update(board_metrics(board))
+        self.stages.append(record)
+
+    def report(self):
+        total = dict(wall=sum(record['wall'] for record in self.stages),
+                     cpu=sum(record['cpu'] for record in self.stages))
+        peaks = [record['peak_memory'] for record in self.stages if record['peak_memory'] is not None]
+        total['peak_memory'] = max(peaks) if len(peaks) > 0 else None
+        calls = [record['pcbnew_calls'] for record in self.stages if record['pcbnew_calls'] is not None]
+        total['pcbnew_calls'] = sum(calls) if len(calls) > 0 else None
+        return dict(stages=self.stages, total=total)
+
+    def summary(self):
+        # E.g. '1.45s wall, 1.40s cpu, peak 85MB, 1816 pcbnew calls; slowest ToPCB.apply 0.61s (42%); 127 tracks (36
+        # arcs), 24 fills, 0 vias, 3710 vertices'
+        if len(self.stages) == 0:
+            return 'No stages profiled.'
+        report = self.report()
+        total = report['total']
+        retval = '%.2fs wall, %.2fs cpu' % (total['wall'], total['cpu'])
+        if total['peak_memory'] is not None:
+            retval += ', peak %dMB' % (total['peak_memory'] // 1024)
+        if total['pcbnew_calls'] is not None:
+            retval += ', %d pcbnew calls' % total['pcbnew_calls']
+        slowest = max(self.stages, key=lambda record: record['wall'])
+        retval += '; slowest %s %.2fs (%d%%)' % (slowest['name'], slowest['wall'],
+                                                  100. * slowest['wall'] / max(total['wall'], 1e-9))
+        last = next((record for record in reversed(self.stages) if 'tracks' in record), None)
+        if last is not None:
+            retval += '; %d tracks (%d arcs), %d fills, %d vias, %d vertices' % (
+                last['tracks'], last['arcs'], last['fills'], last['vias'], last['segments'] + last['fill_vertices'])
+        return retval
+
+    def write(self, path):
+        with io.open(path, 'w', encoding='utf-8') as stream:
+            stream.write(json.dumps(self.report(), indent=2, sort_keys=True, ensure_ascii=False) + '\n')
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
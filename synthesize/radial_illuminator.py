@@ -1,10 +1,17 @@
 from __future__ import unicode_literals, print_function
+from collections import namedtuple
 from pcb import ToPCB, FromPCB
-from cad import Component, Track, Fill, Via, Layer, Terminal
-from polar import Polar, apx_arc_through_polars, normalize_angle, Chord, apx_crown_sector, Point
+from cad import Component, Track, ArcTrack, Fill, Via, Layer, Terminal, NetType
+from polar import Polar, normalize_angle, Chord, apx_crown_sector_xy_array, Point, rotation_matrix, rotate_point
+from pcbapi import FromMM, pcbnew
+from profiling import StageProfiler
+from simplify import simplify_tracks
+from snapshot import SnapshotCache
+import copy
 import math
-import pcbnew
+import os
 import sys
+import weakref
 
 # Thanks https://stackoverflow.com/a/23689767/1749822
 class dotdict(dict):
@@ -12,6 +19,10 @@ class dotdict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
+    def __deepcopy__(self, memo):
+        # Needed because any missing attribute, __deepcopy__ included, reads as None
+        return dotdict((k, copy.deepcopy(v, memo)) for k, v in self.items())
+
 
 OPT = dotdict(
     lines=dotdict(
@@ -19,29 +30,43 @@ OPT = dotdict(
         n_leds=2,
         led_orient=math.pi,
         res_orient=0.,
-        radius=pcbnew.FromMM(25.),
+        radius=FromMM(25.),
         pad_on_circ=True,
         led_pfx='LED',
         res_pfx='R',
         separator=True
     ),
     rings=dotdict(
-        pwr_radius=pcbnew.FromMM(28.),
-        gnd_radius=pcbnew.FromMM(22.)
+        pwr_radius=FromMM(28.),
+        gnd_radius=FromMM(22.)
     ),
     pours=dotdict(
         parallel_to_comp=False,
-        inner_radius=pcbnew.FromMM(23.5),
-        outer_radius=pcbnew.FromMM(26.5)
+        inner_radius=FromMM(23.5),
+        outer_radius=FromMM(26.5)
     ),
-    track_width=pcbnew.FromMM(1.),
-    via_diam=pcbnew.FromMM(1.),
-    via_drill_diam=pcbnew.FromMM(0.4),
+    track_width=FromMM(1.),
+    # Maximum distance between an arc and the segments approximating it
+    arc_max_error=FromMM(0.025),
+    via_diam=FromMM(1.),
+    via_drill_diam=FromMM(0.4),
     connector='J0',
-    mosfet='Q0'
+    mosfet='Q0',
+    # Test points can be on any net, the synthesis leaves them out and where they are
+    test_point_pfx='TP',
+    # Synthesize line 0 only and copy it, rotated, onto the other lines, see LineSymmetry
+    symmetric=False,
+    # Chain and simplify the tracks once routed, merging points this close; None to leave them as routed
+    simplify_tolerance=FromMM(0.001),
+    # Fill the zones when saving to pcbnew; batch exports can leave that to pcbnew
+    fill_zones=True
 )
 
-OPT.lines.n_comps = OPT.lines.n_lines * (OPT.lines.n_leds + 1)
+# What compute_ring_angles returns: the gap between lines, the angle between components, where the first line starts,
+# and how far past their pads the connections to the supply rings and the supply pours reach
+RingAngles = namedtuple('RingAngles', ['separator_spanned_angle', 'angle_step', 'init_angle', 'rings_overhang',
+                                       'pours_overhang'])
+
 OPT.lines.led_ref = lambda line_idx, led_idx: '%s%d' % (OPT.lines.led_pfx, line_idx * OPT.lines.n_leds + led_idx)
 OPT.lines.res_ref = lambda line_idx: '%s%d' % (OPT.lines.res_pfx, line_idx)
 
@@ -55,45 +80,175 @@ def get_lines(board, component_only):
             yield comp if component_only else (comp, True)
 
 
+def get_nets(board, net_type):
+    # Nets of board of the given NetType; the nets are classified on first use, and again only if the options that
+    # tell components apart change
+    board.classify_nets(OPT.lines.led_pfx, OPT.lines.res_pfx, (OPT.connector, OPT.mosfet), OPT.test_point_pfx)
+    return board.nets_by_type[net_type]
+
+
+def lay_out_lines(lines, spanned_angles, init_angle, angle_step, separator_spanned_angle):
+    # Angle of the center of each component in lines, by name. lines yields (component, is LED) in order around the
+    # circle, each line starting with its resistor.
+    angle = init_angle
+    retval = {}
+    for comp, is_led in lines:
+        if not is_led and OPT.lines.separator:
+            angle += separator_spanned_angle + angle_step
+        # Center on the spanned angle (here is where we assume that the two pads are symmetric)
+        angle += spanned_angles[comp.name] / 2.
+        retval[comp.name] = angle
+        angle += angle_step + spanned_angles[comp.name] / 2.
+    return retval
+
+
+def get_line_angles(board):
+    # Angle of the center of each component of the lines, by name
+    return lay_out_lines(get_lines(board, False), OPT.lines.spanned_angles, OPT.lines.init_angle, OPT.lines.angle_step,
+                         OPT.lines.separator_spanned_angle)
+
+
+class LineSymmetry(object):
+    # The lines are all the same, rotated around the origin. With OPT.symmetric, stages synthesize line 0 and copy what
+    # they produced onto line k rotated by angles[k], with a rotation matrix computed once per line, instead of
+    # computing chords, arcs and sectors all over again. Only used if the lines are interchangeable: same footprints,
+    # same spanned angles and nets that map onto each other.
+
+    def template(self, comp):
+        # (line index, counterpart on line 0) of a component of the lines, None for anything else
+        return self._templates.get(comp.name)
+
+    def template_terminal(self, terminal):
+        # (line index, counterpart on line 0) of a terminal on a line component, provided the counterpart is in the
+        # same net; None otherwise
+        template = self.template(terminal.component)
+        if template is None:
+            return None
+        line_idx, comp = template
+        pad = comp.pads.get(terminal.pad.name)
+        if pad is None or pad.connected_to is not terminal.pad.connected_to:
+            return None
+        return line_idx, Terminal(comp, pad)
+
+    def template_net(self, net):
+        # (line index, counterpart on line 0) of a net that lies entirely on some line other than line 0, None if
+        # there is no such thing. The terminals must match in order too, since that is the direction of the tracks.
+        mapped = []
+        for t in net.terminals:
+            template = self.template(t.component)
+            if template is None or template[0] == 0 or template[0] != self.template(net.terminals[0].component)[0]:
+                return None
+            mapped.append((template[1], t.pad.name))
+        if len(mapped) == 0:
+            return None
+        comp, pad_name = mapped[0]
+        template_net = comp.pads[pad_name].connected_to
+        if template_net is None or [(t.component.name, t.pad.name) for t in template_net.terminals] != \
+                [(comp.name, pad_name) for comp, pad_name in mapped]:
+            return None
+        return self.template(net.terminals[0].component)[0], template_net
+
+    def rotated(self, item, line_idx):
+        return item.rotated(self.angles[line_idx], self.matrices[line_idx])
+
+    def place(self, comp):
+        line_idx, template = self._templates[comp.name]
+        comp.orientation = template.orientation + self.angles[line_idx]
+        comp.position = rotate_point(template.position, self.matrices[line_idx])
+        comp.flag_placed = True
+
+    @staticmethod
+    def _same_pads(comp1, comp2):
+        # Footprints are shared exactly by the components whose pads are the same
+        return comp1.flipped == comp2.flipped and comp1.footprint is comp2.footprint
+
+    @staticmethod
+    def _key():
+        # Everything of OPT that the placement of the lines depends on
+        return (OPT.lines.n_lines, OPT.lines.n_leds, OPT.lines.led_pfx, OPT.lines.res_pfx, OPT.lines.init_angle,
+                OPT.lines.angle_step, OPT.lines.separator, OPT.lines.separator_spanned_angle,
+                tuple(sorted(OPT.lines.spanned_angles.items())))
+
+    @classmethod
+    def of(cls, board):
+        # The symmetry of the lines on board, or None if OPT.symmetric is off or the lines are not interchangeable.
+        # Every stage asks for it, but it changes only with the geometry.
+        if not OPT.symmetric or OPT.lines.n_lines < 2:
+            return None
+        key = cls._key()
+        if board in _LINE_SYMMETRIES and _LINE_SYMMETRIES[board][0] == key:
+            return _LINE_SYMMETRIES[board][1]
+        lines = [[OPT.lines.res_ref(line_idx)] + [OPT.lines.led_ref(line_idx, led_idx)
+                                                  for led_idx in range(OPT.lines.n_leds)]
+                 for line_idx in range(OPT.lines.n_lines)]
+        interchangeable = all(OPT.lines.spanned_angles[name] == OPT.lines.spanned_angles[template_name] and
+                              cls._same_pads(board.components[name], board.components[template_name])
+                              for line in lines[1:] for name, template_name in zip(line, lines[0]))
+        retval = cls(board, lines) if interchangeable else None
+        _LINE_SYMMETRIES[board] = (key, retval)
+        return retval
+
+    def __init__(self, board, lines):
+        # Holds no reference to board, which keys _LINE_SYMMETRIES weakly
+        line_angles = get_line_angles(board)
+        self.angles = [line_angles[line[0]] - line_angles[lines[0][0]] for line in lines]
+        self.matrices = list(map(rotation_matrix, self.angles))
+        self._templates = {name: (line_idx, board.components[template_name])
+                           for line_idx, line in enumerate(lines) for name, template_name in zip(line, lines[0])}
+
+
+# LineSymmetry.of of each board, along with the LineSymmetry._key it was computed for
+_LINE_SYMMETRIES = weakref.WeakKeyDictionary()
+
+
 def place_lines(board):
-    angle = OPT.lines.init_angle
     place = Component.place_pads_on_circ if OPT.lines.pad_on_circ else Component.place_radial
+    symmetry = LineSymmetry.of(board)
+    angles = get_line_angles(board)
+    # Line 0 comes first, the copies always find it in place
     for comp, is_led in get_lines(board, False):
-        if not is_led and OPT.lines.separator:
-            angle += OPT.lines.separator_spanned_angle + OPT.lines.angle_step
-        # Center on the spanned angle (here is where we assume that the two pads are symmetric)
-        angle += OPT.lines.spanned_angles[comp.name] / 2.
-        place(comp, angle, OPT.lines.radius, orientation=OPT.lines.led_orient if is_led else OPT.lines.res_orient)
-        angle += OPT.lines.angle_step + OPT.lines.spanned_angles[comp.name] / 2.
+        if symmetry is not None and symmetry.template(comp)[0] > 0:
+            symmetry.place(comp)
+        else:
+            place(comp, angles[comp.name], OPT.lines.radius,
+                  orientation=OPT.lines.led_orient if is_led else OPT.lines.res_orient)
 
 
 def route_led_lines(board):
-    for net in board.netlist.values():
-        if len(net.terminals) != 2:
-            continue
+    symmetry = LineSymmetry.of(board)
+    copies = []
+    for net in get_nets(board, NetType.LED_STRIP):
         if net.terminals[0].component.flag_placed and net.terminals[1].component.flag_placed:
             del net.tracks[:]
-            net.route_arc()
+            template = symmetry.template_net(net) if symmetry is not None else None
+            if template is None:
+                net.route_arc(max_error=OPT.arc_max_error)
+            else:
+                copies.append((net, template))
+    # Once line 0 is routed
+    for net, (line_idx, template) in copies:
+        net.tracks.extend(symmetry.rotated(trk, line_idx) for trk in template.tracks)
+        net.flag_routed = True
 
 
 def route_rings(board, **kwargs):
+    symmetry = LineSymmetry.of(board)
+    kwargs.setdefault('max_error', OPT.arc_max_error)
     kwargs['skip_start'] = False
     kwargs['include_end'] = True
-    for net in board.netlist.values():
-        if net.flag_routed or len(net.terminals) != OPT.lines.n_lines + 1:
+    for net in get_nets(board, NetType.GROUND) + get_nets(board, NetType.POWER):
+        # The ring nets have one terminal per line, plus one towards the connector or the MOSFET, and maybe test points
+        if net.flag_routed or sum(net.terminal_counts) != OPT.lines.n_lines + 1:
             continue
-        # Check if this has n LED or ring terminals
-        cnt_led = len(filter(lambda x: x.component.name.startswith(OPT.lines.led_pfx) and x.component.flag_placed,
-                             net.terminals))
-        cnt_res = len(filter(lambda x: x.component.name.startswith(OPT.lines.res_pfx) and x.component.flag_placed,
-                             net.terminals))
-        if cnt_res == 0 and cnt_led == OPT.lines.n_lines:
-            # Ok that's one of the two ring nets.
+        # A ring net, once every line is placed: n_lines placed LEDs for ground, n_lines placed resistors for power
+        placed = [t.component.name for t in net.terminals if t.component.flag_placed]
+        if net.net_type is NetType.GROUND and \
+                sum(1 for name in placed if name.startswith(OPT.lines.led_pfx)) == OPT.lines.n_lines:
             OPT.rings.gnd_net = net.name
             radius = OPT.rings.gnd_radius
             overhang = OPT.rings.overhang
-        elif cnt_res == OPT.lines.n_lines and cnt_led == 0:
-            # Ok that's one of the two ring nets.
+        elif net.net_type is NetType.POWER and \
+                sum(1 for name in placed if name.startswith(OPT.lines.res_pfx)) == OPT.lines.n_lines:
             OPT.rings.pwr_net = net.name
             radius = OPT.rings.pwr_radius
             overhang = -OPT.rings.overhang
@@ -101,64 +256,96 @@ def route_rings(board, **kwargs):
             continue
         del net.tracks[:]
         intersection_angles = []
+        connections = {}
         for t in filter(lambda x: x.component.flag_placed, net.terminals):
-            # Get the pad position
-            term_pol = t.position.to_polar()
-            # Decide the endpoint for the arc
-            arc_endpt = Polar(term_pol.a + overhang, term_pol.r)
-            # Draw an arc to that point
-            net.tracks.append(Track(map(Polar.to_point, apx_arc_through_polars(term_pol, arc_endpt, **kwargs))))
-            # Draw a segment down to the given radius
-            net.tracks.append(Track([arc_endpt.to_point(), Polar(arc_endpt.a, radius).to_point()]))
-            # Angle at which it intersects the ring
-            intersection_angles.append(arc_endpt.a)
+            template = symmetry.template_terminal(t) if symmetry is not None else None
+            if template is None:
+                tracks, angle = connect_to_ring(t, overhang, radius, **kwargs)
+            else:
+                line_idx, template_t = template
+                key = (template_t.component.name, template_t.pad.name)
+                if key not in connections:
+                    connections[key] = connect_to_ring(template_t, overhang, radius, **kwargs)
+                tracks, angle = connections[key]
+                if line_idx > 0:
+                    tracks = [symmetry.rotated(trk, line_idx) for trk in tracks]
+                    angle += symmetry.angles[line_idx]
+            net.tracks.extend(tracks)
+            intersection_angles.append(angle)
         # Ok now join all the pieces. Add all pieces at multiples of 15 degrees so that we can attach at several angles
         intersection_angles += list(map(lambda x: float(x) * math.pi / 6., range(24)))
-        intersection_angles = list(sorted(map(normalize_angle, intersection_angles)))
-        # Ok pairwise arcs
-        p1 = Polar(intersection_angles[-1], radius)
-        for angle in intersection_angles:
-            p2 = Polar(angle, radius)
-            net.tracks.append(Track(map(Polar.to_point, apx_arc_through_polars(p1, p2, **kwargs))))
-            p1 = p2
-
-
-def compute_lines_spanned_angles(board):
-    # Compute how many radians do the resistor and the LED's pad span
-    def get_spanned_angle(comp):
-        c = Chord(OPT.lines.radius, 0., 0.).with_length(comp.get_pads_distance())
+        net.tracks.extend(ring_arcs(intersection_angles, radius, **kwargs))
+
+
+def connect_to_ring(t, overhang, radius, **kwargs):
+    # Get the pad position
+    term_pol = t.position.to_polar()
+    # Decide the endpoint for the arc
+    arc_endpt = Polar(term_pol.a + overhang, term_pol.r)
+    # Draw an arc to that point, then a segment down to the given radius. Also return the angle at which it intersects
+    # the ring
+    return [ArcTrack.through_polars(term_pol, arc_endpt, **kwargs),
+            Track([arc_endpt.to_point(), Polar(arc_endpt.a, radius).to_point()])], arc_endpt.a
+
+
+def ring_arcs(angles, radius, **kwargs):
+    # The whole circle of the given radius, as arcs between consecutive angles
+    angles = list(sorted(map(normalize_angle, angles)))
+    # Ok pairwise arcs
+    retval = []
+    p1 = Polar(angles[-1], radius)
+    for angle in angles:
+        p2 = Polar(angle, radius)
+        retval.append(ArcTrack.through_polars(p1, p2, **kwargs))
+        p1 = p2
+    return retval
+
+
+def get_spanned_angle(comp, radius):
+    # Compute how many radians do the pads of a resistor or a LED span on a circle of the given radius. That only
+    # depends on the footprint: it is computed once for all the LEDs and once for all the resistors.
+    def compute():
+        c = Chord(radius, 0., 0.).with_length(comp.get_pads_distance())
         # We make the assumption that the center is at the... center
-        if abs(comp.pads.values()[0].offset.l2() - comp.pads.values()[1].offset.l2()) > 0.001:
-            print(('Component will be misaligned because %s has two pads which are not symmetric.' % comp.name),
-                  file=sys.stderr)
+        if not comp.footprint.has_symmetric_pads(*comp.pads.keys()):
+            print(('Components like %s will be misaligned because they have two pads which are not symmetric.' %
+                   comp.name), file=sys.stderr)
         if not OPT.lines.pad_on_circ:
-            c = c.with_distance_to_origin(OPT.lines.radius)
+            c = c.with_distance_to_origin(radius)
         return c.aperture
-    return {comp.name: get_spanned_angle(comp) for comp in get_lines(board, True)}
+    return comp.footprint.cached(('spanned_angle', radius, OPT.lines.pad_on_circ), compute)
+
+
+def compute_lines_spanned_angles(board):
+    return {comp.name: get_spanned_angle(comp, OPT.lines.radius) for comp in get_lines(board, True)}
 
 
 def add_copper_pours(board):
-    for net in board.netlist.values():
-        if not net.flag_routed or len(net.terminals) != 2:
+    symmetry = LineSymmetry.of(board)
+    copies = []
+    for net in get_nets(board, NetType.LED_STRIP):
+        if not net.flag_routed:
+            continue
+        del net.fills[:]
+        template = symmetry.template_net(net) if symmetry is not None else None
+        if template is not None:
+            copies.append((net, template))
             continue
         # Add a fill on top of it
-        if OPT.pours.parallel_to_comp:
-            t1, t2 = net.terminals
-            a1 = t1.component.position.to_polar().a
-            a2 = t2.component.position.to_polar().a
-            shift1 = t1.component.get_pad_tangential_distance(t1.pad)
-            shift2 = t2.component.get_pad_tangential_distance(t2.pad)
-        else:
-            a1 = net.terminals[0].position.to_polar().a
-            a2 = net.terminals[1].position.to_polar().a
-            shift1 = 0.
-            shift2 = 0.
-        net.fills.append(Fill(
-            list(map(Polar.to_point, apx_crown_sector(a1, a2, OPT.pours.inner_radius, OPT.pours.outer_radius,
-                                                      shift1, shift2)))))
+        net.fills.append(strip_pour(net, OPT.pours.inner_radius, OPT.pours.outer_radius))
+    # Once line 0 has its pours
+    for net, (line_idx, template) in copies:
+        net.fills.extend(symmetry.rotated(fill, line_idx) for fill in template.fills)
+
+    def pour(t, overhang):
+        return supply_pour(t, overhang, OPT.lines.radius, OPT.lines.angle_step, OPT.pours.overhang,
+                           OPT.pours.inner_radius, OPT.pours.outer_radius)
+
     # Add copper pours for the remaining pads
     for net_name in [OPT.rings.pwr_net, OPT.rings.gnd_net]:
         net = board.netlist[net_name]
+        del net.fills[:]
+        pours = {}
         for t in filter(lambda x: x.component.flag_placed, net.terminals):
             # Which direction is the overhang?
             if t.component.name.startswith(OPT.lines.res_pfx):
@@ -167,23 +354,52 @@ def add_copper_pours(board):
                 overhang = OPT.pours.overhang
             else:
                 continue
-            if OPT.pours.parallel_to_comp:
-                a1 = t.component.position.to_polar().a
-                a2 = t.position.to_polar().a
-                a2 += OPT.lines.angle_step * (0.5 if overhang > 0. else -0.5)
-                shift1 = t.component.get_pad_tangential_distance(t.pad)
-                # Compute how much space is left
-                c = Chord(OPT.lines.radius, OPT.lines.angle_step - 2. * OPT.pours.overhang)
-                c = c.with_distance_to_origin(OPT.lines.radius)
-                shift2 = c.length * (0.5 if overhang > 0. else -0.5)
-            else:
-                a1 = t.position.to_polar().a
-                a2 = a1 + overhang
-                shift1 = 0.
-                shift2 = 0.
-            net.fills.append(Fill(
-                list(map(Polar.to_point, apx_crown_sector(a1, a2, OPT.pours.inner_radius, OPT.pours.outer_radius,
-                                                          shift1, shift2)))))
+            template = symmetry.template_terminal(t) if symmetry is not None else None
+            if template is None:
+                net.fills.append(pour(t, overhang))
+                continue
+            line_idx, template_t = template
+            key = (template_t.component.name, template_t.pad.name)
+            if key not in pours:
+                pours[key] = pour(template_t, overhang)
+            net.fills.append(pours[key] if line_idx == 0 else symmetry.rotated(pours[key], line_idx))
+
+
+def strip_pour(net, inner_radius, outer_radius):
+    # The copper pour between the two terminals of a net along a line
+    if OPT.pours.parallel_to_comp:
+        t1, t2 = net.terminals
+        a1 = t1.component.position.to_polar().a
+        a2 = t2.component.position.to_polar().a
+        shift1 = t1.component.get_pad_tangential_distance(t1.pad)
+        shift2 = t2.component.get_pad_tangential_distance(t2.pad)
+    else:
+        a1 = net.terminals[0].position.to_polar().a
+        a2 = net.terminals[1].position.to_polar().a
+        shift1 = 0.
+        shift2 = 0.
+    return Fill(apx_crown_sector_xy_array(a1, a2, inner_radius, outer_radius, shift1, shift2,
+                                          max_error=OPT.arc_max_error))
+
+
+def supply_pour(t, overhang, radius, angle_step, pours_overhang, inner_radius, outer_radius):
+    # The copper pour from a terminal connected to a supply ring, overhanging in the gap before or after its line
+    if OPT.pours.parallel_to_comp:
+        a1 = t.component.position.to_polar().a
+        a2 = t.position.to_polar().a
+        a2 += angle_step * (0.5 if overhang > 0. else -0.5)
+        shift1 = t.component.get_pad_tangential_distance(t.pad)
+        # Compute how much space is left
+        c = Chord(radius, angle_step - 2. * pours_overhang)
+        c = c.with_distance_to_origin(radius)
+        shift2 = c.length * (0.5 if overhang > 0. else -0.5)
+    else:
+        a1 = t.position.to_polar().a
+        a2 = a1 + overhang
+        shift1 = 0.
+        shift2 = 0.
+    return Fill(apx_crown_sector_xy_array(a1, a2, inner_radius, outer_radius, shift1, shift2,
+                                          max_error=OPT.arc_max_error))
 
 
 class ConnMosfRadiusTranslator(object):
@@ -298,8 +514,8 @@ def negotiate_connector_and_mosfet_position(conn, mosf):
         r_min = max(r_min, lb)
         r_max = min(r_max, ub)
     r = (r_min + r_max) / 2.
-    conn.position.x = r
-    mosf.position.x = OPT.radius_translator.conn_to_mosf(r)
+    conn.position = conn.position.change(x=r)
+    mosf.position = mosf.position.change(x=OPT.radius_translator.conn_to_mosf(r))
     # Get the routing radius now
     rs = [conn.get_pad_position(pad).to_polar().r for pad in conn.pads.values()
           if pad.connected_to.name != OPT.rings.pwr_net]
@@ -334,6 +550,7 @@ def project_on_ring(pt, radius):
 
 
 def route_connector_and_mosfet(board, **kwargs):
+    kwargs.setdefault('max_error', OPT.arc_max_error)
     kwargs['skip_start'] = False
     kwargs['include_end'] = True
     for net_name in OPT.rings.mosf_conn_nets:
@@ -348,10 +565,8 @@ def route_connector_and_mosfet(board, **kwargs):
         if t2_attach_pos != t2_pos:
             net.tracks.append(Track([t2_pos, t2_attach_pos], Layer.B_Cu))
         # Draw a connecting arc
-        net.tracks.append(Track(
-            map(Polar.to_point, apx_arc_through_polars(t1_attach_pos.to_polar(), t2_attach_pos.to_polar(), **kwargs)),
-            Layer.B_Cu
-        ))
+        net.tracks.append(ArcTrack.through_polars(t1_attach_pos.to_polar(), t2_attach_pos.to_polar(),
+                                                  layer=Layer.B_Cu, **kwargs))
         net.flag_routed = True
     # And now add a straight segment and a via for the pwr and gnd stuff
     gnd_net = board.netlist[OPT.rings.gnd_net]
@@ -376,40 +591,58 @@ def route_connector_and_mosfet(board, **kwargs):
     pwr_net.flag_routed = True
 
 
-def setup_geometry(board):
+def setup_defaults():
     # Setup default vias and tracks
     Track.DEFAULT_WIDTH = OPT.track_width
+    ArcTrack.DEFAULT_MAX_ERROR = OPT.arc_max_error
     Via.DEFAULT_DIAMETER = OPT.via_diam
     Via.DEFAULT_DRILL_DIAMETER = OPT.via_drill_diam
     Fill.DEFAULT_FILLET_RADIUS = OPT.track_width / 2.
-    # Compute how much angle is reserved for each component
-    OPT.lines.spanned_angles = compute_lines_spanned_angles(board)
+
+
+def compute_ring_angles(radius, n_lines, n_comps, spanned_angles):
+    # The angular layout of n_lines lines around a circle of the given radius, made of n_comps components in total
+    # which span spanned_angles (by name)
     # Space to leave between pours:
-    OPT.lines.separator_spanned_angle = Chord(OPT.lines.radius, 0., 0.).with_length(OPT.track_width).aperture
+    separator_spanned_angle = Chord(radius, 0., 0.).with_length(OPT.track_width).aperture
     # Space between each components's pads
     if OPT.lines.separator:
         # One extra component: the separator
-        consumed_angle = sum(OPT.lines.spanned_angles.values()) + OPT.lines.n_lines * OPT.lines.separator_spanned_angle
-        OPT.lines.angle_step = (2. * math.pi - consumed_angle) / (OPT.lines.n_comps + OPT.lines.n_lines)
+        consumed_angle = sum(spanned_angles.values()) + n_lines * separator_spanned_angle
+        angle_step = (2. * math.pi - consumed_angle) / (n_comps + n_lines)
     else:
-        OPT.lines.angle_step = (2. * math.pi - sum(OPT.lines.spanned_angles.values())) / OPT.lines.n_comps
+        angle_step = (2. * math.pi - sum(spanned_angles.values())) / n_comps
     # Angular shift to get free space at angle 0
     if OPT.lines.separator:
         # We begin with separators so we need to add negative space
-        OPT.lines.init_angle = -OPT.lines.separator_spanned_angle / 2.
+        init_angle = -separator_spanned_angle / 2.
     else:
-        OPT.lines.init_angle = OPT.lines.angle_step / 2.
+        init_angle = angle_step / 2.
     # Extra segment of wiring overhanging from the pwr (gnd) pad of the resistor (led)
     if OPT.lines.separator:
         # Overhang track rings until 1 track distance from the end of the copper pour
-        OPT.rings.overhang = OPT.lines.angle_step - 1.5 * OPT.lines.separator_spanned_angle
+        rings_overhang = angle_step - 1.5 * separator_spanned_angle
         # Fill until you leave just the separator gap
-        OPT.pours.overhang = OPT.lines.angle_step
+        pours_overhang = angle_step
     else:
         # Overhang track rings by 1/3 of the available space
-        OPT.rings.overhang = OPT.lines.angle_step / 3.
-        # Fill in until leaving 1 track distance @ OPT.lines.radius
-        OPT.pours.overhang = (OPT.lines.angle_step - OPT.lines.separator_spanned_angle) / 2.
+        rings_overhang = angle_step / 3.
+        # Fill in until leaving 1 track distance @ radius
+        pours_overhang = (angle_step - separator_spanned_angle) / 2.
+    return RingAngles(separator_spanned_angle, angle_step, init_angle, rings_overhang, pours_overhang)
+
+
+def setup_geometry(board):
+    OPT.lines.n_comps = OPT.lines.n_lines * (OPT.lines.n_leds + 1)
+    setup_defaults()
+    # Compute how much angle is reserved for each component
+    OPT.lines.spanned_angles = compute_lines_spanned_angles(board)
+    angles = compute_ring_angles(OPT.lines.radius, OPT.lines.n_lines, OPT.lines.n_comps, OPT.lines.spanned_angles)
+    OPT.lines.separator_spanned_angle = angles.separator_spanned_angle
+    OPT.lines.angle_step = angles.angle_step
+    OPT.lines.init_angle = angles.init_angle
+    OPT.rings.overhang = angles.rings_overhang
+    OPT.pours.overhang = angles.pours_overhang
 
 
 def add_mosfet_copper_pours(board):
@@ -431,29 +664,208 @@ def add_mosfet_copper_pours(board):
         else:
             a2 = a1 + OPT.lines.angle_step
         pad.connected_to.fills.append(Fill(
-            list(map(Polar.to_point, apx_crown_sector(a1, a2, inner_radius, outer_radius, shift, 0.))),
+            apx_crown_sector_xy_array(a1, a2, inner_radius, outer_radius, shift, 0., max_error=OPT.arc_max_error),
             layer=Layer.B_Cu))
 
 
-def main():
-    board = FromPCB.populate()
+def apply_overrides(overrides):
+    # Overrides are given as {'rings.pwr_radius': value, ...}
+    for key, value in overrides.items():
+        path = key.split('.')
+        opt = OPT
+        for name in path[:-1]:
+            if not isinstance(opt.get(name), dict):
+                raise KeyError(key)
+            opt = opt[name]
+        if path[-1] not in opt:
+            raise KeyError(key)
+        opt[path[-1]] = value
+
+
+# Each stage declares the OPT keys it reads and writes, and the board entities (prefixed with @) it depends on or
+# produces. IncrementalSynthesis uses these to rerun only what is affected by a change.
+Stage = namedtuple('Stage', ['func', 'reads', 'writes'])
+
+STAGES = [
     # Compute all the angular values according to the selected geometry
-    setup_geometry(board)
+    Stage(setup_geometry,
+          reads=('lines.n_lines', 'lines.n_leds', 'lines.led_pfx', 'lines.res_pfx', 'lines.radius',
+                 'lines.pad_on_circ', 'lines.separator', 'track_width', 'arc_max_error', 'via_diam',
+                 'via_drill_diam'),
+          writes=('lines.n_comps', 'lines.spanned_angles', 'lines.separator_spanned_angle', 'lines.angle_step',
+                  'lines.init_angle', 'rings.overhang', 'pours.overhang')),
     # Place all leds and resistors in F.Cu
-    place_lines(board)
+    Stage(place_lines,
+          reads=('lines.n_lines', 'lines.n_leds', 'lines.led_pfx', 'lines.res_pfx', 'lines.init_angle',
+                 'lines.pad_on_circ', 'lines.separator', 'lines.separator_spanned_angle', 'lines.angle_step',
+                 'lines.spanned_angles', 'lines.radius', 'lines.led_orient', 'lines.res_orient', 'symmetric'),
+          writes=('@placement',)),
     # Connect adjacent pads on F.Cu
-    route_led_lines(board)
+    Stage(route_led_lines,
+          reads=('@placement', 'track_width', 'arc_max_error', 'lines.led_pfx', 'lines.res_pfx', 'connector', 'mosfet',
+                 'test_point_pfx', 'symmetric'),
+          writes=('@led_tracks',)),
     # Bring power to the resistor and ground from the LEDs onto two other concentric rings
-    route_rings(board)
+    Stage(route_rings,
+          reads=('@placement', '@led_tracks', 'track_width', 'arc_max_error', 'lines.n_lines', 'lines.led_pfx',
+                 'lines.res_pfx', 'connector', 'mosfet', 'test_point_pfx', 'rings.gnd_radius', 'rings.pwr_radius',
+                 'rings.overhang', 'symmetric'),
+          writes=('@ring_tracks', 'rings.gnd_net', 'rings.pwr_net')),
     # Add copper pours on the front face
-    add_copper_pours(board)
+    Stage(add_copper_pours,
+          reads=('@placement', '@led_tracks', 'track_width', 'arc_max_error', 'lines.led_pfx', 'lines.res_pfx',
+                 'connector', 'mosfet', 'test_point_pfx', 'lines.radius', 'lines.angle_step', 'rings.gnd_net',
+                 'rings.pwr_net', 'pours.parallel_to_comp', 'pours.inner_radius', 'pours.outer_radius',
+                 'pours.overhang', 'symmetric'),
+          writes=('@fills',)),
+]
+
+
+def get_option(key):
+    opt = OPT
+    for name in key.split('.'):
+        opt = opt.get(name) if isinstance(opt, dict) else None
+    return opt
+
+
+def synthesize(board, profiler=None, stages=None):
+    # Runs stages, STAGES by default, on board
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+    for stage in stages if stages is not None else STAGES:
+        with profiler.stage(stage.func.__name__, board):
+            stage.func(board)
+    # Not a stage: it rewrites what every stage made. IncrementalSynthesis puts the tracks back before rerunning any
+    if OPT.simplify_tolerance is not None:
+        with profiler.stage('simplify_tracks', board):
+            simplify_tracks(board, OPT.simplify_tolerance)
+
+
+class IncrementalSynthesis(object):
+    # Runs STAGES on a board, and on subsequent runs reruns only the stages whose inputs changed. The tracks and fills
+    # produced by a stage that is not rerun are kept as they are. As synthesize does, the tracks are simplified at the
+    # end; the tracks as the stages left them are kept aside, so that they can be undone stage by stage later.
+    def _snapshot_options(self, keys):
+        return {key: copy.deepcopy(get_option(key)) for key in keys if not key.startswith('@')}
+
+    def _snapshot_items(self):
+        return {(net.name, attr): set(map(id, getattr(net, attr)))
+                for net in self.board.netlist.values() for attr in ('tracks', 'fills')}
+
+    def _undo(self, stage):
+        # Remove whatever the previous run of this stage added and is still on the board
+        for net_name, attr, items in self._outputs.pop(stage, []):
+            net = self.board.netlist.get(net_name)
+            if net is not None:
+                ids = set(map(id, items))
+                getattr(net, attr)[:] = [x for x in getattr(net, attr) if id(x) not in ids]
+
+    def _is_dirty(self, stage, changed):
+        if stage not in self._inputs:
+            return True
+        return any(key in changed for key in stage.reads) or self._snapshot_options(stage.reads) != self._inputs[stage]
+
+    def _unsimplify(self):
+        for net_name, tracks in self._unsimplified.items():
+            net = self.board.netlist.get(net_name)
+            if net is not None:
+                net.tracks[:] = tracks
+        self._unsimplified = {}
+
+    def run(self, profiler=None):
+        # Returns the names of the stages that were run, simplify_tracks included
+        if profiler is None:
+            profiler = StageProfiler(enabled=False)
+        changed = set()
+        retval = []
+        for stage in self.stages:
+            if not self._is_dirty(stage, changed):
+                continue
+            # Stages are undone and recorded on the tracks as they made them
+            self._unsimplify()
+            self._undo(stage)
+            inputs = self._snapshot_options(stage.reads)
+            outputs = self._snapshot_options(stage.writes)
+            before = self._snapshot_items()
+            with profiler.stage(stage.func.__name__, self.board):
+                stage.func(self.board)
+            # Record what the stage added, net by net
+            self._outputs[stage] = []
+            for net in self.board.netlist.values():
+                for attr in ('tracks', 'fills'):
+                    old_ids = before.get((net.name, attr), set())
+                    added = [x for x in getattr(net, attr) if id(x) not in old_ids]
+                    if len(added) > 0:
+                        self._outputs[stage].append((net.name, attr, added))
+            self._inputs[stage] = inputs
+            # Entities are always considered changed, options only if their value did
+            changed.update(key for key in stage.writes if key.startswith('@'))
+            changed.update(key for key, value in self._snapshot_options(stage.writes).items()
+                           if value != outputs[key])
+            retval.append(stage.func.__name__)
+        if len(retval) > 0 or OPT.simplify_tolerance != self._simplify_tolerance:
+            self._unsimplify()
+            if OPT.simplify_tolerance is not None:
+                # simplify_tracks replaces the track lists without touching the tracks, so keeping the lists is enough
+                self._unsimplified = {net.name: list(net.tracks) for net in self.board.netlist.values()}
+                with profiler.stage('simplify_tracks', self.board):
+                    simplify_tracks(self.board, OPT.simplify_tolerance)
+                retval.append('simplify_tracks')
+            self._simplify_tolerance = OPT.simplify_tolerance
+        return retval
+
+    def __init__(self, board, stages=None):
+        self.board = board
+        self.stages = list(stages) if stages is not None else list(STAGES)
+        self._inputs = {}
+        self._outputs = {}
+        self._unsimplified = {}
+        self._simplify_tolerance = None
+
+
+# The IncrementalSynthesis that main() keeps for each board opened in pcbnew, by file name, with the modules, tracks and
+# zones that the board counted right after main() last saved to it
+_RUNNERS = {}
+
+
+def _pcbnew_counts(pcb_board):
+    return (sum(1 for _ in pcb_board.GetModules()), sum(1 for _ in pcb_board.GetTracks()), pcb_board.GetAreaCount())
+
+
+def main(stages=None):
+    # Synthesizes the board in pcbnew with stages, STAGES by default. With RATCAM_PROFILE set to a path, every stage
+    # is timed and measured, and a JSON report is written there. With RATCAM_SNAPSHOTS set to a folder, the board is
+    # extracted from pcbnew only when its file changes, and loaded from a snapshot kept in there otherwise.
+    # Within a session, e.g. from the KiCad console after changing OPT, main() reruns only the stages affected by the
+    # change. The board is extracted again if it is not the one main() saved to last, i.e. if its modules, tracks or
+    # zones went up or down in number since; edits by hand that keep those numbers go unnoticed.
+    profile_path = os.environ.get('RATCAM_PROFILE')
+    snapshots_path = os.environ.get('RATCAM_SNAPSHOTS')
+    profiler = StageProfiler(enabled=profile_path is not None)
+    pcb_board = pcbnew.GetBoard()
+    runner_key = (pcb_board.GetFileName(), tuple(stages) if stages is not None else None)
+    runner, counts = _RUNNERS.pop(runner_key, (None, None))
+    if runner is None or counts != _pcbnew_counts(pcb_board):
+        with profiler.stage('FromPCB.populate'):
+            if snapshots_path is not None:
+                board = SnapshotCache(snapshots_path).populate_pcbnew()
+            else:
+                board = FromPCB.populate()
+        runner = IncrementalSynthesis(board, stages)
+    runner.run(profiler)
+    board = runner.board
     # Place smartly J0 and Q0
     # place_connector_and_mosfet(board)
     # Add the metal on B.Cu
     # route_connector_and_mosfet(board)
     # add_mosfet_copper_pours(board)
-    # Save
-    ToPCB.apply(board)
+    # Save, touching only what changed since the last run
+    with profiler.stage('ToPCB.apply', board):
+        ToPCB.apply(board, incremental=True, fill_zones=OPT.fill_zones)
+    _RUNNERS[runner_key] = (runner, _pcbnew_counts(pcb_board))
+    if profile_path is not None:
+        profiler.write(profile_path)
+        print(profiler.summary(), file=sys.stderr)
 
 
 if __name__ == '__main__':
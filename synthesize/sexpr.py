@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+import re
+
+try:
+    _text_type = unicode
+except NameError:
+    _text_type = str
+
+
+OPEN = '('
+CLOSE = ')'
+ATOM = 'atom'
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))', re.UNICODE)
+_UNESCAPE_RE = re.compile(r'\\(.)', re.UNICODE)
+_NEEDS_QUOTES_RE = re.compile(r'[\s()"\\]', re.UNICODE)
+
+
+class Quoted(_text_type):
+    # An atom that was enclosed in double quotes in the source; quote() quotes it back
+    pass
+
+
+def tokenize(stream):
+    # Yields (offset, kind, value) for every token in a text stream, one line at a time. Offsets are in characters
+    # from the beginning of the stream; kind is one of OPEN, CLOSE, ATOM.
+    offset = 0
+    buf = ''
+    for line in stream:
+        buf += line
+        pos = 0
+        while True:
+            m = _TOKEN_RE.match(buf, pos)
+            if m is None:
+                break
+            pos = m.end()
+            if m.group(1) is not None:
+                yield offset + m.start(1), OPEN, None
+            elif m.group(2) is not None:
+                yield offset + m.start(2), CLOSE, None
+            elif m.group(3) is not None:
+                yield offset + m.start(3) - 1, ATOM, Quoted(_UNESCAPE_RE.sub(r'\1', m.group(3)))
+            else:
+                yield offset + m.start(4), ATOM, m.group(4)
+        if buf[pos:].strip():
+            # A quoted string spanning more than one line, keep it for the next round
+            offset += pos
+            buf = buf[pos:]
+        else:
+            offset += len(buf)
+            buf = ''
+    if buf.strip():
+        raise ValueError('Unterminated string at offset %d.' % offset)
+
+
+def iter_nodes(stream, depth=1):
+    # Streams the nodes found at the given depth (the root node is at depth 0) as (parents, node, start, end), where
+    # parents is the tuple of the heads of the enclosing nodes and [start, end) is the span of the node in the
+    # stream. Enclosing nodes only retain their leading atoms, so memory stays bounded by the largest yielded node.
+    stack = []
+    for offset, kind, value in tokenize(stream):
+        if kind is OPEN:
+            stack.append(([], offset))
+        elif kind is CLOSE:
+            if len(stack) == 0:
+                raise ValueError('Unbalanced parenthesis at offset %d.' % offset)
+            node, start = stack.pop()
+            if len(stack) == depth:
+                yield tuple(parent[0][0] if len(parent[0]) > 0 else None for parent in stack), node, start, offset + 1
+            elif len(stack) > depth:
+                stack[-1][0].append(node)
+        elif len(stack) > depth or (len(stack) > 0 and len(stack[-1][0]) == 0):
+            stack[-1][0].append(value)
+    if len(stack) > 0:
+        raise ValueError('Unbalanced parenthesis at end of stream.')
+
+
+def parse(stream):
+    # Parses the whole stream and returns the root node
+    for _, node, _, _ in iter_nodes(stream, depth=0):
+        return node
+    raise ValueError('Empty stream.')
+
+
+def find(node, head):
+    for child in node:
+        if isinstance(child, list) and len(child) > 0 and child[0] == head:
+            return child
+    return None
+
+
+def find_all(node, head):
+    for child in node:
+        if isinstance(child, list) and len(child) > 0 and child[0] == head:
+            yield child
+
+
+def has_atom(node, atom):
+    return any(not isinstance(child, list) and child == atom for child in node[1:])
+
+
+def quote(atom):
+    if not isinstance(atom, Quoted):
+        atom = _text_type(atom)
+        if len(atom) > 0 and _NEEDS_QUOTES_RE.search(atom) is None:
+            return atom
+    return '"%s"' % atom.replace('\\', '\\\\').replace('"', '\\"')
+
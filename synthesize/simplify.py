@@ -0,0 +1,150 @@
+from __future__ import unicode_literals
+from drc import point_segment_distances
+import cad
+import math
+import numpy as np
+
+
+# Points closer than this are the same point, and vertices closer than this to the simplified polyline are dropped;
+# 1um in pcbnew internal units
+DEFAULT_TOLERANCE = 1000.
+# Merged arcs do not grow past a half turn, three points cannot tell a full circle apart from nothing
+MAX_ARC_SWEEP = math.pi
+
+
+def simplify_polyline(xy, tolerance=DEFAULT_TOLERANCE):
+    # Ramer-Douglas-Peucker on a (N, 2) array of x, y: keeps the ends, and drops every vertex that is within tolerance
+    # of the polyline that is left, repeated and collinear vertices included
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if len(xy) < 3:
+        return xy
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xy) - 1)]
+    while len(stack) > 0:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dist, _ = point_segment_distances(xy[first + 1:last], xy[first], xy[last])
+        idx = int(np.argmax(dist))
+        if dist[idx] > tolerance:
+            idx += first + 1
+            keep[idx] = True
+            stack += [(first, idx), (idx, last)]
+    return xy[keep]
+
+
+def _is_polyline(trk):
+    return isinstance(trk, cad.Track) and not isinstance(trk, cad.ArcTrack)
+
+
+def _ends(trk):
+    if isinstance(trk, cad.ArcTrack):
+        return (trk.start.x, trk.start.y), (trk.end.x, trk.end.y)
+    return tuple(trk.vertices[0]), tuple(trk.vertices[-1])
+
+
+def _reversed(trk):
+    if isinstance(trk, cad.ArcTrack):
+        return cad.ArcTrack(trk.center, trk.radius, trk.start_angle + trk.angle, -trk.angle, trk.layer,
+                            width=trk.width, **trk.tessellation)
+    return cad.Track(trk.vertices[::-1], trk.layer, width=trk.width)
+
+
+def _joined(trk1, trk2, tolerance):
+    # trk1 followed by trk2, which starts where trk1 ends, as a single track; None if they cannot be one
+    if type(trk1) is not type(trk2) or trk1.layer != trk2.layer or trk1.width != trk2.width:
+        return None
+    if _is_polyline(trk1):
+        return cad.Track(simplify_polyline(np.concatenate((trk1.vertices, trk2.vertices[1:])), tolerance), trk1.layer,
+                         width=trk1.width)
+    if trk1.tessellation != trk2.tessellation or abs(trk1.radius - trk2.radius) > tolerance or \
+            (trk1.center - trk2.center).l2() > tolerance or (trk1.angle > 0.) != (trk2.angle > 0.) or \
+            abs(trk1.angle + trk2.angle) > MAX_ARC_SWEEP:
+        return None
+    return cad.ArcTrack(trk1.center, trk1.radius, trk1.start_angle, trk1.angle + trk2.angle, trk1.layer,
+                        width=trk1.width, **trk1.tessellation)
+
+
+class _Nodes(object):
+    # Snaps points within tolerance of each other onto the same node, through a hashed grid of tolerance sized cells
+    def node(self, pt):
+        cx, cy = int(math.floor(pt[0] / self.tolerance)), int(math.floor(pt[1] / self.tolerance))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for node, x, y in self._cells.get((cx + dx, cy + dy), ()):
+                    if math.hypot(pt[0] - x, pt[1] - y) <= self.tolerance:
+                        return node
+        node = self._count
+        self._count += 1
+        self._cells.setdefault((cx, cy), []).append((node, pt[0], pt[1]))
+        return node
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self._cells = {}
+        self._count = 0
+
+
+def simplify_net(net, tolerance=DEFAULT_TOLERANCE):
+    # Drops the repeated and collinear vertices of every polyline and the tracks that are left with no length, then
+    # chains end to end the tracks of the same kind, layer and width that meet at a point where nothing else does.
+    # Pads and vias are never merged across, so the net connects the same as before.
+    tracks = []
+    for trk in net.tracks:
+        if _is_polyline(trk):
+            if len(trk.vertices) < 2:
+                continue
+            trk = cad.Track(simplify_polyline(trk.vertices, tolerance), trk.layer, width=trk.width)
+            if len(trk.vertices) == 2 and math.hypot(*(trk.vertices[1] - trk.vertices[0])) <= tolerance:
+                continue
+        tracks.append(trk)
+    nodes = _Nodes(tolerance)
+    # Nodes that cannot be merged across, and the (index, is start) of the tracks ending on every other node
+    blocked = set()
+    for t in net.terminals:
+        if isinstance(t.component, cad.Component) and t.component.position is not None:
+            pos = t.position
+            blocked.add(nodes.node((pos.x, pos.y)))
+    for trk in tracks:
+        if isinstance(trk, cad.Via):
+            blocked.add(nodes.node((trk.position.x, trk.position.y)))
+    track_ends = {}
+    for idx, trk in enumerate(tracks):
+        if isinstance(trk, cad.Track):
+            start, end = map(nodes.node, _ends(trk))
+            track_ends.setdefault(start, []).append((idx, True))
+            track_ends.setdefault(end, []).append((idx, False))
+    for node in sorted(track_ends.keys()):
+        if node in blocked or len(track_ends[node]) != 2:
+            continue
+        (idx1, at_start1), (idx2, at_start2) = track_ends[node]
+        if idx1 == idx2:
+            # A loop
+            continue
+        # Orient them so that the first ends on node and the second starts there
+        trk1 = _reversed(tracks[idx1]) if at_start1 else tracks[idx1]
+        trk2 = tracks[idx2] if at_start2 else _reversed(tracks[idx2])
+        joined = _joined(trk1, trk2, tolerance)
+        if joined is None:
+            continue
+        # The joined track takes the place of the first, and the far end of the second now belongs to it
+        tracks[idx1] = joined
+        tracks[idx2] = None
+        del track_ends[node]
+        far_end = nodes.node(_ends(trk2)[1])
+        track_ends[nodes.node(_ends(trk1)[0])].remove((idx1, not at_start1))
+        track_ends[nodes.node(_ends(trk1)[0])].append((idx1, True))
+        track_ends[far_end].remove((idx2, not at_start2))
+        track_ends[far_end].append((idx1, False))
+    net.tracks[:] = [trk for trk in tracks if trk is not None]
+
+
+def simplify_tracks(board, tolerance=DEFAULT_TOLERANCE):
+    # Returns the number of tracks that were dropped or merged away
+    retval = 0
+    for net in board.netlist.values():
+        count = len(net.tracks)
+        simplify_net(net, tolerance)
+        retval += count - len(net.tracks)
+    return retval
@@ -0,0 +1,137 @@
+from __future__ import unicode_literals
+from pcb import FromPCB
+from pcbapi import pcbnew
+from pcbfile import FromPCBFile, FootprintLibrary
+import errno
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+try:
+    # Several times faster than pickle on Python 2
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Bump whenever the cad classes change in a way that old pickles would not load into
+SNAPSHOT_VERSION = 4
+
+
+def _hash_file(digest, path):
+    with io.open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+
+
+def _hash_library(digest, library):
+    # Footprint libraries can be large: they are hashed by the name, size and modification time of their footprints
+    for lib_name in sorted(library.paths.keys()):
+        lib_path = library.paths[lib_name]
+        digest.update(('%s=%s\n' % (lib_name, lib_path)).encode('utf-8'))
+        if not os.path.isdir(lib_path):
+            continue
+        for fp_name in sorted(os.listdir(lib_path)):
+            if fp_name.endswith('.kicad_mod'):
+                stat = os.stat(os.path.join(lib_path, fp_name))
+                digest.update(('%s %d %r\n' % (fp_name, stat.st_size, stat.st_mtime)).encode('utf-8'))
+    # The stock libraries in the search folders are many, and change only with KiCad: the folder of each one will do
+    for search_dir in library.search_dirs:
+        digest.update(('search %s\n' % search_dir).encode('utf-8'))
+        if not os.path.isdir(search_dir):
+            continue
+        for lib_name in sorted(os.listdir(search_dir)):
+            if lib_name.endswith('.pretty'):
+                stat = os.stat(os.path.join(search_dir, lib_name))
+                digest.update(('%s %r\n' % (lib_name, stat.st_mtime)).encode('utf-8'))
+
+
+class SnapshotCache(object):
+    # Populated cad.Board's, pickled in folder and keyed by the hash of the .kicad_pcb they come from and of the
+    # footprint libraries used for it. Loading one is much faster than extracting the board again, whether through
+    # SWIG or by parsing the file.
+
+    def key(self, source, board_path, library=None):
+        # source tells apart boards populated in different ways from the same file, e.g. 'file' or 'pcbnew'
+        digest = hashlib.sha1()
+        digest.update(('%d %d %s\n' % (SNAPSHOT_VERSION, sys.version_info[0], source)).encode('utf-8'))
+        _hash_file(digest, board_path)
+        if library is not None:
+            _hash_library(digest, library)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + '.pickle')
+
+    def load(self, key):
+        # Returns the board stored under key, or None if there is none or it cannot be loaded. A corrupt pickle can
+        # raise just about anything (ValueError, KeyError, IndexError...), and is a miss like any other.
+        try:
+            with io.open(self._path(key), 'rb') as stream:
+                return pickle.load(stream)
+        except Exception:
+            return None
+
+    def store(self, key, board):
+        try:
+            os.makedirs(self.folder)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Written aside and moved in place, so that a concurrent load never sees half a file
+        handle, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                pickle.dump(board, stream, pickle.HIGHEST_PROTOCOL)
+            try:
+                os.rename(tmp_path, self._path(key))
+            except OSError:
+                # Windows does not rename onto an existing file. Another process may have stored or removed the same
+                # snapshot meanwhile, either way the target is gone or about to be replaced.
+                try:
+                    os.remove(self._path(key))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                os.rename(tmp_path, self._path(key))
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def populate_file(self, board_path, library=None):
+        # Cached FromPCBFile.populate
+        if library is None:
+            library = FootprintLibrary.from_project(os.path.dirname(os.path.abspath(board_path)))
+        key = self.key('file', board_path, library)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        board = FromPCBFile.populate(board_path, library=library)
+        self.store(key, board)
+        return board
+
+    def populate_pcbnew(self):
+        # Cached FromPCB.populate. The board in pcbnew can differ from its file without being saved, e.g. after
+        # ToPCB.apply, so snapshots are also keyed by how many modules, tracks and zones it has. Unsaved edits by hand
+        # that keep those numbers go unnoticed: leave the cache off while editing.
+        pcb_board = pcbnew.GetBoard()
+        board_path = pcb_board.GetFileName()
+        if not board_path or not os.path.isfile(board_path):
+            return FromPCB.populate()
+        counts = '%d modules, %d tracks, %d zones' % (sum(1 for _ in pcb_board.GetModules()),
+                                                      sum(1 for _ in pcb_board.GetTracks()), pcb_board.GetAreaCount())
+        key = self.key('pcbnew ' + counts, board_path)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        board = FromPCB.populate()
+        self.store(key, board)
+        return board
+
+    def __init__(self, folder):
+        self.folder = folder
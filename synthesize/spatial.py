@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+import math
+import numpy as np
+
+
+# 1mm in pcbnew internal units, about the size of a pad
+DEFAULT_CELL_SIZE = 1000000.
+
+
+def segments_bounding_boxes(vertices, margin=0.):
+    # (N, 4) array of xmin, ymin, xmax, ymax for each segment of a polyline, grown by margin on every side
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+    if len(vertices) < 2:
+        vertices = np.concatenate((vertices, vertices))
+    retval = np.empty((len(vertices) - 1, 4))
+    np.minimum(vertices[:-1], vertices[1:], out=retval[:, :2])
+    np.maximum(vertices[:-1], vertices[1:], out=retval[:, 2:])
+    retval[:, :2] -= margin
+    retval[:, 2:] += margin
+    return retval
+
+
+def polygon_bounding_box(vertices, margin=0.):
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+    return np.concatenate((vertices.min(axis=0) - margin, vertices.max(axis=0) + margin)).reshape(1, 4)
+
+
+def point_bounding_box(x, y, half_dx, half_dy):
+    return np.array([[x - half_dx, y - half_dy, x + half_dx, y + half_dy]])
+
+
+class GridIndex(object):
+    # Uniform grid over bounding boxes. Every object is stored with one or more boxes (e.g. one per track segment) and
+    # is listed in each cell that any of its boxes touches. Queries are answered on the boxes only, it is up to the
+    # caller to refine them with the exact geometry.
+
+    def _cells_of(self, box):
+        ix0, iy0 = int(math.floor(box[0] / self.cell_size)), int(math.floor(box[1] / self.cell_size))
+        ix1, iy1 = int(math.floor(box[2] / self.cell_size)), int(math.floor(box[3] / self.cell_size))
+        for ix in range(ix0, ix1 + 1):
+            for iy in range(iy0, iy1 + 1):
+                yield ix, iy
+
+    def insert(self, obj, boxes, owner=None):
+        # Inserting an object that is already there replaces its boxes
+        if obj in self._boxes:
+            self.remove(obj)
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self._boxes[obj] = boxes
+        self._owners[obj] = owner
+        for box in boxes:
+            for cell in self._cells_of(box):
+                self._cells.setdefault(cell, set()).add(obj)
+
+    def remove(self, obj):
+        boxes = self._boxes.pop(obj, None)
+        if boxes is None:
+            return
+        del self._owners[obj]
+        for box in boxes:
+            for cell in self._cells_of(box):
+                objs = self._cells.get(cell)
+                if objs is not None:
+                    objs.discard(obj)
+                    if len(objs) == 0:
+                        del self._cells[cell]
+
+    def owner(self, obj):
+        return self._owners.get(obj)
+
+    def boxes(self, obj):
+        return self._boxes.get(obj)
+
+    def query(self, xmin, ymin, xmax, ymax):
+        # Objects with at least one box overlapping the given one
+        candidates = set()
+        for cell in self._cells_of((xmin, ymin, xmax, ymax)):
+            candidates.update(self._cells.get(cell, ()))
+        retval = []
+        for obj in candidates:
+            boxes = self._boxes[obj]
+            if np.any((boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) & (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin)):
+                retval.append(obj)
+        return retval
+
+    def near(self, point, distance):
+        # Objects with at least one box closer than distance to point (along each axis)
+        return self.query(point.x - distance, point.y - distance, point.x + distance, point.y + distance)
+
+    def overlapping(self, obj, margin=0.):
+        # Other objects with at least one box overlapping one of the boxes of obj, grown by margin
+        retval = set()
+        for box in self._boxes[obj]:
+            retval.update(self.query(box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin))
+        retval.discard(obj)
+        return list(retval)
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __contains__(self, obj):
+        return obj in self._boxes
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        self._boxes = {}
+        self._owners = {}
@@ -0,0 +1,176 @@
+from __future__ import unicode_literals, print_function
+# The sweep only reads and writes .kicad_pcb files, it never loads pcbnew and so does not need KiCad at all
+from pcbfile import FromPCBFile, ToPCBFile, IU_PER_MM
+from snapshot import SnapshotCache
+import cad
+import connectivity
+import drc
+import profiling
+import radial_illuminator
+import argparse
+import ast
+import copy
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import sys
+import time
+
+
+# Per-process state, set up once by _init_worker
+_WORKER = {}
+
+
+def grid(axes):
+    # axes is {'lines.n_lines': [4, 6, 8], 'rings.pwr_radius': [...], ...}; returns the cartesian product as a list of
+    # overrides dictionaries
+    keys = sorted(axes.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[axes[key] for key in keys])]
+
+
+def random_sample(ranges, n, seed=None):
+    # ranges is {'lines.radius': (min, max), 'lines.n_leds': [1, 2, 3], ...}: tuples are sampled uniformly, lists are
+    # sampled as a choice
+    rng = random.Random(seed)
+    keys = sorted(ranges.keys())
+    retval = []
+    for _ in range(n):
+        overrides = {}
+        for key in keys:
+            if isinstance(ranges[key], tuple):
+                overrides[key] = rng.uniform(*ranges[key])
+            else:
+                overrides[key] = rng.choice(ranges[key])
+        retval.append(overrides)
+    return retval
+
+
+def _init_worker(board_path, output_dir, min_clearance, check_connectivity, snapshots_path):
+    # Parse the board only once per process, every variant then starts from an unpickled copy. Errors are reported
+    # by each variant: raising here would make the pool respawn the worker forever.
+    _WORKER['board_path'] = board_path
+    _WORKER['output_dir'] = output_dir
+    _WORKER['min_clearance'] = min_clearance
+    _WORKER['check_connectivity'] = check_connectivity
+    _WORKER['error'] = None
+    try:
+        if snapshots_path is not None:
+            board = SnapshotCache(snapshots_path).populate_file(board_path)
+        else:
+            board = FromPCBFile.populate(board_path)
+        _WORKER['board'] = pickle.dumps(board, pickle.HIGHEST_PROTOCOL)
+        _WORKER['opt'] = copy.deepcopy(radial_illuminator.OPT)
+    except Exception as e:
+        _WORKER['error'] = '%s: %s' % (e.__class__.__name__, str(e))
+
+
+def _run_variant(args):
+    idx, overrides = args
+    result = dict(index=idx, overrides=overrides, error=None)
+    start = time.time()
+    try:
+        if _WORKER['error'] is not None:
+            raise RuntimeError('Worker initialization failed: ' + _WORKER['error'])
+        radial_illuminator.OPT.clear()
+        radial_illuminator.OPT.update(copy.deepcopy(_WORKER['opt']))
+        radial_illuminator.apply_overrides(overrides)
+        board = pickle.loads(_WORKER['board'])
+        radial_illuminator.synthesize(board)
+        result.update(profiling.board_metrics(board))
+        if _WORKER['min_clearance'] is not None:
+            violations = drc.check_clearances(board, _WORKER['min_clearance'])
+            result['violations'] = len(violations)
+            result['worst_clearance'] = violations[0].distance if len(violations) > 0 else None
+        if _WORKER['check_connectivity']:
+            result['disconnected_nets'] = sorted(d.net.name for d in connectivity.check_connectivity(board))
+        # Variants that fail the checks are not worth writing
+        if _WORKER['output_dir'] is not None and result.get('violations', 0) == 0 and \
+                len(result.get('disconnected_nets', ())) == 0:
+            result['output'] = os.path.join(_WORKER['output_dir'], 'variant_%04d.kicad_pcb' % idx)
+            ToPCBFile.write(board, _WORKER['board_path'], result['output'])
+    except Exception as e:
+        result['error'] = '%s: %s' % (e.__class__.__name__, str(e))
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def sweep(variants, board_path, processes=None, output_dir=None, chunksize=None, min_clearance=None,
+          check_connectivity=False, snapshots_path=None):
+    # Runs the synthesis pipeline on each overrides dictionary in variants, across a pool of processes. Returns one
+    # metrics dictionary per variant, in the same order. With min_clearance, each variant is also checked with
+    # drc.check_clearances and the number of violations is reported; with check_connectivity, the nets that
+    # connectivity.check_connectivity finds broken are listed. With snapshots_path, the board is parsed only if it
+    # changed since the last sweep, see SnapshotCache.
+    variants = list(variants)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunksize is None:
+        # A few chunks per process balances the load without flooding the queue
+        chunksize = max(1, int(math.ceil(len(variants) / (4. * processes))))
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(board_path, output_dir, min_clearance, check_connectivity, snapshots_path))
+    try:
+        results = list(pool.imap_unordered(_run_variant, enumerate(variants), chunksize))
+    finally:
+        pool.close()
+        pool.join()
+    return sorted(results, key=lambda result: result['index'])
+
+
+def _parse_value(value):
+    # Lengths can be given in millimeters as '25mm'; anything else is a Python literal
+    if value.endswith('mm'):
+        return float(value[:-2]) * IU_PER_MM
+    return ast.literal_eval(value)
+
+
+def _parse_axis(arg):
+    key, _, values = arg.partition('=')
+    if ':' in values:
+        lo, hi = values.split(':')
+        return key, (_parse_value(lo), _parse_value(hi))
+    return key, [_parse_value(value) for value in values.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the radial illuminator synthesis over a set of OPT overrides.')
+    parser.add_argument('board', help='Source .kicad_pcb file.')
+    parser.add_argument('axes', nargs='+', metavar='KEY=VALUES',
+                        help='E.g. lines.n_leds=1,2,3 or rings.pwr_radius=27mm:30mm (range, random sampling only).')
+    parser.add_argument('--random', type=int, default=None, metavar='N', help='Sample N variants instead of a grid.')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output-dir', default=None, help='Write every variant as a .kicad_pcb file in here.')
+    parser.add_argument('--min-clearance', type=_parse_value, default=None,
+                        help='Check clearances between nets, e.g. 0.2mm; variants that fail are not written.')
+    parser.add_argument('--check-connectivity', action='store_true',
+                        help='Check that the copper joins the terminals of each net; variants that fail are not '
+                             'written.')
+    parser.add_argument('--snapshots', default=None, metavar='DIR',
+                        help='Keep the parsed board in here, and reuse it until the board or its footprints change.')
+    args = parser.parse_args(argv)
+    axes = dict(map(_parse_axis, args.axes))
+    if args.random is not None:
+        variants = random_sample(axes, args.random, args.seed)
+    elif any(isinstance(values, tuple) for values in axes.values()):
+        parser.error('Ranges can only be used with --random.')
+    else:
+        variants = grid(axes)
+    start = time.time()
+    results = sweep(variants, args.board, processes=args.processes, output_dir=args.output_dir,
+                    min_clearance=args.min_clearance, check_connectivity=args.check_connectivity,
+                    snapshots_path=args.snapshots)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print()
+    print('%d variants (%d failed) in %.2fs.' % (len(results), sum(1 for r in results if r['error'] is not None),
+                                                time.time() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
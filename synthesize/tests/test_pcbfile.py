@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+# Round trips through ToPCBFile and FromPCBFile. Run from the synthesize folder with
+#   python -m unittest discover -s tests
+from pcbfile import FromPCBFile, ToPCBFile, FootprintLibrary, ARC_TRACKS_VERSION
+from polar import Point, Vector, normalize_angle
+import cad
+import io
+import math
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+SMALL_BOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'small.kicad_pcb')
+# Coordinates are written in millimeters with 6 decimals
+TOLERANCE = 2.
+MIRRORED_LAYERS = {cad.Layer.F_Cu: cad.Layer.B_Cu, cad.Layer.B_Cu: cad.Layer.F_Cu}
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def populate(self, path):
+        # Pad geometry from the board itself, so that the tests do not depend on the installed libraries
+        return FromPCBFile.populate(path, library=FootprintLibrary())
+
+    def round_trip(self, board, source_path=SMALL_BOARD):
+        dest_path = os.path.join(self.folder, 'out.kicad_pcb')
+        ToPCBFile.write(board, source_path, dest_path)
+        return dest_path, self.populate(dest_path)
+
+    def with_version(self, version):
+        with io.open(SMALL_BOARD, encoding='utf-8') as stream:
+            text = stream.read()
+        path = os.path.join(self.folder, 'version.kicad_pcb')
+        with io.open(path, 'w', encoding='utf-8', newline='\n') as stream:
+            stream.write(re.sub(r'\(version \d+\)', '(version %d)' % version, text, count=1))
+        return path
+
+    def assertPointAlmostEqual(self, first, second):
+        self.assertLessEqual(abs(first.x - second.x), TOLERANCE, (first, second))
+        self.assertLessEqual(abs(first.y - second.y), TOLERANCE, (first, second))
+
+    def assertAngleAlmostEqual(self, first, second):
+        delta = normalize_angle(first - second)
+        self.assertAlmostEqual(min(delta, 2. * math.pi - delta), 0., places=6)
+
+    def assertComponentsEqual(self, board, other):
+        self.assertEqual(sorted(board.components.keys()), sorted(other.components.keys()))
+        for name, comp in board.components.items():
+            other_comp = other.components[name]
+            self.assertEqual(comp.flipped, other_comp.flipped, name)
+            self.assertPointAlmostEqual(comp.position, other_comp.position)
+            self.assertAngleAlmostEqual(comp.orientation, other_comp.orientation)
+            self.assertEqual(sorted(comp.pads.keys()), sorted(other_comp.pads.keys()))
+            for pad_name, pad in comp.pads.items():
+                other_pad = other_comp.pads[pad_name]
+                self.assertEqual(pad.layers, other_pad.layers, (name, pad_name))
+                self.assertPointAlmostEqual(comp.get_pad_position(pad), other_comp.get_pad_position(other_pad))
+
+    def assertTracksEqual(self, tracks, other):
+        # Same kind, layer, width and geometry, in any order
+        def key(trk):
+            if isinstance(trk, cad.Via):
+                return type(trk).__name__, round(trk.position.x), round(trk.position.y)
+            return type(trk).__name__, trk.layer.value, round(trk.width or 0.), round(trk.vertices[0][0])
+        self.assertEqual(len(tracks), len(other))
+        for trk, other_trk in zip(sorted(tracks, key=key), sorted(other, key=key)):
+            self.assertIs(type(trk), type(other_trk))
+            if isinstance(trk, cad.Via):
+                self.assertPointAlmostEqual(trk.position, other_trk.position)
+                self.assertAlmostEqual(trk.diameter, other_trk.diameter)
+                self.assertAlmostEqual(trk.drill_diameter, other_trk.drill_diameter)
+                continue
+            self.assertEqual(trk.layer, other_trk.layer)
+            self.assertAlmostEqual(trk.width, other_trk.width)
+            if isinstance(trk, cad.ArcTrack):
+                for attr in ('start', 'mid', 'end', 'center'):
+                    self.assertPointAlmostEqual(getattr(trk, attr), getattr(other_trk, attr))
+                self.assertAlmostEqual(trk.radius, other_trk.radius, delta=TOLERANCE)
+                self.assertAlmostEqual(trk.angle, other_trk.angle, places=6)
+            else:
+                self.assertEqual(trk.vertices.shape, other_trk.vertices.shape)
+                for (x, y), (other_x, other_y) in zip(trk.vertices.tolist(), other_trk.vertices.tolist()):
+                    self.assertPointAlmostEqual(Point(x, y), Point(other_x, other_y))
+
+    def assertCopperEqual(self, board, other):
+        self.assertEqual(sorted(board.netlist.keys()), sorted(other.netlist.keys()))
+        for name, net in board.netlist.items():
+            other_net = other.netlist[name]
+            self.assertTracksEqual(net.tracks, other_net.tracks)
+            self.assertEqual(len(net.fills), len(other_net.fills))
+            for fill, other_fill in zip(net.fills, other_net.fills):
+                self.assertEqual(fill.layer, other_fill.layer)
+                self.assertEqual(fill.thermal, other_fill.thermal)
+                self.assertAlmostEqual(fill.fillet_radius or 0., other_fill.fillet_radius or 0.)
+                self.assertEqual(fill.vertices.shape, other_fill.vertices.shape)
+                for (x, y), (other_x, other_y) in zip(fill.vertices.tolist(), other_fill.vertices.tolist()):
+                    self.assertPointAlmostEqual(Point(x, y), Point(other_x, other_y))
+
+    def segments(self, tracks, native_arcs):
+        # Tracks as they are read back: one per segment, arcs included unless the file format has them
+        retval = []
+        for trk in tracks:
+            if isinstance(trk, cad.Track) and not (native_arcs and isinstance(trk, cad.ArcTrack)):
+                retval.extend(cad.Track(trk.vertices[i:i + 2], trk.layer, width=trk.width)
+                              for i in range(len(trk.vertices) - 1))
+            else:
+                retval.append(trk)
+        return retval
+
+    def add_copper(self, board):
+        # A bit of everything ToPCBFile writes, on the nets of the modules
+        net = board.netlist['GND']
+        center = board.components['Q0'].position
+        net.tracks.append(cad.Track([center, center + Vector(5e6, 0.), center + Vector(5e6, 3e6)], cad.Layer.B_Cu,
+                                    width=0.5e6))
+        net.tracks.append(cad.Via(center + Vector(5e6, 3e6), diameter=0.8e6, drill_diameter=0.4e6))
+        net.tracks.append(cad.ArcTrack(center, 8e6, 0.25, 1.3, cad.Layer.F_Cu, width=0.7e6, max_error=0.01e6))
+        net.tracks.append(cad.ArcTrack(center, 12e6, -0.5, -2., cad.Layer.B_Cu, width=1e6, max_error=0.01e6))
+        fill = cad.Fill([center + Vector(-3e6, -3e6), center + Vector(3e6, -3e6), center + Vector(0., 4e6)],
+                        cad.Layer.F_Cu, fillet_radius=0.5e6)
+        fill.thermal = True
+        net.fills.append(fill)
+        net.fills.append(cad.Fill([center + Vector(10e6, 10e6), center + Vector(15e6, 10e6),
+                                   center + Vector(15e6, 15e6)], cad.Layer.B_Cu))
+
+    def test_unchanged(self):
+        board = self.populate(SMALL_BOARD)
+        _, other = self.round_trip(board)
+        self.assertComponentsEqual(board, other)
+        self.assertCopperEqual(board, other)
+
+    def test_placement(self):
+        board = self.populate(SMALL_BOARD)
+        for idx, comp in enumerate(sorted(board.components.values(), key=lambda comp: comp.name)):
+            comp.position = comp.position + Vector(1e6 * (idx + 1), -2e6)
+            comp.orientation = normalize_angle(comp.orientation + 0.3 * (idx + 1))
+            # LED0 goes to the back and Q0 to the front, the others stay on their side
+            if idx < 2:
+                comp.flipped = not comp.flipped
+                # Pads keep the layers they were read with, the file gets them mirrored along with the module
+                for pad in comp.pads.values():
+                    pad.layers = [MIRRORED_LAYERS[layer] for layer in pad.layers]
+        self.assertEqual(len(set(comp.flipped for comp in board.components.values())), 2)
+        path, other = self.round_trip(board)
+        self.assertComponentsEqual(board, other)
+        # Put back where they were, they are as in the source
+        source = self.populate(SMALL_BOARD)
+        for name, comp in other.components.items():
+            comp.position = source.components[name].position
+            comp.orientation = source.components[name].orientation
+            comp.flipped = source.components[name].flipped
+        back_path = os.path.join(self.folder, 'back.kicad_pcb')
+        ToPCBFile.write(other, path, back_path)
+        self.assertComponentsEqual(source, self.populate(back_path))
+
+    def test_tessellated_arcs(self):
+        board = self.populate(SMALL_BOARD)
+        self.add_copper(board)
+        path, other = self.round_trip(board)
+        with io.open(path, encoding='utf-8') as stream:
+            self.assertNotIn('(arc ', stream.read())
+        self.assertComponentsEqual(board, other)
+        for name, net in board.netlist.items():
+            self.assertTracksEqual(self.segments(net.tracks, False), other.netlist[name].tracks)
+
+    def test_native_arcs(self):
+        source_path = self.with_version(ARC_TRACKS_VERSION)
+        board = self.populate(source_path)
+        self.add_copper(board)
+        path, other = self.round_trip(board, source_path)
+        with io.open(path, encoding='utf-8') as stream:
+            self.assertEqual(stream.read().count('(arc '), 2)
+        self.assertComponentsEqual(board, other)
+        for name, net in board.netlist.items():
+            self.assertTracksEqual(self.segments(net.tracks, True), other.netlist[name].tracks)
+        # And back again, untouched
+        _, again = self.round_trip(other, path)
+        self.assertCopperEqual(other, again)
+
+    def test_zone_tstamps(self):
+        with io.open(SMALL_BOARD, encoding='utf-8') as stream:
+            source_tstamps = [int(tstamp, 16) for tstamp in re.findall(r'\(tstamp ([0-9A-Fa-f]+)\)', stream.read())]
+        board = self.populate(SMALL_BOARD)
+        self.add_copper(board)
+        path, other = self.round_trip(board)
+        self.assertEqual(sum(len(net.fills) for net in other.netlist.values()), 3)
+        with io.open(path, encoding='utf-8') as stream:
+            text = stream.read()
+        zone_tstamps = [int(tstamp, 16) for tstamp in re.findall(r'\(zone .*\(tstamp ([0-9A-Fa-f]+)\)', text)]
+        self.assertEqual(len(zone_tstamps), 3)
+        self.assertEqual(len(set(zone_tstamps)), 3)
+        self.assertGreater(min(zone_tstamps), max(source_tstamps))
+        # Writing the written file again does not collide with its own tstamps either
+        path, _ = self.round_trip(other, path)
+        with io.open(path, encoding='utf-8') as stream:
+            all_tstamps = re.findall(r'\(tstamp ([0-9A-Fa-f]+)\)', stream.read())
+        self.assertEqual(len(all_tstamps), len(set(all_tstamps)))
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+if __name__ == '__main__':
+    unittest.main()